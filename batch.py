@@ -0,0 +1,191 @@
+# batch.py — run the extractors over whole folders of payslip PDFs on a process pool
+#
+#   uv run batch.py "cedolini/*.pdf" --extractor ocr --workers 32 --out risultati.jsonl
+#   uv run batch.py archivio/ --extractor auto     # template per document, see templates.py
+#
+# Documents are submitted through a bounded window, so at most `--queue` of them are
+# in flight or waiting to be written; results come back in input order and a failing
+# document only produces an error line, the rest of the run goes on.
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+import argparse
+import glob
+import importlib
+import json
+import os
+import sys
+
+import main as ocr
+from ocr_backend import get_backend
+from parallel import map_ordered, default_workers
+from sinks import SINKS, open_sink
+import schema
+import tracing
+
+
+def collect_pdfs(source):
+    # folder, single file or glob pattern ("archivio/**/*.pdf")
+    path = Path(source)
+    if path.is_dir():
+        return sorted(p for p in path.iterdir() if p.suffix.lower() == ".pdf")
+    if path.is_file():
+        return [path]
+    return sorted(Path(p) for p in glob.glob(source, recursive=True) if p.lower().endswith(".pdf"))
+
+
+# modules the extractors import lazily (see bench/startup.py): short runs only pay for what
+# they use, long-lived workers load them all up front with warm_worker()
+WARM_MODULES = ("numpy", "cv2", "PIL.Image", "fitz", "preprocess", "requirements.parse_cedolini", "requirements.pc")
+
+
+def warm_worker():
+    # pool initializer of the service: OCR engine and heavy modules loaded once per worker,
+    # so the first job a worker gets is as fast as the others
+    get_backend()
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+
+
+# --- worker tasks (top-level so they can be pickled) ---
+
+def ocr_document(path, mode="region", dpi=ocr.DPI, batched=False, source="auto", adaptive=False):
+    return ocr.extract_fields(path, mode=mode, dpi=dpi, batched=batched, source=source, adaptive=adaptive)
+
+
+def ocr_field(task, dpi=ocr.DPI, source="auto"):
+    path, key = task
+    return ocr.extract_fields(path, {key: ocr.data_map[key]}, mode="region", dpi=dpi, source=source)[key]
+
+
+def cedolini_document(path):
+    from requirements import parse_cedolini
+    return parse_cedolini.parse_pdf_cached(Path(path))
+
+
+def layout_document(path):
+    from requirements import pc
+    return pc.extract_file_records(str(path))
+
+
+def auto_document(path, mode="region", dpi=ocr.DPI, batched=False, source="auto", adaptive=False):
+    # route by page-1 fingerprint to a registered template, then run only its extractor
+    import templates
+    kwargs = {"mode": mode, "dpi": dpi, "batched": batched, "source": source, "adaptive": adaptive}
+    match, result = templates.route_and_extract(path, **kwargs)
+    return {"template": match.template.key, "extractor": match.template.extractor,
+            "fields" if match.template.extractor == "ocr" else "records": result}
+
+
+EXTRACTORS = {
+    "ocr": ocr_document,
+    "cedolini": cedolini_document,
+    "layout": layout_document,
+    "auto": auto_document,
+}
+
+
+def run_documents(paths, extractor, workers, max_pending, initializer=None):
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer) as executor:
+        yield from map_ordered(executor, extractor, paths, max_pending)
+
+
+def run_fields(paths, fields, workers, max_pending, dpi=ocr.DPI, source="auto"):
+    # one task per (document, field): spreads the fields of a page across the pool too
+    tasks = ((path, key) for path in paths for key in fields)
+    current, values = None, {}
+    # each worker keeps its own OCR engine loaded for the whole run
+    with ProcessPoolExecutor(max_workers=workers, initializer=get_backend) as executor:
+        for (path, key), text, error in map_ordered(executor, partial(ocr_field, dpi=dpi, source=source), tasks, max_pending):
+            if current is not None and path != current:
+                yield current, values, None
+                values = {}
+            current = path
+            if error is not None:
+                values.setdefault("_errors", {})[key] = repr(error)
+            else:
+                values[key] = text
+    if current is not None:
+        yield current, values, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch extraction of payslip PDFs")
+    parser.add_argument("source", help="folder, PDF file or glob pattern")
+    parser.add_argument("--extractor", choices=sorted(EXTRACTORS), default="ocr")
+    parser.add_argument("--workers", type=int, default=default_workers(), help="process pool size")
+    parser.add_argument("--queue", type=int, default=None,
+                        help="max documents in flight (default: 2 x workers)")
+    parser.add_argument("--split-fields", action="store_true",
+                        help="ocr only: submit every data_map field as its own task")
+    parser.add_argument("--shared-pages", type=int, metavar="SLOTS",
+                        help="ocr only: render here into SLOTS shared-memory page buffers, OCR the crops "
+                             "in the pool (memory ~ SLOTS x the largest page at --dpi, 70 MB for A4 at 500)")
+    parser.add_argument("--mode", choices=["region", "page"], default="region", help="ocr render mode")
+    parser.add_argument("--dpi", type=int, default=ocr.DPI)
+    parser.add_argument("--batched", action="store_true", help="ocr: one OCR call per page instead of per field")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="ocr: low dpi first, higher dpi only for low-confidence/invalid fields")
+    parser.add_argument("--source", dest="text_source", choices=["auto", "text", "ocr"], default="auto",
+                        help="ocr: PDF text layer first (auto), text layer only, or always OCR")
+    parser.add_argument("--out", help="JSON-lines output file (default: stdout)")
+    parser.add_argument("--records", help="also one row per payslip, whatever the extractor, in the schema.py "
+                                          "columns: " + "/".join(sorted(SINKS)) + " (format from the extension)")
+    parser.add_argument("--cache", help="SQLite result cache shared by the workers (OCR and cedolini)")
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+    if args.cache:
+        # inherited by the pool workers
+        os.environ["OCR_CACHE"] = os.environ["CEDOLINI_CACHE"] = args.cache
+    tracing.from_args(args)  # likewise TRACE_FILE: every worker appends its spans
+
+    paths = collect_pdfs(args.source)
+    if not paths:
+        raise SystemExit(f"No PDF found: {args.source}")
+    max_pending = args.queue or 2 * args.workers
+
+    if args.extractor == "ocr" and args.shared_pages:
+        import page_buffers
+        results = page_buffers.run_shared(paths, ocr.data_map, args.workers, args.shared_pages, args.dpi,
+                                          args.text_source, max_pending)
+    elif args.extractor == "ocr" and args.split_fields:
+        results = run_fields(paths, ocr.data_map, args.workers, max_pending * len(ocr.data_map), args.dpi,
+                             args.text_source)
+    else:
+        extractor, initializer = EXTRACTORS[args.extractor], None
+        if args.extractor in ("ocr", "auto"):
+            extractor = partial(extractor, mode=args.mode, dpi=args.dpi, batched=args.batched,
+                                source=args.text_source, adaptive=args.adaptive)
+            initializer = get_backend
+        results = run_documents(paths, extractor, args.workers, max_pending, initializer)
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    records = open_sink(args.records, schema.RECORD_COLUMNS) if args.records else None
+    n_ok = n_err = 0
+    try:
+        for path, result, error in results:
+            line = {"source_file": Path(path).name}
+            if error is not None:
+                line["error"] = repr(error)
+                n_err += 1
+            else:
+                if args.extractor == "auto":
+                    line.update(result)
+                else:
+                    line["fields" if args.extractor == "ocr" else "records"] = result
+                n_ok += 1
+            if records is not None and error is None:
+                records.write(schema.records_from_result(result, args.extractor, Path(path).name))
+            out.write(json.dumps(line, ensure_ascii=False, default=schema.json_default) + "\n")
+            out.flush()
+    finally:
+        if records is not None:
+            records.close()
+        if out is not sys.stdout:
+            out.close()
+    print(f"[batch] {n_ok} documents processed, {n_err} failed", file=sys.stderr)
+    tracing.finish(args, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+# bench/corpus.py — synthetic payslip PDFs with known ground truth
+#
+# Three kinds of document, one per extractor:
+#   datamap  values inside the main.py data_map rectangles (page size of example.pdf)
+#   layout   "LABEL" + value at the pc.py LAYOUT_MAP offsets, one employee per page
+#   lul      LUL-style text blocks for parse_cedolini.py, several employees per PDF
+# Every document is written twice: "text" keeps the PDF text layer, "raster" is the
+# same page rendered to an image (a scan without text layer) for the OCR path.
+#
+#     uv run -m bench.corpus bench_corpus/ --docs 50 --seed 1
+#
+# truth.json: {kind: {file name: {"pages": n, "truth": ...}}}, where truth is the
+# expected result of the extractor (data_map dict, pc record, list of LUL records).
+from pathlib import Path
+import argparse
+import json
+import random
+import sys
+
+import fitz  # PyMuPDF
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from validators import MONTHS
+
+KINDS = ("datamap", "layout", "lul")
+VARIANTS = ("text", "raster")
+RASTER_DPI = 300
+
+# pdfminer/pdfplumber put the top of a Helvetica glyph box this far above the baseline
+# (1 + descent of -0.207 em): used to place text by its pdfplumber "top"
+HELV_TOP = 0.793
+
+LAST_NAMES = ["ROSSI", "BIANCHI", "ESPOSITO", "COLOMBO", "RICCI", "MARINO", "GRECO", "BRUNO",
+              "GALLO", "CONTI", "DE LUCA", "MANCINI", "COSTA", "GIORDANO", "RIZZO", "LOMBARDI"]
+FIRST_NAMES = ["MARIO", "GIULIA", "LUCA", "FRANCESCA", "MARCO", "CHIARA", "ANDREA", "SARA",
+               "PAOLO", "ELENA", "DANIELE", "ANNA", "STEFANO", "MARTA"]
+QUALIFICHE = ["Operaio", "Impiegato", "Operai Part-Time", "Apprendista", "Quadro"]
+MANSIONI = ["BARMAN", "CAMERIERE", "CUOCO", "ADDETTO SALA", "MAGAZZINIERE", "RECEPTIONIST"]
+RAPPORTI = ["TEMPO INDETERMINATO", "TEMPO DETERMINATO", "APPRENDISTATO"]
+CONTRATTI = ["CCNL TURISMO PUBBLICI ESERCIZI", "CCNL COMMERCIO TERZIARIO"]
+COMPANIES = ["LOVES SRL", "ALFA SPA", "BETA SNC"]
+PRES_CODES = ["FE", "FT", "A1", "RS", "ROL", "MAL", "INF", "MAT", "PERM", "STRAORD", "FG"]
+CF_MONTHS = "ABCDEHLMPRST"
+
+
+def eu(value):
+    # 1169.62 -> "1.169,62"
+    return f"{value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def fake_cf(rng, last, first):
+    consonants = lambda s: [c for c in s if c.isalpha() and c not in "AEIOU"] + [c for c in s if c in "AEIOU"] + ["X"] * 3
+    return ("".join(consonants(last)[:3]) + "".join(consonants(first)[:3]) + f"{rng.randint(50, 99):02d}"
+            + rng.choice(CF_MONTHS) + f"{rng.randint(1, 71):02d}" + rng.choice("ABCDEFGHLM")
+            + f"{rng.randint(100, 999)}" + rng.choice("ABCDEFGHLMNPRSTUVWXYZ"))
+
+
+def fake_date(rng, first_year, last_year):
+    return f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(first_year, last_year)}"
+
+
+def fake_company(rng):
+    return {"name": rng.choice(COMPANIES), "cf": f"{rng.randint(10**10, 10**11 - 1)}",
+            "month": rng.choice(MONTHS), "year": rng.randint(2021, 2026)}
+
+
+def fake_employee(rng):
+    last, first = rng.choice(LAST_NAMES), rng.choice(FIRST_NAMES)
+    competenze = round(rng.uniform(600, 3500), 2)
+    ritenute_inps = round(competenze * 0.0919, 2)
+    trattenute = round(ritenute_inps + rng.uniform(0, 400), 2)
+    return {
+        "nome": f"{last} {first}",
+        "cf": fake_cf(rng, last, first),
+        "matricola": f"{rng.randint(10**9, 10**10 - 1)}",
+        "qualifica": rng.choice(QUALIFICHE),
+        "mansione": rng.choice(MANSIONI),
+        "livello": str(rng.randint(1, 7)),
+        "rapporto": rng.choice(RAPPORTI),
+        "contratto": rng.choice(CONTRATTI),
+        "assunzione": fake_date(rng, 2005, 2020),
+        "cessazione": fake_date(rng, 2021, 2026) if rng.random() < 0.2 else None,
+        "nascita": fake_date(rng, 1960, 1999),
+        "indirizzo": f"VIA ROMA {rng.randint(1, 200)}",
+        "competenze": competenze,
+        "trattenute": trattenute,
+        "netto": round(competenze - trattenute, 2),
+        "imponibile_inps": round(competenze + rng.uniform(0, 5), 2),
+        "imponibile_fiscale": round(competenze - ritenute_inps, 2),
+        "ritenute_inps": ritenute_inps,
+        "inps_ditta": round(competenze * 0.29, 2),
+        "inail": round(competenze * 0.01, 2),
+        "tfr": round(competenze / 13.5, 2),
+        "quota_tfr": round(rng.uniform(10, 300), 2),
+        "presenze": [rng.choice(PRES_CODES) for _ in range(rng.randint(0, 12))],
+    }
+
+
+def put_text(page, x, top, text, fontsize=7):
+    # top = pdfplumber "top" of the glyph boxes
+    page.insert_text((x, top + HELV_TOP * fontsize), text, fontsize=fontsize, fontname="helv")
+
+
+def fit_fontsize(text, width, height, largest=7):
+    size = min(largest, height * 0.9)
+    length = fitz.get_text_length(text, fontname="helv", fontsize=size)
+    if length > width:
+        size *= width / length
+    return max(size, 3)
+
+
+# --- datamap: main.py data_map rectangles ---
+
+def datamap_values(company, emp):
+    return {
+        "dipendente_nome": emp["nome"], "codice_fiscale": emp["cf"], "matricola_inps": emp["matricola"],
+        "qualifica": emp["qualifica"], "mansione": emp["mansione"], "livello": emp["livello"],
+        "data_assunzione": emp["assunzione"], "data_cessazione": emp["cessazione"] or "",
+        "mese_retribuito": company["month"], "anno": str(company["year"]),
+        "totale_competenze": eu(emp["competenze"]), "totale_trattenute": eu(emp["trattenute"]),
+        "netto_in_busta": eu(emp["netto"]), "imponibile_fiscale": eu(emp["imponibile_fiscale"]),
+        "ritenute_inps": eu(emp["ritenute_inps"]), "tfr_mese": eu(emp["tfr"]),
+    }
+
+
+def write_datamap(doc, company, employees):
+    import main as ocr
+
+    values = datamap_values(company, employees[0])
+    page = doc.new_page(width=595.275, height=841.889)  # A4, as example.pdf
+    put_text(page, 30, 20, f"{company['name']}  CODICE FISCALE {company['cf']}", 8)
+    for key, value in values.items():
+        if not value:
+            continue
+        rect = ocr.bbox_to_rect(ocr.data_map[key]["bbox"])
+        size = fit_fontsize(value, rect.width - 4, rect.height)
+        put_text(page, rect.x0 + 2, rect.y0 + (rect.height - size) / 2, value, size)
+    return values
+
+
+# --- layout: pc.py LAYOUT_MAP, label + value at the learned offset ---
+
+# (label, value key) in two columns; rows 50 pt apart, so no value rectangle reaches
+# the text of another label (value rectangles overlapping their own label are a
+# property of the map and are kept)
+LAYOUT_GRID = [
+    ("AZIENDA", "azienda", "PARTITA IVA", "piva"),
+    ("INDIRIZZO", "indirizzo", "POSIZIONE INAIL", "pos_inail"),
+    ("CONTRATTO APPLICATO", "contratto", "SEDE INAIL", "sede_inail"),
+    ("DIPENDENTE", "nome", "CODICE FISCALE", "cf"),
+    ("QUALIFICA", "qualifica", "MATRICOLA INPS", "matricola"),
+    ("MANSIONE", "mansione", "LIVELLO", "livello"),
+    ("DATA ASSUNZIONE", "assunzione", "DATA CESSAZIONE", "cessazione"),
+    ("DATA DI NASCITA", "nascita", "MESE RETRIBUITO", "mese"),
+    ("TOTALE COMPETENZE", "competenze", "TOTALE RITENUTE", "trattenute"),
+    ("RITENUTE INPS", "ritenute_inps", "IMPONIBILE FISCALE", "imponibile_fiscale"),
+    ("NETTO IN BUSTA", "netto", "TFR DEL MESE", "tfr"),
+]
+LAYOUT_COLUMNS = (90, 400)
+LAYOUT_AMOUNTS = {"competenze", "trattenute", "netto", "imponibile_fiscale", "ritenute_inps", "tfr"}
+
+
+def write_layout(doc, company, employees):
+    from requirements import pc
+
+    truth = []
+    for emp in employees:
+        values = {**emp, "azienda": company["name"][:4], "piva": company["cf"], "pos_inail": "12345678",
+                  "sede_inail": "ROMA", "mese": company["month"]}
+        page = doc.new_page(width=595.275, height=841.889)
+        put_text(page, 90, 30, f"LIBRO UNICO DEL LAVORO {company['month'].upper()} {company['year']}", 9)
+        record = {}
+        for row, cells in enumerate(LAYOUT_GRID):
+            top = 80 + 50 * row
+            for x, (label, key) in zip(LAYOUT_COLUMNS, (cells[:2], cells[2:])):
+                put_text(page, x, top, label)
+                value = values[key]
+                if value is None:
+                    continue
+                text = eu(value) if key in LAYOUT_AMOUNTS else str(value)
+                box = pc.LAYOUT_MAP[label]
+                size = fit_fontsize(text, box["width"] - 2, box["height"] - 1)
+                put_text(page, x + box["offset_x"] + 1, top + box["offset_y"] + (box["height"] - size) / 2, text, size)
+                record[label.lower().replace(" ", "_")] = value
+        record["anno"] = company["year"]
+        truth.append(record)
+    return truth
+
+
+# --- lul: text blocks for the parse_cedolini.py regexes ---
+
+def lul_lines(emp):
+    lines = [
+        f"DIPENDENTE {emp['nome']} QUALIFICA {emp['qualifica']}",
+        f"CODICE FISCALE {emp['cf']}   MATRICOLA INPS {emp['matricola']}",
+        f"MANSIONE {emp['mansione']}",
+        f"LIVELLO {emp['livello']}",
+        f"TIPO RAPPORTO {emp['rapporto']}",
+        f"DATA ASSUNZIONE {emp['assunzione']}",
+    ]
+    if emp["cessazione"]:
+        lines.append(f"DATA CESSAZIONE {emp['cessazione']}")
+    lines += [
+        f"TOTALE COMPETENZE {eu(emp['competenze'])}   TOTALE RITENUTE {eu(emp['trattenute'])}",
+        f"NETTO IN BUSTA {eu(emp['netto'])}",
+        f"TOTALE IMPONIBILE INPS {eu(emp['imponibile_inps'])}   IMPONIBILE FISCALE {eu(emp['imponibile_fiscale'])}",
+        f"RITENUTE INPS {eu(emp['ritenute_inps'])}   INPS DITTA {eu(emp['inps_ditta'])}   INAIL {eu(emp['inail'])}",
+        f"TFR DEL MESE {eu(emp['tfr'])}   QUOTA ANNO TFR {eu(emp['quota_tfr'])}",
+        "PRESENZE " + " ".join(emp["presenze"]),
+    ]
+    return lines
+
+
+def lul_record(company, emp):
+    return {
+        "azienda_denominazione": company["name"], "azienda_cf": company["cf"], "azienda_piva": company["cf"],
+        "mese_retribuito": company["month"], "anno": str(company["year"]),
+        "dipendente_nome": emp["nome"], "dipendente_cf": emp["cf"], "matricola_inps": emp["matricola"],
+        "qualifica": emp["qualifica"], "mansione": emp["mansione"], "livello": emp["livello"],
+        "tipo_rapporto": emp["rapporto"], "data_assunzione": emp["assunzione"], "data_cessazione": emp["cessazione"],
+        "totale_competenze": emp["competenze"], "totale_trattenute": emp["trattenute"], "netto_a_pagare": emp["netto"],
+        "imponibile_previdenziale": emp["imponibile_inps"], "imponibile_fiscale": emp["imponibile_fiscale"],
+        "inps_dip": emp["ritenute_inps"], "inps_azienda": emp["inps_ditta"], "inail_azienda": emp["inail"],
+        "tfr_mese": emp["tfr"], "quota_anno_tfr": emp["quota_tfr"],
+        **{f"occ_{code}": emp["presenze"].count(code) for code in PRES_CODES},
+    }
+
+
+def write_lul(doc, company, employees, per_page=4):
+    header = [f"AZIENDA {company['name']}", f"CODICE FISCALE {company['cf']}   PARTITA IVA {company['cf']}",
+              f"MESE RETRIBUITO {company['month']} {company['year']}"]
+    for start in range(0, len(employees), per_page):
+        page = doc.new_page(width=595.275, height=841.889)
+        y = 40
+        for line in header:
+            put_text(page, 40, y, line, 8)
+            y += 11
+        for emp in employees[start:start + per_page]:
+            y += 22  # blank space between employees: one text block each
+            for line in lul_lines(emp):
+                put_text(page, 40, y, line, 8)
+                y += 11
+    return [lul_record(company, emp) for emp in employees]
+
+
+WRITERS = {"datamap": write_datamap, "layout": write_layout, "lul": write_lul}
+EMPLOYEES = {"datamap": (1, 1), "layout": (1, 3), "lul": (1, 10)}
+
+
+def rasterize(src, dst, dpi=RASTER_DPI):
+    # image-only copy: every page becomes one grayscale picture, no text layer
+    with fitz.open(src) as doc, fitz.open() as out:
+        for page in doc:
+            pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+            new = out.new_page(width=page.rect.width, height=page.rect.height)
+            new.insert_image(new.rect, pixmap=pix)
+        out.save(dst, deflate=True)
+
+
+def generate(out_dir, docs=20, seed=0, kinds=KINDS, raster_dpi=RASTER_DPI):
+    rng = random.Random(seed)
+    out_dir = Path(out_dir)
+    manifest = {}
+    for kind in kinds:
+        for variant in VARIANTS:
+            (out_dir / kind / variant).mkdir(parents=True, exist_ok=True)
+        manifest[kind] = {}
+        for i in range(docs):
+            company = fake_company(rng)
+            employees = [fake_employee(rng) for _ in range(rng.randint(*EMPLOYEES[kind]))]
+            name = f"{kind}_{i:04d}.pdf"
+            text_path = out_dir / kind / "text" / name
+            with fitz.open() as doc:
+                truth = WRITERS[kind](doc, company, employees)
+                pages = doc.page_count
+                doc.save(text_path, deflate=True)
+            rasterize(text_path, out_dir / kind / "raster" / name, raster_dpi)
+            manifest[kind][name] = {"pages": pages, "truth": truth}
+    with open(out_dir / "truth.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    return manifest
+
+
+def load(out_dir):
+    with open(Path(out_dir) / "truth.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate synthetic payslip PDFs with ground truth")
+    ap.add_argument("out", help="output folder")
+    ap.add_argument("--docs", type=int, default=20, help="documents per kind")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--kind", action="append", choices=KINDS, help="repeatable (default: all)")
+    ap.add_argument("--raster-dpi", type=int, default=RASTER_DPI)
+    args = ap.parse_args()
+    manifest = generate(args.out, args.docs, args.seed, tuple(args.kind or KINDS), args.raster_dpi)
+    for kind, files in manifest.items():
+        print(f"{kind:<8} {len(files)} documents, {sum(f['pages'] for f in files.values())} pages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+# bench/run.py — throughput, latency, memory and accuracy of the extractors
+#
+#     uv run -m bench.run --docs 20                          # all suites, checked against bench/thresholds.json
+#     uv run -m bench.run --suite lul --out results.json     # save the numbers ...
+#     uv run -m bench.run --suite lul --baseline results.json --tolerance 0.2   # ... and compare a later run
+#
+# Suites run on the synthetic corpus of bench/corpus.py (generated in a temporary folder,
+# or reused/created with --corpus). Each suite runs in a fresh process, so "peak RSS" is
+# the high-water mark of that extractor alone (imports included). ru_maxrss survives
+# fork + exec, so this process stays small: the corpus is generated and the OCR engine
+# probed in throwaway processes, numpy and PyMuPDF are only imported by the children.
+# Stage latencies come from wrapping the module functions for the duration of the run;
+# the extractors run unmodified. Exit status 1 when a threshold or the baseline
+# comparison fails.
+#
+# bench/thresholds.json holds absolute limits that must hold on any machine (accuracy
+# exactly, speed, memory and p90 latency as loose floors/ceilings, ~10x the typical value
+# so a busy machine does not trip them); --baseline compares with a run saved on the
+# same machine, where --tolerance can be tight. A suite with known wrong fields lists
+# them under "expected_errors": any other field that comes out wrong fails the run even
+# when the overall accuracy stays above min_accuracy.
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+import argparse
+import inspect
+import json
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+THRESHOLDS = Path(__file__).with_name("thresholds.json")
+PERCENTILES = (50, 90, 99)
+
+
+class StageTimer:
+    # with StageTimer() as t: t.wrap(module, "function", "stage") ... -> t.samples[stage] = [seconds]
+    def __init__(self):
+        self.samples = {}
+        self._patched = []
+
+    def wrap(self, owner, attr, stage):
+        original = getattr(owner, attr)
+        samples = self.samples.setdefault(stage, [])
+        if inspect.isgeneratorfunction(original):
+            # time every step of the generator: the work done to produce each item
+            def wrapper(*args, **kwargs):
+                it = original(*args, **kwargs)
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        item = next(it)
+                    except StopIteration:
+                        return
+                    finally:
+                        samples.append(time.perf_counter() - start)
+                    yield item
+        else:
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    samples.append(time.perf_counter() - start)
+        setattr(owner, attr, wrapper)
+        self._patched.append((owner, attr, original))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for owner, attr, original in reversed(self._patched):
+            setattr(owner, attr, original)
+        self._patched.clear()
+
+
+def same(expected, got):
+    if isinstance(expected, float):
+        return isinstance(got, (int, float)) and abs(expected - got) < 0.005
+    if expected is None or expected == "":
+        return got is None or got == ""
+    return got is not None and " ".join(str(got).split()) == " ".join(str(expected).split())
+
+
+def score(expected, got, errors):
+    # field-by-field comparison of one record; missing record = every field wrong
+    ok = 0
+    for field, value in expected.items():
+        if got is not None and same(value, got.get(field)):
+            ok += 1
+        else:
+            errors[field] = errors.get(field, 0) + 1
+    return ok, len(expected)
+
+
+def score_records(expected, got, key, errors):
+    # multi-record documents: records are matched on `key`, not on position
+    by_key = {r.get(key): r for r in got}
+    totals = [score(rec, by_key.get(rec[key]), errors) for rec in expected]
+    return sum(t[0] for t in totals), sum(t[1] for t in totals)
+
+
+# --- suites: (kind, variant, setup) ; setup(timer, options) -> run(path) -> extracted ---
+
+def datamap_suite(source):
+    def setup(timer, options):
+        import main as ocr
+
+        timer.wrap(ocr, "read_text_fields", "text")
+        timer.wrap(ocr, "iter_field_images", "render")
+        timer.wrap(ocr, "preprocess", "preprocess")
+        timer.wrap(ocr, "ocr_field", "ocr")
+        return lambda path: ocr.extract_fields(path, mode=options.get("mode", "region"),
+                                               dpi=options.get("dpi", ocr.DPI), source=source)
+    return setup
+
+
+def layout_setup(timer, options):
+    from requirements import pc
+
+    timer.wrap(pc, "PageIndex", "index")
+    timer.wrap(pc, "extract_data_with_layout", "page")
+    return lambda path: pc.extract_file_records(str(path))
+
+
+def lul_setup(timer, options):
+    from requirements import parse_cedolini
+
+    timer.wrap(parse_cedolini, "iter_page_texts", "text")  # one sample per page
+    timer.wrap(parse_cedolini, "parse_chunk", "chunk")
+    backend = options.get("backend", parse_cedolini.DEFAULT_BACKEND)
+    return lambda path: parse_cedolini.parse_pdf_to_records(path, backend=backend)
+
+
+SUITES = {
+    "datamap-text": ("datamap", "text", datamap_suite("text")),    # main.py, PDF text layer
+    "datamap-ocr": ("datamap", "raster", datamap_suite("auto")),   # main.py on scans: every field OCR'd
+    "layout": ("layout", "text", layout_setup),                    # requirements/pc.py
+    "lul": ("lul", "text", lul_setup),                             # requirements/parse_cedolini.py
+}
+NEEDS_OCR = {"datamap-ocr"}
+
+
+def ocr_available():
+    # the tesseract engine (tesserocr or the pytesseract binary) may be missing
+    try:
+        import numpy as np
+        from ocr_backend import get_backend
+        get_backend().engine.image_to_string(np.full((32, 32), 255, dtype=np.uint8))
+        return True
+    except Exception:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10  # bytes on macOS, KiB on Linux
+
+
+def run_suite(name, corpus_dir, options):
+    # runs in its own process (see main)
+    import numpy as np
+    from bench import corpus
+
+    kind, variant, setup = SUITES[name]
+    manifest = corpus.load(corpus_dir)[kind]
+    with StageTimer() as timer:
+        extract = setup(timer, options)
+        documents, pages, ok, total, errors, failures = [], 0, 0, 0, {}, 0
+        for file_name, info in manifest.items():
+            path = Path(corpus_dir) / kind / variant / file_name
+            start = time.perf_counter()
+            try:
+                got = extract(path)
+            except Exception:
+                got, failures = None, failures + 1
+            documents.append(time.perf_counter() - start)
+            pages += info["pages"]
+            truth = info["truth"]
+            if kind == "datamap":
+                counts = score(truth, got, errors)
+            elif kind == "layout":
+                counts = score_records(truth, got or [], "codice_fiscale", errors)
+            else:
+                counts = score_records(truth, got or [], "dipendente_cf", errors)
+            ok, total = ok + counts[0], total + counts[1]
+    samples = {"document": documents, **timer.samples}
+    elapsed = sum(documents)
+    return {
+        "suite": name,
+        "documents": len(documents),
+        "pages": pages,
+        "failures": failures,
+        "seconds": elapsed,
+        "pages_per_s": pages / elapsed if elapsed else None,
+        "latency_ms": {stage: {f"p{q}": float(np.percentile(values, q)) * 1000 for q in PERCENTILES}
+                       for stage, values in samples.items() if values},
+        "peak_rss_mb": peak_rss_mb(),
+        "accuracy": ok / total if total else None,
+        "field_errors": dict(sorted(errors.items(), key=lambda kv: -kv[1])),
+    }
+
+
+# --- checks ---
+
+def check_thresholds(result, limits):
+    failed = []
+    if "min_accuracy" in limits and (result["accuracy"] or 0) < limits["min_accuracy"]:
+        failed.append(f"accuracy {result['accuracy']:.4f} < {limits['min_accuracy']}")
+    if "expected_errors" in limits:
+        failed += [f"wrong {field} in {n} records (not in expected_errors)"
+                   for field, n in result["field_errors"].items() if field not in limits["expected_errors"]]
+    if "min_pages_per_s" in limits and (result["pages_per_s"] or 0) < limits["min_pages_per_s"]:
+        failed.append(f"pages/s {result['pages_per_s']:.2f} < {limits['min_pages_per_s']}")
+    if "max_rss_mb" in limits and result["peak_rss_mb"] and result["peak_rss_mb"] > limits["max_rss_mb"]:
+        failed.append(f"peak RSS {result['peak_rss_mb']:.0f} MB > {limits['max_rss_mb']}")
+    for stage, limit in limits.get("max_p90_ms", {}).items():
+        p90 = result["latency_ms"].get(stage, {}).get("p90")
+        if p90 is not None and p90 > limit:
+            failed.append(f"{stage} p90 {p90:.1f} ms > {limit}")
+    return failed
+
+
+def check_baseline(result, base, tolerance):
+    # relative to an earlier run on the same machine: accuracy may not drop at all
+    failed = []
+    if (result["accuracy"] or 0) < (base["accuracy"] or 0) - 1e-9:
+        failed.append(f"accuracy {result['accuracy']:.4f} < baseline {base['accuracy']:.4f}")
+    if base["pages_per_s"] and result["pages_per_s"] < base["pages_per_s"] * (1 - tolerance):
+        failed.append(f"pages/s {result['pages_per_s']:.2f} < baseline {base['pages_per_s']:.2f} - {tolerance:.0%}")
+    if base["peak_rss_mb"] and result["peak_rss_mb"] and result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+        failed.append(f"peak RSS {result['peak_rss_mb']:.0f} MB > baseline {base['peak_rss_mb']:.0f} MB + {tolerance:.0%}")
+    for stage, values in base["latency_ms"].items():
+        p90 = result["latency_ms"].get(stage, {}).get("p90")
+        if p90 is not None and p90 > values["p90"] * (1 + tolerance):
+            failed.append(f"{stage} p90 {p90:.1f} ms > baseline {values['p90']:.1f} ms + {tolerance:.0%}")
+    return failed
+
+
+def print_result(result):
+    print(f"\n== {result['suite']}: {result['documents']} documents, {result['pages']} pages, "
+          f"{result['pages_per_s']:.2f} pages/s, peak RSS "
+          + (f"{result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] else "n/a")
+          + f", accuracy {result['accuracy']:.4f}" + (f", {result['failures']} failed" if result["failures"] else ""))
+    for stage, values in result["latency_ms"].items():
+        print(f"  {stage:<12} " + "  ".join(f"{q} {v:9.2f} ms" for q, v in values.items()))
+    for field, n in result["field_errors"].items():
+        print(f"  wrong {field:<26} {n}")
+
+
+def in_child(fn, *args):
+    # fn(*args) in a fresh spawned interpreter: its memory does not raise this process's peak RSS
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def generate_corpus(corpus_dir, docs, seed, kinds):
+    from bench import corpus
+    corpus.generate(corpus_dir, docs, seed, kinds)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the extractors on a synthetic payslip corpus")
+    ap.add_argument("--suite", action="append", choices=sorted(SUITES), help="repeatable (default: all)")
+    ap.add_argument("--docs", type=int, default=20, help="documents per kind when generating the corpus")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--corpus", help="corpus folder (generated there if it has no truth.json)")
+    ap.add_argument("--backend", help="parse_cedolini text backend for the lul suite")
+    ap.add_argument("--dpi", type=int, help="render resolution for the OCR suite")
+    ap.add_argument("--thresholds", default=str(THRESHOLDS), help="JSON limits per suite ('' to skip)")
+    ap.add_argument("--baseline", help="results JSON of an earlier run to compare with")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown vs the baseline")
+    ap.add_argument("--out", help="write the results as JSON")
+    args = ap.parse_args()
+
+    suites = args.suite or list(SUITES)
+    if NEEDS_OCR & set(suites):
+        # probed in a throwaway process: pytesseract loads pandas
+        if not in_child(ocr_available):
+            skipped = NEEDS_OCR & set(suites)
+            print(f"no OCR engine available (tesseract): skipping {', '.join(sorted(skipped))}")
+            suites = [s for s in suites if s not in skipped]
+    options = {key: value for key, value in (("backend", args.backend), ("dpi", args.dpi)) if value}
+
+    with tempfile.TemporaryDirectory(prefix="bench-corpus-") as tmp:
+        corpus_dir = Path(args.corpus or tmp)
+        if not (corpus_dir / "truth.json").exists():
+            kinds = tuple(dict.fromkeys(SUITES[s][0] for s in suites))
+            start = time.perf_counter()
+            in_child(generate_corpus, str(corpus_dir), args.docs, args.seed, kinds)
+            print(f"corpus: {args.docs} documents per kind in {corpus_dir} ({time.perf_counter() - start:.1f} s)")
+        results = {}
+        for name in suites:
+            # a clean interpreter per suite, nothing inherited from the others
+            results[name] = in_child(run_suite, name, str(corpus_dir), options)
+            print_result(results[name])
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+
+    failed = []
+    limits = json.loads(Path(args.thresholds).read_text(encoding="utf-8")) if args.thresholds else {}
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8")) if args.baseline else {}
+    for name, result in results.items():
+        failed += [f"{name}: {msg}" for msg in check_thresholds(result, limits.get(name, {}))]
+        if name in baseline:
+            failed += [f"{name}: {msg}" for msg in check_baseline(result, baseline[name], args.tolerance)]
+    if failed:
+        print("\nREGRESSIONS:\n  " + "\n  ".join(failed))
+        raise SystemExit(1)
+    print("\nall checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# bench/startup.py — cold import time of the extraction entry points
+#
+#     uv run -m bench.startup                          # checked against bench/startup.json
+#     uv run -m bench.startup --module requirements.pc --tree   # slowest imports below one module
+#
+# Every sample is a fresh `python -X importtime -c "import <module>"`; the time is the
+# module's cumulative import time as reported by the interpreter (its own startup not
+# included), the median of --repeat runs. bench/startup.json holds a loose ceiling in ms
+# per module and the heavy modules an import must not load (OpenCV, pandas, ...): the
+# extractors import those where they are used, a top-level import creeping back is the
+# regression this catches on any machine. Exit status 1 when a budget is exceeded.
+from pathlib import Path
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+ROOT = Path(__file__).resolve().parent.parent
+BUDGET = Path(__file__).with_name("startup.json")
+
+
+def import_profile(module):
+    # {imported module: cumulative µs} of one cold import, in import order
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=ROOT, capture_output=True, text=True, check=True)
+    profile = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        profile[name.strip()] = int(cumulative)
+    return profile
+
+
+def measure(module, repeat=5):
+    profiles = [import_profile(module) for _ in range(repeat)]
+    return {
+        "ms": statistics.median(p[module] for p in profiles) / 1000,
+        "loaded": sorted(profiles[-1]),
+        "profile": profiles[-1],
+    }
+
+
+def check(module, result, budget):
+    failed = []
+    if "max_ms" in budget and result["ms"] > budget["max_ms"]:
+        failed.append(f"{result['ms']:.0f} ms > {budget['max_ms']} ms")
+    loaded = set(result["loaded"])
+    heavy = [name for name in budget.get("forbid", ()) if name in loaded]
+    if heavy:
+        failed.append("loads " + ", ".join(heavy))
+    return failed
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Import-time budget of the extraction modules")
+    ap.add_argument("--module", action="append", help="repeatable (default: every module in the budget file)")
+    ap.add_argument("--repeat", type=int, default=5, help="cold imports per module (median)")
+    ap.add_argument("--budget", default=str(BUDGET))
+    ap.add_argument("--tree", action="store_true", help="also list the slowest imports below each module")
+    ap.add_argument("--top", type=int, default=15)
+    args = ap.parse_args()
+
+    budgets = json.loads(Path(args.budget).read_text(encoding="utf-8")) if args.budget else {}
+    failed = []
+    for module in args.module or list(budgets):
+        result = measure(module, args.repeat)
+        msgs = check(module, result, budgets.get(module, {}))
+        limit = budgets.get(module, {}).get("max_ms")
+        print(f"{module:<30} {result['ms']:8.1f} ms" + (f"  (budget {limit} ms)" if limit else "")
+              + ("   " + "; ".join(msgs) if msgs else ""))
+        if args.tree:
+            slowest = sorted(((us, name) for name, us in result["profile"].items() if name != module), reverse=True)
+            for us, name in slowest[:args.top]:
+                print(f"    {name:<40} {us / 1000:8.1f} ms")
+        failed += [f"{module}: {msg}" for msg in msgs]
+    if failed:
+        print("\nOVER BUDGET:\n  " + "\n  ".join(failed))
+        raise SystemExit(1)
+    print("\nall imports within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,119 +1,398 @@
 from pathlib import Path
-
-
-import pytesseract
-
-from PIL import Image
+import argparse
 import os
-import cv2
-import pytesseract
-from PIL import Image
 
+# cv2, numpy, PIL and PyMuPDF are imported where they are used: `import main` (batch,
+# service, templates, parse_cedolini) stays cheap, and a run served by the PDF text
+# layer never loads OpenCV
+from ocr_backend import BACKENDS, DEFAULT_CONFIG, DIGITS_CONFIG, get_backend
+from preprocess import DEFAULT_CHAIN, run_chain, split_chains
+from result_cache import flush_caches
+from schema import PayslipRecord
+from validators import is_valid
+import tracing
 
-import fitz  # PyMuPDF
 
+input_pdf_file_path = "example.pdf"
 
-# convert PDF to images
+# data_map bboxes are pixel coordinates on a page rendered at this resolution
+DPI = 500
 
-input_pdf_file_path="example.pdf"
+# adaptive mode: OCR every field at the first resolution, re-render at the next one only
+# the fields that fail their validator or score below MIN_CONFIDENCE (0-100)
+DPI_STEPS = (200, 300, DPI)
+MIN_CONFIDENCE = 75
 
+# optional per-field keys: "page" (1-based, default 1), "ocr" (OcrConfig),
+# "preprocess" (filter chain, see preprocess.py; default gray -> threshold 150 -> median 3),
+# "format" (validators.FORMATS key used to accept a text-layer value; default digits/text)
 
-def convert_pdf_to_images(pdf_path):
-    file_name = Path(pdf_path).name
-    doc = fitz.open(pdf_path)
+data_map = {
+    "dipendente_nome": {"type": str, "bbox": (544, 622, 1886, 696)},
+    "codice_fiscale": {"type": str, "bbox": (1984, 340, 2671, 402), "format": "cf"},
+    "matricola_inps": {"type": str, "bbox": (2874, 208, 3244, 270), "format": "digits"},
+    "qualifica": {"type": str, "bbox": (700, 750, 1300, 850)},
+    "mansione": {"type": str, "bbox": (1310, 750, 1882, 850)},
+    "livello": {"type": int, "bbox": (1916, 750, 2190, 850)},
+    "data_assunzione": {"type": str, "bbox": (126, 920, 392, 990), "format": "date"},
+    "data_cessazione": {"type": str, "bbox": (410, 920, 686, 990), "format": "date"},
+    "mese_retribuito": {"type": str, "bbox": (2020, 470, 2660, 580), "format": "month"},
+    "anno": {"type": int, "bbox": (2910, 490, 3120, 580), "format": "year"},
+    "totale_competenze": {"type": str, "bbox": (144, 4378, 502, 4440), "format": "amount"},
+    "totale_trattenute": {"type": str, "bbox": (2428, 5346, 2747, 5420), "format": "amount"},
+    "netto_in_busta": {"type": str, "bbox": (3290, 5338, 3880, 5410), "format": "amount"},
+    "imponibile_fiscale": {"type": str, "bbox": (146, 4512, 492, 4580), "format": "amount"},
+    "ritenute_inps": {"type": str, "bbox": (900, 4370, 1274, 4438), "format": "amount"},
+    "tfr_mese": {"type": str, "bbox": (1664, 4228, 2026, 4298), "format": "amount"},
+}
 
-    output_folder = Path(os.getcwd()) / "output" / file_name
-    output_folder.mkdir(parents=True, exist_ok=True)
 
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        pix = page.get_pixmap(dpi=500)  # render at 500 dpi
-        pix.save(f"{output_folder}/{page_num+1}.png")
+# convert PDF to images
 
+def output_folder_for(pdf_path):
+    output_folder = Path(os.getcwd()) / "output" / Path(pdf_path).name
+    output_folder.mkdir(parents=True, exist_ok=True)
     return output_folder
 
-output_folder = convert_pdf_to_images(input_pdf_file_path)
-print(f"Converted PDF pages saved to: {output_folder}")
-
-
-output_file_page_1 = f"{output_folder}/1.png"
 
+def render_page_to_disk(doc, page_num, output_folder):
+    with tracing.span("render", page=page_num):
+        pix = doc[page_num - 1].get_pixmap(dpi=DPI)  # render at 500 dpi
+    with tracing.span("png_save", page=page_num):
+        pix.save(f"{output_folder}/{page_num}.png")
+    return f"{output_folder}/{page_num}.png"
 
 
+def convert_pdf_to_images(pdf_path):
+    import fitz  # PyMuPDF
 
-data_map = {
-    "dipendente_nome": {"type": str, "bbox": (544, 622, 1886, 696)},
-    "codice_fiscale": {"type": str, "bbox": (1984, 340, 2671, 402)},
-    "matricola_inps": {"type": str, "bbox": (2874, 208, 3244, 270)},
-    "qualifica": {"type": str, "bbox": (700, 750, 1300, 850)},
-    "mansione": {"type": str, "bbox": (1310, 750, 1882, 850)},
-    "livello": {"type": int, "bbox": (1916, 750, 2190, 850)},
-    "data_assunzione": {"type": str, "bbox": (126, 920, 392, 990)},
-    "data_cessazione": {"type": str, "bbox": (410, 920, 686, 990)},
-    "mese_retribuito": {"type": str, "bbox": (2020, 470, 2660, 580)},
-    "anno": {"type": int, "bbox": (2910, 490, 3120, 580)},
-    "totale_competenze": {"type": str, "bbox": (144, 4378, 502, 4440)},
-    "totale_trattenute": {"type": str, "bbox": (2428, 5346, 2747, 5420)},
-    "netto_in_busta": {"type": str, "bbox": (3290, 5338, 3880, 5410)},
-    "imponibile_fiscale": {"type": str, "bbox": (146, 4512, 492, 4580)},
-    "ritenute_inps": {"type": str, "bbox": (900, 4370, 1274, 4438)},
-    "tfr_mese": {"type": str, "bbox": (1664, 4228, 2026, 4298)},
-}
+    output_folder = output_folder_for(pdf_path)
+    with fitz.open(pdf_path) as doc:
+        for page_num in range(1, len(doc) + 1):
+            render_page_to_disk(doc, page_num, output_folder)
+    return output_folder
 
 
 # Crop the image based on the bounding box
 
 def crop_image(name, image_path, bbox):
-    file_dir = Path(image_path).parent
-
     output_folder = Path(image_path).parent / "cropped"
     output_folder.mkdir(parents=True, exist_ok=True)
     output_file_path = f"{output_folder}/{name}.png"
 
-    with Image.open(image_path) as img:
+    from PIL import Image
+    with tracing.span("crop", field=name), Image.open(image_path) as img:
         cropped = img.crop(bbox)
-        cropped.save(output_file_path)
+        with tracing.span("png_save", field=name):
+            cropped.save(output_file_path)
 
     return output_file_path
 
 
-cropped_image_paths = {}
+# Preprocess and OCR a single field image
 
-for key, value in data_map.items():
-    cropped_image_path = crop_image(key, output_file_page_1, value["bbox"])
-    cropped_image_paths[key] = cropped_image_path
+def field_chain(field):
+    return field.get("preprocess", DEFAULT_CHAIN)
 
 
-# Read and process cropped images with OCR
+def preprocess(img, chain=DEFAULT_CHAIN, dpi=DPI):
+    # RGB or grayscale in, binarised image ready for OCR out
+    return run_chain(img, chain, dpi)
 
-for key, cropped_image_path in cropped_image_paths.items():
 
-    # Load image
-    img = cv2.imread(cropped_image_path)
+def field_config(field):
+    # one OCR pass per field: an explicit "ocr" config, or digits only for int fields
+    # (multiple languages: OcrConfig(lang="eng+ara+chi_sim+deu+jpn+rus+urd"))
+    if "ocr" in field:
+        return field["ocr"]
+    return DIGITS_CONFIG if field["type"] == int else DEFAULT_CONFIG
 
-    # Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-    # Threshold (binarize)
-    _, thresh = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
+def ocr_field(thresh, field):
+    with tracing.span("ocr"):
+        return get_backend().image_to_string(thresh, field_config(field))
 
-    # Optional: denoise
-    thresh = cv2.medianBlur(thresh, 3)
 
-    # OCR with multiple languages (example: English + Arabic + Chinese + German + Japanese + Russian + Urdu)
-    # text = pytesseract.image_to_string(img_rgb, lang="eng+ara+chi_sim+deu+jpn+rus+urd").strip()
-    text = pytesseract.image_to_string(thresh, lang="eng").strip()
+# In-memory pipeline: render once, slice the fields as views, no intermediate PNGs
 
+def pixmap_to_array(pix):
+    # shares memory with pix.samples: keep the Pixmap alive while the array is in use
+    import numpy as np
+    return np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
 
-    if data_map[key]["type"] == int:
-        # Restrict to digits only
-        custom_config = r'--oem 3 --psm 6 -c tessedit_char_whitelist=0123456789'
-
-        text = pytesseract.image_to_string(thresh, config=custom_config).strip()
 
+def crop_array(image, bbox):
+    x0, y0, x1, y1 = bbox
+    return image[y0:y1, x0:x1]
+
+
+def scale_bbox(bbox, dpi):
+    # data_map pixels (at DPI) -> pixels at another render resolution
+    if dpi == DPI:
+        return bbox
+    return tuple(round(v * dpi / DPI) for v in bbox)
+
+
+def bbox_to_rect(bbox):
+    # data_map pixels (at DPI) -> PDF points, resolution independent
+    import fitz  # PyMuPDF
+    return fitz.Rect(bbox) * (72 / DPI)
+
+
+def fields_by_page(fields):
+    pages = {}
+    for key, value in fields.items():
+        pages.setdefault(value.get("page", 1), []).append(key)
+    return pages
+
+
+def save_debug_image(path, image):
+    import cv2
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with tracing.span("png_save"):
+        cv2.imwrite(str(path), image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+
+
+def iter_field_images(doc, fields=data_map, mode="region", dpi=DPI, debug_folder=None, page_chain=()):
+    # Yields (key, array). Each array is only valid until the next item is requested.
+    # page mode: page_chain (pointwise steps, e.g. gray + threshold) runs once per page
+    for page_num, keys in fields_by_page(fields).items():
+        page = doc[page_num - 1]
+
+        if mode == "region":
+            # rasterise only the field rectangles, never the whole page
+            for key in keys:
+                with tracing.span("render", page=page_num, field=key, dpi=dpi):
+                    pix = page.get_pixmap(clip=bbox_to_rect(fields[key]["bbox"]), dpi=dpi)
+                tracing.count("rendered_pixels", pix.width * pix.height)
+                yield key, pixmap_to_array(pix)
+            continue
+
+        with tracing.span("render", page=page_num, dpi=dpi):
+            pix = page.get_pixmap(dpi=dpi)
+        tracing.count("rendered_pixels", pix.width * pix.height)
+        page_image = pixmap_to_array(pix)
+        if page_chain:
+            with tracing.span("preprocess", page=page_num):
+                page_image = run_chain(page_image, page_chain, dpi)
+        if debug_folder:
+            save_debug_image(Path(debug_folder) / f"{page_num}.png", page_image)
+        for key in keys:
+            yield key, crop_array(page_image, scale_bbox(fields[key]["bbox"], dpi))
+
+
+def ocr_fields(doc, fields=data_map, mode="region", dpi=DPI, debug_folder=None, batched=False):
+    # batched: collect every preprocessed crop first, then one OCR call per distinct config
+    results, pending = {}, []
+    chains = {key: field_chain(value) for key, value in fields.items()}
+    page_chain = ()
+    if mode == "page":
+        page_chain, chains = split_chains(chains)
+    for key, crop in iter_field_images(doc, fields, mode, dpi, debug_folder, page_chain):
+        with tracing.span("field", field=key):
+            if debug_folder:
+                save_debug_image(Path(debug_folder) / "cropped" / f"{key}.png", crop)
+            with tracing.span("preprocess"):
+                thresh = preprocess(crop, chains[key], dpi)
+            if batched:
+                pending.append((key, thresh, field_config(fields[key])))
+            else:
+                results[key] = ocr_field(thresh, fields[key])
+    if pending:
+        with tracing.span("ocr", fields=len(pending)):
+            texts = get_backend().image_to_strings(pending)
+        results = {key: texts[key] for key, _, _ in pending}
+    return results
+
+
+# Adaptive resolution: low dpi first, higher dpi only where the result is not trusted
+
+def is_blank(thresh, max_ink=0.002):
+    # binarised crop (dark text on white) with almost no ink: an empty field, no OCR needed
+    import numpy as np
+    return np.count_nonzero(thresh < 128) <= max_ink * thresh.size
+
+
+def ocr_fields_adaptive(doc, fields=data_map, mode="region", dpi_steps=DPI_STEPS, min_conf=MIN_CONFIDENCE,
+                        debug_folder=None):
+    # -> {key: (text, confidence, dpi)}; confidence None = blank crop (or engine without confidences).
+    # A field is accepted as soon as it passes its validator with confidence >= min_conf; after
+    # the last step the best attempt (valid first, then most confident) is kept.
+    results, pending = {}, dict(fields)
+    for step, dpi in enumerate(dpi_steps):
+        # only the first pass may render whole pages; retries render just the failed fields
+        step_mode = mode if step == 0 else "region"
+        chains = {key: field_chain(value) for key, value in pending.items()}
+        page_chain = ()
+        if step_mode == "page":
+            page_chain, chains = split_chains(chains)
+        if step:
+            tracing.count("adaptive_retries", len(pending))
+        for key, crop in iter_field_images(doc, pending, step_mode, dpi, None, page_chain):
+            field = pending[key]
+            with tracing.span("field", field=key, dpi=dpi):
+                with tracing.span("preprocess"):
+                    thresh = preprocess(crop, chains[key], dpi)
+                if debug_folder:
+                    save_debug_image(Path(debug_folder) / "cropped" / f"{key}_{dpi}.png", thresh)
+                if is_blank(thresh):
+                    text, confidence = "", None
+                else:
+                    with tracing.span("ocr"):
+                        text, confidence = get_backend().recognize(thresh, field_config(field))
+            blank = confidence is None and not text
+            valid = blank or is_valid(field, text)
+            attempt = (valid, -1 if confidence is None else confidence, text, confidence, dpi)
+            if key not in results or attempt[:2] > results[key][:2]:
+                results[key] = attempt
+            if blank or (valid and (confidence is None or confidence >= min_conf)):
+                del pending[key]
+        if not pending:
+            break
+    return {key: attempt[2:] for key, attempt in results.items()}
+
+
+# Text layer: generated (non scanned) payslips carry the values as text, no OCR needed
+
+def read_text_field(page, bbox):
+    # words inside the field rectangle, in reading order, one output line per text line
+    lines = {}
+    for x0, y0, x1, y1, word, block_no, line_no, word_no in page.get_text("words", clip=bbox_to_rect(bbox), sort=True):
+        lines.setdefault((block_no, line_no), []).append(word)
+    return "\n".join(" ".join(words) for words in lines.values())
+
+
+def read_text_fields(doc, fields=data_map):
+    results = {}
+    for page_num, keys in fields_by_page(fields).items():
+        page = doc[page_num - 1]
+        with tracing.span("text_layer", page=page_num):
+            for key in keys:
+                results[key] = read_text_field(page, fields[key]["bbox"])
+    return results
+
+
+def text_layer_fields(doc, fields=data_map, source="auto"):
+    # the fields taken from the PDF text layer: all of them for source="text", those with a
+    # valid value for "auto", none for "ocr" (main.extract_fields, page_buffers.render_document)
+    if source == "ocr":
+        return {}
+    return {key: text for key, text in read_text_fields(doc, fields).items()
+            if source == "text" or is_valid(fields[key], text)}
+
+
+def extract_fields(pdf_path, fields=data_map, mode="region", dpi=DPI, debug_folder=None, batched=False,
+                   source="auto", adaptive=False, dpi_steps=DPI_STEPS, min_conf=MIN_CONFIDENCE, details=None):
+    # source: "ocr" always renders + OCRs; "text" only reads the PDF text layer;
+    # "auto" takes the text layer where it yields a valid value and OCRs the other fields.
+    # adaptive: OCR at dpi_steps instead of the single dpi (batched does not apply).
+    # details: optional dict, filled with {key: {"source", "confidence", "dpi"}}
+    import fitz  # PyMuPDF
+
+    details = {} if details is None else details
+    with tracing.document(pdf_path), fitz.open(pdf_path) as doc:
+        results = text_layer_fields(doc, fields, source)
+        details.update({key: {"source": "text"} for key in results})
+        missing = {key: value for key, value in fields.items() if key not in results}
+        tracing.count("fields_from_text", len(fields) - len(missing))
+        if missing and adaptive:
+            for key, (text, confidence, used_dpi) in ocr_fields_adaptive(doc, missing, mode, dpi_steps, min_conf,
+                                                                         debug_folder).items():
+                results[key] = text
+                details[key] = {"source": "ocr", "confidence": confidence, "dpi": used_dpi}
+        elif missing:
+            results.update(ocr_fields(doc, missing, mode, dpi, debug_folder, batched))
+            details.update({key: {"source": "ocr", "dpi": dpi} for key in missing})
+        flush_caches()
+    return {key: results[key] for key in fields}
+
+
+def extract_record(pdf_path, fields=data_map, **kwargs):
+    # extract_fields() as a schema.PayslipRecord (amounts in cents, data_map names mapped to
+    # the shared ones: netto_in_busta -> netto_a_pagare, ...)
+    return PayslipRecord.from_fields(extract_fields(pdf_path, fields, **kwargs), source_file=Path(pdf_path).name)
+
+
+def extract_fields_from_disk(pdf_path, fields=data_map):
+    # only the pages that have fields, each one OCRed before the next is rendered
+    import cv2
+    import fitz  # PyMuPDF
+
+    with tracing.document(pdf_path, mode="disk"), fitz.open(pdf_path) as doc:
+        output_folder = output_folder_for(pdf_path)
+        print(f"Converted PDF pages saved to: {output_folder}")
+
+        results = {}
+        for page_num, keys in fields_by_page(fields).items():
+            page_image_path = render_page_to_disk(doc, page_num, output_folder)
+            for key in keys:
+                value = fields[key]
+                cropped_image_path = crop_image(key, page_image_path, value["bbox"])
+                img = cv2.cvtColor(cv2.imread(cropped_image_path), cv2.COLOR_BGR2RGB)
+                with tracing.span("preprocess", field=key):
+                    thresh = preprocess(img, field_chain(value))
+                results[key] = ocr_field(thresh, value)
+    return {key: results[key] for key in fields}
+
+
+def parse_dpi_steps(value):
+    steps = tuple(int(v) for v in value.split(","))
+    if list(steps) != sorted(steps):
+        raise argparse.ArgumentTypeError("dpi steps must be increasing")
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR the data_map fields of a payslip PDF")
+    parser.add_argument("pdf", nargs="?", default=input_pdf_file_path, help="PDF to process")
+    parser.add_argument("--mode", choices=["region", "page", "disk"], default="region",
+                        help="region: render only the field rectangles; page: render whole pages in RAM; "
+                             "disk: write page and crop PNGs first")
+    parser.add_argument("--dpi", type=int, default=DPI, help="render resolution for region/page mode")
+    parser.add_argument("--debug", action="store_true",
+                        help="in region/page mode, also save crop (and page) PNGs under output/<file>/")
+    parser.add_argument("--source", choices=["auto", "text", "ocr"], default="auto",
+                        help="auto: PDF text layer first, OCR only for empty/invalid fields")
+    parser.add_argument("--batched", action="store_true",
+                        help="tesserocr: one OCR call per page (per config) instead of one per field; "
+                             "pytesseract still OCRs field by field")
+    parser.add_argument("--ocr-backend", choices=sorted(BACKENDS), default=None,
+                        help="default: tesserocr if installed, else pytesseract")
+    parser.add_argument("--cache", help="SQLite file for the persistent OCR result cache (env OCR_CACHE)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="OCR at --dpi-steps, raising the resolution only for low-confidence/invalid fields")
+    parser.add_argument("--dpi-steps", type=parse_dpi_steps, default=DPI_STEPS, help="e.g. 200,300,500")
+    parser.add_argument("--min-conf", type=float, default=MIN_CONFIDENCE,
+                        help="adaptive: accept a field at confidence >= this (0-100)")
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+    if args.cache:
+        os.environ["OCR_CACHE"] = args.cache
+    tracing.from_args(args)
+    if args.ocr_backend:
+        # picked up by get_backend() on the first OCR call: a text-layer run never loads an engine
+        os.environ["OCR_BACKEND"] = args.ocr_backend
+
+    details = {}
+    if args.mode == "disk":
+        results = extract_fields_from_disk(args.pdf)
+    else:
+        debug_folder = Path(os.getcwd()) / "output" / Path(args.pdf).name if args.debug else None
+        results = extract_fields(args.pdf, mode=args.mode, dpi=args.dpi, debug_folder=debug_folder,
+                                 batched=args.batched, source=args.source, adaptive=args.adaptive,
+                                 dpi_steps=args.dpi_steps, min_conf=args.min_conf, details=details)
 
     # Print the extracted text
-
-    print(f"---- {key}")
-    print(text)
-
+    for key, text in results.items():
+        info = details.get(key, {})
+        if args.adaptive and info.get("source") == "ocr":
+            conf = "blank" if info["confidence"] is None else f"conf {info['confidence']:.0f}"
+            print(f"---- {key} ({conf}, {info['dpi']} dpi)")
+        else:
+            print(f"---- {key}")
+        print(text)
+    tracing.finish(args)
+
+
+if __name__ == "__main__":
+    main()
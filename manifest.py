@@ -0,0 +1,65 @@
+# manifest.py — processed-file manifest for incremental folder ingestion
+#
+# One row per (pipeline, path) with size, mtime and content hash of the PDF that was
+# last ingested successfully. plan() compares a folder listing against it: files with
+# the same size and mtime are skipped without reading them, otherwise the hash decides.
+from collections import namedtuple
+from pathlib import Path
+import hashlib
+import os
+import sqlite3
+import time
+
+FileState = namedtuple("FileState", "path size mtime sha256")
+
+
+def init_manifest(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ingest_manifest (
+        pipeline TEXT NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL,
+        sha256 TEXT NOT NULL, processed_at REAL NOT NULL,
+        PRIMARY KEY (pipeline, path)
+    );""")
+    conn.commit()
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def plan(conn: sqlite3.Connection, pipeline: str, paths):
+    # -> (files to (re)process as FileState, paths in the manifest that no longer exist)
+    known = {row[0]: row[1:] for row in conn.execute(
+        "SELECT path, size, mtime, sha256 FROM ingest_manifest WHERE pipeline = ?", (pipeline,))}
+    todo, seen = [], set()
+    for p in paths:
+        path = str(Path(p).resolve())
+        seen.add(path)
+        st = os.stat(path)
+        prev = known.get(path)
+        if prev and prev[0] == st.st_size and prev[1] == st.st_mtime:
+            continue
+        sha = file_sha256(path)
+        if prev and prev[2] == sha:
+            # touched but identical: only refresh the stat fields
+            conn.execute("UPDATE ingest_manifest SET size = ?, mtime = ? WHERE pipeline = ? AND path = ?",
+                         (st.st_size, st.st_mtime, pipeline, path))
+            continue
+        todo.append(FileState(path, st.st_size, st.st_mtime, sha))
+    conn.commit()
+    deleted = sorted(set(known) - seen)
+    return todo, deleted
+
+
+def mark_processed(conn: sqlite3.Connection, pipeline: str, state: FileState):
+    conn.execute("INSERT OR REPLACE INTO ingest_manifest (pipeline, path, size, mtime, sha256, processed_at) "
+                 "VALUES (?,?,?,?,?,?)", (pipeline, state.path, state.size, state.mtime, state.sha256, time.time()))
+
+
+def forget(conn: sqlite3.Connection, pipeline: str, paths):
+    conn.executemany("DELETE FROM ingest_manifest WHERE pipeline = ? AND path = ?",
+                     [(pipeline, str(p)) for p in paths])
@@ -0,0 +1,264 @@
+# ocr_backend.py — OCR engines behind one interface
+#
+# pytesseract starts a `tesseract` process and reloads the traineddata on every call.
+# When the tesserocr bindings are installed (pip install tesserocr) the engine lives in
+# the process instead: one initialised TessBaseAPI per language, reused for every field.
+# Select explicitly with OCR_BACKEND=tesserocr|pytesseract or get_backend(name).
+# Results are cached by crop content + config (memory LRU, plus SQLite when OCR_CACHE
+# points to a file), so reruns over unchanged scans skip the engine.
+# recognize() also returns the engine's confidence (0-100, mean over the words), used by
+# main.py's adaptive mode to decide whether a field needs a higher resolution pass.
+# image_to_strings() (main.py --batched) returns the same texts as image_to_string() per
+# field. Only tesserocr batches: one SetImage of a composite, then one rectangle per field.
+# pytesseract keeps one tesseract run per field, since the CLI cannot recognise rectangles
+# and an auto-segmented composite does not read like the lone crops.
+from dataclasses import dataclass
+import os
+
+from result_cache import array_key, open_cache
+import tracing
+
+
+@dataclass(frozen=True)
+class OcrConfig:
+    lang: str = "eng"
+    psm: int | None = None  # None = tesseract default (3, fully automatic)
+    oem: int | None = None
+    whitelist: str | None = None
+
+    def to_cli(self):
+        parts = []
+        if self.oem is not None:
+            parts.append(f"--oem {self.oem}")
+        if self.psm is not None:
+            parts.append(f"--psm {self.psm}")
+        if self.whitelist:
+            parts.append(f"-c tessedit_char_whitelist={self.whitelist}")
+        return " ".join(parts)
+
+
+DEFAULT_CONFIG = OcrConfig()
+DIGITS_CONFIG = OcrConfig(oem=3, psm=6, whitelist="0123456789")
+
+
+def batchable(image):
+    # compose() takes 2-D uint8 crops (the default gray -> threshold chain); colour crops of
+    # a chain without "gray" are OCRed on their own
+    import numpy as np
+    return isinstance(image, np.ndarray) and image.ndim == 2 and image.dtype == np.uint8
+
+
+def compose(images, gap=32):
+    # stack grayscale crops top to bottom on a white canvas; returns the canvas and
+    # the (x0, y0, x1, y1) box of every tile
+    import numpy as np
+
+    if not all(batchable(img) for img in images):
+        raise ValueError("compose() takes 2-D uint8 images only")
+    width = max(img.shape[1] for img in images)
+    height = sum(img.shape[0] for img in images) + gap * (len(images) + 1)
+    canvas = np.full((height, width + 2 * gap), 255, dtype=np.uint8)
+    boxes, y = [], gap
+    for img in images:
+        h, w = img.shape[:2]
+        canvas[y:y + h, gap:gap + w] = img
+        boxes.append((gap, y, gap + w, y + h))
+        y += h + gap
+    return canvas, boxes
+
+
+def as_pil(image):
+    from PIL import Image
+    return image if isinstance(image, Image.Image) else Image.fromarray(image)
+
+
+def group_by_config(items):
+    groups = {}
+    for key, image, config in items:
+        groups.setdefault(config, []).append((key, image))
+    return groups
+
+
+class OcrBackend:
+    name = None
+    batches = False  # image_to_strings() recognises the batchable() crops of a config at once
+
+    def image_to_string(self, image, config=DEFAULT_CONFIG):
+        raise NotImplementedError
+
+    def image_to_strings(self, items):
+        # items: [(key, image, config)] -> {key: text}, the texts image_to_string() gives;
+        # engines with batches = True override this, one recognition per distinct config
+        return {key: self.image_to_string(image, config) for key, image, config in items}
+
+    def recognize(self, image, config=DEFAULT_CONFIG):
+        # (text, confidence); None when the engine does not report one
+        return self.image_to_string(image, config), None
+
+
+class PytesseractBackend(OcrBackend):
+    name = "pytesseract"
+
+    def __init__(self):
+        import pytesseract
+        self._pytesseract = pytesseract
+
+    def image_to_string(self, image, config=DEFAULT_CONFIG):
+        return self._pytesseract.image_to_string(image, lang=config.lang, config=config.to_cli()).strip()
+
+    def recognize(self, image, config=DEFAULT_CONFIG):
+        # image_to_data: the same recognition as image_to_string plus a confidence per word
+        data = self._pytesseract.image_to_data(image, lang=config.lang, config=config.to_cli(),
+                                               output_type=self._pytesseract.Output.DICT)
+        lines, confs = {}, []
+        for i, word in enumerate(data["text"]):
+            if not word.strip() or float(data["conf"][i]) < 0:
+                continue
+            lines.setdefault((data["block_num"][i], data["par_num"][i], data["line_num"][i]), []).append(word)
+            confs.append(float(data["conf"][i]))
+        text = "\n".join(" ".join(words) for _, words in sorted(lines.items()))
+        return text, (sum(confs) / len(confs) if confs else 0.0)
+
+
+class TesserocrBackend(OcrBackend):
+    name = "tesserocr"
+    batches = True
+
+    def __init__(self, langs=("eng",)):
+        import tesserocr
+        self._tesserocr = tesserocr
+        self._apis = {}
+        for lang in langs:  # load the models up front, not on the first field
+            self._api(OcrConfig(lang=lang))
+
+    def _api(self, config):
+        # oem 3 is tesseract's default engine mode, the one PyTessBaseAPI starts with
+        api = self._apis.get(config.lang)
+        if api is None:
+            api = self._tesserocr.PyTessBaseAPI(lang=config.lang)
+            self._apis[config.lang] = api
+        api.SetPageSegMode(self._tesserocr.PSM.AUTO if config.psm is None else config.psm)
+        api.SetVariable("tessedit_char_whitelist", config.whitelist or "")
+        return api
+
+    def image_to_string(self, image, config=DEFAULT_CONFIG):
+        api = self._api(config)
+        api.SetImage(as_pil(image))
+        return api.GetUTF8Text().strip()
+
+    def recognize(self, image, config=DEFAULT_CONFIG):
+        api = self._api(config)
+        api.SetImage(as_pil(image))
+        text = api.GetUTF8Text().strip()
+        # mean word confidence of the recognition GetUTF8Text just ran
+        return text, float(api.MeanTextConf()) if text else 0.0
+
+    def image_to_strings(self, items):
+        # one SetImage per config, then one rectangle per field on the same engine:
+        # each field is recognised exactly as in the per-field path
+        results = {key: self.image_to_string(image, config) for key, image, config in items
+                   if not batchable(image)}
+        for config, group in group_by_config([item for item in items if batchable(item[1])]).items():
+            canvas, boxes = compose([image for _, image in group])
+            api = self._api(config)
+            api.SetImage(as_pil(canvas))
+            for (key, _), (x0, y0, x1, y1) in zip(group, boxes):
+                api.SetRectangle(x0, y0, x1 - x0, y1 - y0)
+                results[key] = api.GetUTF8Text().strip()
+        return results
+
+    def close(self):
+        for api in self._apis.values():
+            api.End()
+        self._apis.clear()
+
+
+class CachedBackend(OcrBackend):
+    def __init__(self, engine, cache):
+        self.engine = engine
+        self.cache = cache
+        self.name = engine.name
+
+    def _key(self, image, config, *parts):
+        import numpy as np
+        return array_key(np.asarray(image), self.name, config, *parts)
+
+    def _batched(self, image):
+        # crops the engine recognises inside a composite are cached apart from the per-field texts
+        return self.engine.batches and batchable(image)
+
+    def image_to_string(self, image, config=DEFAULT_CONFIG):
+        tracing.count("ocr_fields")
+        key = self._key(image, config)
+        text = self.cache.get(key)
+        if text is None:
+            tracing.count("ocr_engine_calls")
+            text = self.engine.image_to_string(image, config)
+            self.cache.set(key, text)
+        else:
+            tracing.count("ocr_cache_hits")
+        return text
+
+    def recognize(self, image, config=DEFAULT_CONFIG):
+        tracing.count("ocr_fields")
+        import numpy as np
+        key = array_key(np.asarray(image), self.name, config, "recognize")
+        hit = self.cache.get(key)
+        if hit is not None:
+            tracing.count("ocr_cache_hits")
+            return tuple(hit)
+        tracing.count("ocr_engine_calls")
+        text, confidence = self.engine.recognize(image, config)
+        self.cache.set(key, [text, confidence])
+        return text, confidence
+
+    def image_to_strings(self, items):
+        results, misses, cache_keys = {}, [], {}
+        for key, image, config in items:
+            cache_keys[key] = self._key(image, config, *(("batched",) if self._batched(image) else ()))
+            text = self.cache.get(cache_keys[key])
+            if text is None:
+                misses.append((key, image, config))
+            else:
+                results[key] = text
+        tracing.count("ocr_fields", len(items))
+        tracing.count("ocr_cache_hits", len(items) - len(misses))
+        if misses:
+            # one engine pass per config for the batched crops, one per field for the rest
+            batched = [item for item in misses if self._batched(item[1])]
+            tracing.count("ocr_engine_calls", len(misses) - len(batched) + len(group_by_config(batched)))
+            for key, text in self.engine.image_to_strings(misses).items():
+                self.cache.set(cache_keys[key], text)
+                results[key] = text
+        return results
+
+    def close(self):
+        if hasattr(self.engine, "close"):
+            self.engine.close()
+
+
+BACKENDS = {
+    "tesserocr": TesserocrBackend,
+    "pytesseract": PytesseractBackend,
+}
+
+_backend = None
+
+
+def get_backend(name=None):
+    # one backend per process; used as ProcessPoolExecutor initializer to warm workers
+    global _backend
+    name = name or os.environ.get("OCR_BACKEND")
+    if _backend is not None and name in (None, _backend.name):
+        return _backend
+    if _backend is not None:
+        _backend.close()
+    if name:
+        engine = BACKENDS[name]()
+    else:
+        try:
+            engine = TesserocrBackend()
+        except ImportError:
+            engine = PytesseractBackend()
+    _backend = CachedBackend(engine, open_cache(os.environ.get("OCR_CACHE")))
+    return _backend
@@ -0,0 +1,227 @@
+# page_buffers.py — rendered pages shared with the OCR workers instead of pickled to them
+#
+#     uv run batch.py cedolini/ --shared-pages 4 --workers 16
+#
+# The parent process renders every page once (500 dpi RGB, ~70 MB for A4) and copies
+# Pixmap.samples straight into a slot of one SharedMemory block; the pool workers get a
+# descriptor (block name, offset, shape) plus the field key, map the block once per
+# process and crop their field out of a numpy view: no page array ever goes through a
+# pipe. The number of slots is fixed, so memory is slots x slot size whatever the load:
+# when every slot holds a page still being OCRed the renderer waits for one to free up.
+# A slot is released when the last field of its page is done. The slot size is the
+# largest page with fields among the input documents, rendered at the requested dpi
+# (A4 at 500 dpi: ~70 MB); a page that still does not fit is OCRed in this process,
+# with a warning on stderr.
+#
+# Results are the ones of main.extract_fields(mode="page"): the full preprocess chain is
+# run on each crop, which equals running its pointwise prefix on the page first.
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+import math
+import sys
+import threading
+
+import main as ocr
+from ocr_backend import get_backend
+import tracing
+
+A4 = (595.275, 841.889)  # PDF points
+
+
+def page_bytes(width, height, dpi, channels=3):
+    # upper bound of len(get_pixmap(dpi=dpi).samples) for a page of width x height points (RGB)
+    return (math.ceil(width * dpi / 72) + 1) * (math.ceil(height * dpi / 72) + 1) * channels
+
+
+def slot_bytes_for(paths, fields, dpi):
+    # largest rendered page among the pages that have fields, over all the documents
+    import fitz  # PyMuPDF
+
+    page_nums = list(ocr.fields_by_page(fields))
+    size = 0
+    for path in paths:
+        try:
+            with fitz.open(path) as doc:
+                for page_num in page_nums:
+                    if page_num <= len(doc):
+                        rect = doc[page_num - 1].rect
+                        size = max(size, page_bytes(rect.width, rect.height, dpi))
+        except Exception:
+            continue  # unreadable: it fails again, and is reported, when it is rendered
+    return size or page_bytes(*A4, dpi)
+
+
+class PageBuffers:
+    # parent side: `slots` page buffers of `slot_bytes` each in one shared memory block
+    def __init__(self, slots, slot_bytes):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self._free = deque(range(slots))
+        self._pending = {}  # slot -> tasks still reading it
+        self._cond = threading.Condition()
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def acquire(self):
+        # blocks while every slot holds a page that is still being OCRed
+        with self._cond:
+            while not self._free:
+                self._cond.wait()
+            return self._free.popleft()
+
+    def put(self, slot, pix):
+        # copy Pixmap.samples into the slot -> descriptor for page_view()
+        shape = (pix.height, pix.width, pix.n)
+        offset = slot * self.slot_bytes
+        with tracing.span("page_copy", bytes=len(pix.samples_mv)):
+            self.shm.buf[offset:offset + len(pix.samples_mv)] = pix.samples_mv
+        return self.name, offset, shape
+
+    def fits(self, pix):
+        return len(pix.samples_mv) <= self.slot_bytes
+
+    def release(self, slot):
+        with self._cond:
+            self._free.append(slot)
+            self._cond.notify()
+
+    def hold(self, slot, futures):
+        # the slot goes back to the free list once all these futures are done
+        with self._cond:
+            self._pending[slot] = len(futures)
+        for future in futures:
+            future.add_done_callback(lambda _, slot=slot: self._done(slot))
+
+    def _done(self, slot):
+        with self._cond:
+            self._pending[slot] -= 1
+            if self._pending[slot] == 0:
+                del self._pending[slot]
+                self._free.append(slot)
+                self._cond.notify()
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# --- worker side ---
+
+_attached = {}
+
+
+def page_view(desc):
+    # numpy view of a page in the parent's block; the block is mapped once per worker.
+    # track=False: the parent owns (and unlinks) the block, the worker's resource
+    # tracker must not unlink it when the worker exits
+    import numpy as np
+
+    name, offset, shape = desc
+    shm = _attached.get(name)
+    if shm is None:
+        shm = _attached[name] = shared_memory.SharedMemory(name=name, track=False)
+    return np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+
+
+def ocr_shared_field(desc, key, field, dpi=ocr.DPI, doc=None):
+    # pool task: crop one field out of a shared page, preprocess, OCR
+    with tracing.span("field", doc=doc, field=key):
+        crop = ocr.crop_array(page_view(desc), ocr.scale_bbox(field["bbox"], dpi))
+        with tracing.span("preprocess"):
+            thresh = ocr.preprocess(crop, ocr.field_chain(field), dpi)
+        del crop
+        return ocr.ocr_field(thresh, field)
+
+
+# --- pipeline ---
+
+def render_document(path, fields, buffers, executor, dpi, source):
+    # text layer first (source="auto"), then one render per page that still has fields;
+    # returns {key: text or Future}
+    import fitz  # PyMuPDF
+
+    with tracing.document(path, mode="shared"), fitz.open(path) as doc:
+        results = ocr.text_layer_fields(doc, fields, source)
+        missing = {key: value for key, value in fields.items() if key not in results}
+        for page_num, keys in ocr.fields_by_page(missing).items():
+            with tracing.span("render", page=page_num, dpi=dpi):
+                pix = doc[page_num - 1].get_pixmap(dpi=dpi)
+            if not buffers.fits(pix):
+                # larger than a slot (changed since slot_bytes_for): OCR it here rather than resizing the pool
+                tracing.count("oversize_pages")
+                print(f"[shared-pages] {path} page {page_num}: {pix.width}x{pix.height} px does not fit a "
+                      f"{buffers.slot_bytes} byte slot, OCR in the parent process", file=sys.stderr)
+                results.update(ocr.ocr_fields(doc, {k: missing[k] for k in keys}, "page", dpi))
+                continue
+            slot, futures = buffers.acquire(), {}
+            try:
+                desc = buffers.put(slot, pix)
+                del pix
+                for key in keys:
+                    futures[key] = executor.submit(ocr_shared_field, desc, key, missing[key], dpi, str(path))
+            finally:
+                # a submit failing halfway: the fields already submitted still read the slot
+                if futures:
+                    buffers.hold(slot, list(futures.values()))
+                else:
+                    buffers.release(slot)
+            results.update(futures)
+            tracing.count("shared_pages")
+    return {key: results[key] for key in fields}
+
+
+def _collect(path, results):
+    values, errors = {}, {}
+    for key, value in results.items():
+        if hasattr(value, "result"):
+            try:
+                value = value.result()
+            except Exception as e:
+                errors[key] = repr(e)
+                continue
+        values[key] = value
+    if errors:
+        values["_errors"] = errors
+    return path, values, None
+
+
+def run_shared(paths, fields=ocr.data_map, workers=1, slots=4, dpi=ocr.DPI, source="auto", max_pending=None):
+    # yields (path, {key: text}, error) in input order, like batch.run_documents; this process
+    # renders, the pool OCRs. max_pending: documents rendered ahead of the oldest unfinished one
+    max_pending = max_pending or 2 * slots
+    paths = list(paths)
+    # buffers outermost: the block is unlinked only after the workers have exited
+    with PageBuffers(slots, slot_bytes_for(paths, fields, dpi)) as buffers, \
+            ProcessPoolExecutor(max_workers=workers, initializer=get_backend) as executor:
+        pending = deque()
+        for path in paths:
+            try:
+                pending.append((path, render_document(path, fields, buffers, executor, dpi, source)))
+            except Exception as e:
+                pending.append((path, e))
+            while pending and (len(pending) >= max_pending or _ready(pending[0][1])):
+                yield _finish(*pending.popleft())
+        while pending:
+            yield _finish(*pending.popleft())
+
+
+def _ready(results):
+    return isinstance(results, Exception) or all(v.done() for v in results.values() if hasattr(v, "done"))
+
+
+def _finish(path, results):
+    if isinstance(results, Exception):
+        return path, None, results
+    if not _ready(results):
+        wait([v for v in results.values() if hasattr(v, "done")])
+    return _collect(path, results)
@@ -0,0 +1,43 @@
+# parallel.py — ordered, bounded fan-out of documents over a process pool
+#
+# Shared by batch.py and the text parsers (requirements/parse_cedolini.py, pc.py), which
+# must not import the OCR command line modules just for this.
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+
+def map_ordered(executor, fn, items, max_pending):
+    # executor.map with a bounded number of submitted tasks; yields (item, result, error)
+    # in input order, an exception in one task is returned instead of raised
+    pending = deque()
+    for item in items:
+        pending.append((item, executor.submit(fn, item)))
+        if len(pending) >= max_pending:
+            yield _collect(*pending.popleft())
+    while pending:
+        yield _collect(*pending.popleft())
+
+
+def _collect(item, future):
+    try:
+        return item, future.result(), None
+    except Exception as e:
+        return item, None, e
+
+
+def map_documents(fn, items, workers=1, max_pending=None):
+    # map_ordered on a pool of `workers` processes; workers <= 1 runs fn here, one item at a time
+    if workers <= 1:
+        for item in items:
+            try:
+                yield item, fn(item), None
+            except Exception as e:
+                yield item, None, e
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from map_ordered(executor, fn, items, max_pending or 2 * workers)
+
+
+def default_workers():
+    return os.cpu_count() or 1
@@ -0,0 +1,194 @@
+# preprocess.py — configurable image preprocessing before OCR
+#
+# A chain is a list of steps, each a filter name or (name, *args):
+#
+#     ["gray", ("threshold", 150), ("median", 3)]          # DEFAULT_CHAIN, the original pipeline
+#     ["gray", "otsu", ("downscale", 300), ("median", 3)]
+#
+# data_map fields can carry their own chain under "preprocess". Pointwise steps shared
+# by every field (gray, fixed threshold) can be run once on the whole page and the
+# fields sliced afterwards with identical results; see split_chains().
+#
+# Timing harness, ms per stage on the data_map crops of a PDF:
+#
+#     uv run preprocess.py example.pdf --chain gray,threshold:150,median:3 --chain gray,otsu,median:3
+import argparse
+import math
+import time
+
+# cv2 and numpy are imported inside the filters: main.py imports the chain helpers
+# (DEFAULT_CHAIN, split_chains) on every run, OpenCV only loads when a field is OCRed
+
+
+def gray(img):
+    import cv2
+    return img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+
+
+def threshold(img, value=150):
+    import cv2
+    _, out = cv2.threshold(img, value, 255, cv2.THRESH_BINARY)
+    return out
+
+
+def otsu(img):
+    import cv2
+    _, out = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return out
+
+
+def adaptive(img, block_size=31, c=15):
+    import cv2
+    return cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_size, c)
+
+
+def median(img, ksize=3):
+    import cv2
+    return cv2.medianBlur(img, ksize)
+
+
+def deskew(img, max_angle=10.0):
+    # angle of the minimum-area rectangle around the dark pixels; expects a binarised image
+    import cv2
+    import numpy as np
+
+    coords = np.column_stack(np.nonzero(img < 128))
+    if len(coords) < 10:
+        return img
+    angle = cv2.minAreaRect(coords[:, ::-1].astype(np.float32))[-1]
+    if angle > 45:
+        angle -= 90
+    if abs(angle) < 0.1 or abs(angle) > max_angle:
+        return img
+    h, w = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(img, matrix, (w, h), flags=cv2.INTER_LINEAR, borderValue=255)
+
+
+def downscale(img, target_dpi=300, dpi=None):
+    # Tesseract needs ~300 dpi for body text: fewer pixels at the same accuracy
+    if not dpi or target_dpi >= dpi:
+        return img
+    import cv2
+
+    scale = target_dpi / dpi
+    h, w = img.shape[:2]
+    return cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+FILTERS = {
+    "gray": gray,
+    "threshold": threshold,
+    "otsu": otsu,
+    "adaptive": adaptive,
+    "median": median,
+    "deskew": deskew,
+    "downscale": downscale,
+}
+
+# steps that only look at one pixel: page-then-crop == crop-then-step
+POINTWISE = {"gray", "threshold"}
+# steps that need the resolution the image was rendered at
+DPI_AWARE = {"downscale"}
+
+DEFAULT_CHAIN = (("gray",), ("threshold", 150), ("median", 3))
+
+
+def normalize(chain):
+    return tuple((step,) if isinstance(step, str) else tuple(step) for step in chain)
+
+
+def parse_chain(text):
+    # "gray,threshold:150,median:3" -> (("gray",), ("threshold", 150), ("median", 3))
+    steps = []
+    for part in text.split(","):
+        name, *args = part.strip().split(":")
+        if name not in FILTERS:
+            raise ValueError(f"unknown filter {name!r}, expected one of {sorted(FILTERS)}")
+        steps.append((name, *(float(a) if "." in a else int(a) for a in args)))
+    return tuple(steps)
+
+
+def run_chain(img, chain=DEFAULT_CHAIN, dpi=None, timings=None):
+    # timings: optional dict, accumulates {step name: [ms, ...]}
+    for name, *args in normalize(chain):
+        start = time.perf_counter()
+        if name in DPI_AWARE:
+            img = FILTERS[name](img, *args, dpi=dpi)
+        else:
+            img = FILTERS[name](img, *args)
+        if timings is not None:
+            timings.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+    return img
+
+
+def split_chains(chains):
+    # longest pointwise prefix shared by every chain -> (page chain, {key: remaining chain})
+    chains = {key: normalize(chain) for key, chain in chains.items()}
+    if not chains:
+        return (), chains
+    prefix = []
+    for steps in zip(*chains.values()):
+        if len(set(steps)) != 1 or steps[0][0] not in POINTWISE:
+            break
+        prefix.append(steps[0])
+    n = len(prefix)
+    return tuple(prefix), {key: chain[n:] for key, chain in chains.items()}
+
+
+# --- timing harness ---
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def benchmark(pdf_path, chains, repeat=5, dpi=None, run_ocr=False):
+    import fitz  # PyMuPDF
+    import main as pipeline
+
+    dpi = dpi or pipeline.DPI
+    with fitz.open(pdf_path) as doc:
+        crops = {key: crop.copy() for key, crop in pipeline.iter_field_images(doc, pipeline.data_map, "region", dpi)}
+
+    reference = None
+    for chain in chains:
+        timings, outputs = {}, {}
+        for _ in range(repeat):
+            for key, crop in crops.items():
+                outputs[key] = run_chain(crop, chain, dpi, timings)
+        print(f"\n== {','.join(':'.join(map(str, step)) for step in chain)}  ({len(crops)} fields x {repeat})")
+        total = 0.0
+        for name, values in timings.items():
+            per_page = sum(values) / repeat
+            total += per_page
+            print(f"  {name:<10} {per_page:8.2f} ms/page   p50 {percentile(values, 50):6.3f}   "
+                  f"p95 {percentile(values, 95):6.3f} ms/field")
+        print(f"  {'total':<10} {total:8.2f} ms/page   {sum(o.size for o in outputs.values()) / 1e6:.2f} Mpx to OCR")
+        if run_ocr:
+            texts = {key: pipeline.ocr_field(outputs[key], pipeline.data_map[key]) for key in outputs}
+            if reference is None:
+                reference = texts
+                print("  (OCR reference)")
+            else:
+                same = sum(texts[k] == reference[k] for k in texts)
+                print(f"  OCR equal to reference: {same}/{len(texts)}")
+                for k in texts:
+                    if texts[k] != reference[k]:
+                        print(f"    {k}: {reference[k]!r} -> {texts[k]!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time preprocessing chains on the data_map fields of a PDF")
+    parser.add_argument("pdf")
+    parser.add_argument("--chain", action="append", type=parse_chain,
+                        help="comma separated steps, e.g. gray,otsu,median:3 (repeatable; first = reference)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--dpi", type=int, default=None, help="render resolution (default: data_map DPI)")
+    parser.add_argument("--ocr", action="store_true", help="also OCR every chain and compare with the first")
+    args = parser.parse_args()
+    benchmark(args.pdf, args.chain or [DEFAULT_CHAIN], args.repeat, args.dpi, args.ocr)
+
+
+if __name__ == "__main__":
+    main()
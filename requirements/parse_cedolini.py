@@ -2,20 +2,30 @@
 # parse_cedolini.py — Estrazione cedolini PDF -> Dettaglio + Aggregati + Anagrafica (XLSX) con dropdown 'sede_operativa'
 # Robustezza: ancore LUL/Datev, split chunk “validi”, regex a fine riga (no catture a fiume),
 # EU->float, lineage source_file, anno con fallback (pagina o nome file), QA check basilari.
-import re, argparse, sys, time
+import re, argparse, itertools, json, os, sqlite3, sys, time
+from array import array
 from pathlib import Path
-import pandas as pd
-from pdfminer.high_level import extract_text
-from openpyxl.utils import get_column_letter
-from openpyxl.worksheet.datavalidation import DataValidation
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+# pandas/numpy/openpyxl solo dove si costruisce il report: il parsing (worker di batch.py,
+# --stream senza --out) non li carica
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # moduli condivisi nella root del progetto
+from parallel import map_ordered
+from result_cache import file_key, flush_caches, open_cache
+from text_backends import TEXT_BACKENDS, DEFAULT_BACKEND, iter_page_texts
+from field_scanner import FieldScanner, count_tokens
+from sinks import SINKS, open_sink, read_frame
+from manifest import init_manifest, plan, mark_processed, forget
+from schema import PayslipRecord, PRES_CODES, PRES_TYPECODE, RECORD_COLUMNS, to_cents, to_euros, to_year, to_frame
+import tracing
 
 # ---------- costanti & util ----------
+PARSER_VERSION = "1"  # incrementare quando cambiano regex o campi: invalida la cache dei risultati
 CONTROL_CHARS = re.compile(r"[\000-\010\013\014\016-\037]")
 CF_RE = r"\b([A-Z]{6}\d{2}[A-Z]\d{2}[A-Z]\d{3}[A-Z])\b"
 EU_NUM = r"[-+]?\d{1,3}(?:\.\d{3})*(?:,\d+)?|[-+]?\d+(?:,\d+)?"
 
-PRES_CODES = ["FE","FT","A1","RS","ROL","MAL","INF","MAT","PERM","STRAORD","FG"]  # FG=festività non goduta (presenti nei tuoi PDF)
-
 MONTHS_MAP = {
     "gen": "Gennaio", "feb": "Febbraio", "mar": "Marzo", "apr": "Aprile",
     "mag": "Maggio", "giu": "Giugno", "lug": "Luglio", "ago": "Agosto",
@@ -42,131 +52,289 @@ def find_first_line(text, patterns, group=1, flags=re.IGNORECASE):
             return m.group(group).strip()
     return None
 
+# campi azienda/periodo: primo match nel documento, pattern in ordine di priorità (find_first_line)
+COMPANY_PATTERNS = {
+    "azienda_denominazione": [r"\bAZIENDA\s+([^\n]+)"],
+    "azienda_cf": [r"\bCODICE\s+FISCALE\s+([0-9/]{5,})"],
+    "azienda_piva": [r"\bPARTITA\s+IVA\s+([0-9/]{5,})"],
+    "mese_retribuito": [r"\bMESE\s+RETRIBUITO\s+([A-Za-zÀ-ÖØ-öø-ÿ]+)\b",
+                        # fallback: individua pattern “Aprile 2025” nel frontespizio
+                        r"\b(Gennaio|Febbraio|Marzo|Aprile|Maggio|Giugno|Luglio|Agosto|Settembre|Ottobre|Novembre|Dicembre)\b"],
+    "anno": [r"\bMESE\s+RETRIBUITO\s+[A-Za-zÀ-ÖØ-öø-ÿ]+\s+(20\d{2})\b",
+             r"\bANNO\s+(20\d{2})\b",
+             r"\b(20\d{2})\b"],  # ultimo fallback nella pagina
+}
+
 def parse_month(text):
-    m = find_first_line(text, [r"\bMESE\s+RETRIBUITO\s+([A-Za-zÀ-ÖØ-öø-ÿ]+)\b"])
-    if m: return m
-    # fallback: individua pattern “Aprile 2025” nel frontespizio
-    m2 = find_first_line(text, [r"\b(Gennaio|Febbraio|Marzo|Aprile|Maggio|Giugno|Luglio|Agosto|Settembre|Ottobre|Novembre|Dicembre)\b"])
-    return m2
+    return find_first_line(text, COMPANY_PATTERNS["mese_retribuito"])
 
-def parse_year(text, source_name):
-    y = find_first_line(text, [r"\bMESE\s+RETRIBUITO\s+[A-Za-zÀ-ÖØ-öø-ÿ]+\s+(20\d{2})\b",
-                               r"\bANNO\s+(20\d{2})\b",
-                               r"\b(20\d{2})\b"])  # ultimo fallback nella pagina
-    if y: return y
+def year_from_name(source_name):
     # ultimissimo fallback: numero a 4 cifre nel nome file
     m = re.search(r"(20\d{2})", source_name)
     return m.group(1) if m else None
 
+def parse_year(text, source_name):
+    return find_first_line(text, COMPANY_PATTERNS["anno"]) or year_from_name(source_name)
+
 def month_matches(text, month_key):
     if not month_key: return [False]*len(text)
     k = month_key.strip().lower()[:3]
     return text.str.contains(k, case=False, na=False)
 
 # ---------- splitting & parsing ----------
+EMPLOYEE_START = re.compile(r"(?=DIPENDENTE\s)")
+
+def is_employee_chunk(part):
+    return bool(re.search(CF_RE, part) or re.search(r"\bQUALIFICA\b", part, re.IGNORECASE))
+
 def split_employees(text):
     # spezza su “DIPENDENTE ” e filtra chunk “validi” (devono contenere CF o la parola QUALIFICA)
-    raw_parts = re.split(r"(?=DIPENDENTE\s)", text)
-    parts = []
-    for p in raw_parts:
-        if re.search(CF_RE, p) or re.search(r"\bQUALIFICA\b", p, re.IGNORECASE):
-            parts.append(p)
-    return parts
+    return [p for p in EMPLOYEE_START.split(text) if is_employee_chunk(p)]
+
+# ---------- campi del dipendente: pattern compilati una volta, un solo passaggio per chunk ----------
+# campo -> [(parola chiave, pattern), ...] in ordine di priorità (come find_first_line);
+# la parola chiave (maiuscola) è il testo letterale con cui inizia ogni match del pattern
+AMOUNT = rf"[^\d]*({EU_NUM})"
+FIELD_PATTERNS = {
+    "dipendente_nome": [("DIPENDENTE", r"DIPENDENTE\s+([^\n]+?)\s+(?:QUALIFICA|CODICE\s+FISCALE|RETRIBUZIONE|TIPO|MANSIONE)\b")],
+    "dipendente_nome_riga": [("DIPENDENTE", r"DIPENDENTE\s+([^\n]+)")],
+    "dipendente_cf": [(None, CF_RE)],
+    "matricola_inps": [("MATRICOLA", r"\bMATRICOLA\s+INPS\s+([0-9/]+)\b")],
+    "qualifica": [("QUALIFICA", r"\bQUALIFICA\s+([^\n]+)")],
+    "mansione": [("MANSIONE", r"\bMANSIONE\s+([^\n]+)")],
+    "livello": [("LIVELLO", r"\bLIVELLO\s+([^\n]+)")],
+    "tipo_rapporto": [("TIPO", r"\bTIPO\s+RAPPORTO\s+([^\n]+)")],
+    "data_assunzione": [("DATA", r"\bDATA\s+ASSUNZIONE\s+(\d{1,2}/\d{1,2}/\d{4})\b")],
+    "data_cessazione": [("DATA", r"\bDATA\s+CESSAZIONE\s+(\d{1,2}/\d{1,2}/\d{4})\b")],
+    "totale_competenze": [("TOTALE", r"\bTOTALE\s+COMPETENZE" + AMOUNT)],
+    "totale_trattenute": [("TOTALE", r"\bTOTALE\s+RITENUTE" + AMOUNT), ("TOTALE", r"\bTOTALE\s+TRATTENUTE" + AMOUNT)],
+    "netto_a_pagare": [("NETTO", r"\bNETTO\s*(?:IN\s*BUSTA|A\s*PAGARE)" + AMOUNT)],
+    "imponibile_previdenziale": [("TOTALE", r"\bTOTALE\s+IMPONIBILE\s+INPS" + AMOUNT),
+                                 ("IMPO", r"\bIMPO[NM]IBILE\s+PREVIDENZIALE" + AMOUNT)],
+    "imponibile_fiscale": [("IMPO", r"\bIMPO[NM]IBILE\s+FISCALE" + AMOUNT)],
+    "inps_dip": [("RITENUTE", r"\bRITENUTE\s+INPS" + AMOUNT), ("CONTRIB", r"\bCONTRIB(?:\.)?\s*INPS\s+DIP\.*" + AMOUNT)],
+    "inps_azienda": [(("INPS", "CONTRIB"), r"(?:\bINPS\s+DITTA|\bCONTRIB(?:\.)?\s*INPS\s+DITTA)" + AMOUNT)],
+    "inail_azienda": [("INAIL", r"\bINAIL" + AMOUNT)],
+    "tfr_mese": [("TFR", r"\bTFR\s+DEL\s+MESE" + AMOUNT)],
+    "quota_anno_tfr": [("RIVALUTAZIONE", r"\bRIVALUTAZIONE\s+QUOTA\s+ANNO\s+TFR" + AMOUNT),
+                       ("QUOTA", r"\bQUOTA\s+ANNO\s+TFR" + AMOUNT)],
+    "costo_azienda": [("COSTO", r"\bCOSTO\s+AZIENDA" + AMOUNT)],
+}
+SCANNER = FieldScanner(FIELD_PATTERNS)
+TEXT_FIELDS = ["dipendente_cf", "matricola_inps", "qualifica", "mansione", "livello", "tipo_rapporto",
+               "data_assunzione", "data_cessazione"]
+AMOUNT_FIELDS = ["totale_competenze", "totale_trattenute", "netto_a_pagare", "imponibile_previdenziale",
+                 "imponibile_fiscale", "inps_dip", "inps_azienda", "inail_azienda", "tfr_mese", "quota_anno_tfr"]
+# record: schema.PayslipRecord (importi in centesimi, presenze in un array); RECORD_COLUMNS è la
+# sua forma piatta (to_dict) scritta dai sink CSV/Parquet e letta dal report
+TEXT_COLUMNS = [c for c, kind in RECORD_COLUMNS.items() if kind == "str"]
+# colonne numeriche nell'ordine del foglio AggregatiMensili
+NUM_COLUMNS = ["totale_competenze","totale_trattenute","netto_a_pagare","imponibile_fiscale",
+               "imponibile_previdenziale","inps_dip","inps_azienda","inail_azienda",
+               "tfr_mese","quota_anno_tfr","costo_azienda"] + [f"occ_{c}" for c in PRES_CODES]
+
+def set_company(rec, comp):
+    # metadati azienda + periodo (CompanyFields.values) sul record
+    for field, value in comp.items():
+        setattr(rec, field, value)
 
 def parse_chunk(chunk, comp, verbose=False):
-    get = lambda pats: find_first_line(chunk, pats)
-
-    rec = {
-        # metadati azienda + periodo
-        "azienda_denominazione": comp.get("azienda_denominazione"),
-        "azienda_cf": comp.get("azienda_cf"),
-        "azienda_piva": comp.get("azienda_piva"),
-        "mese_retribuito": comp.get("mese_retribuito"),
-        "anno": comp.get("anno"),
-        "source_file": comp.get("source_file"),
-        # colonna manuale a dropdown
-        "sede_operativa": None,
-    }
+    found = SCANNER.scan(chunk)
 
     # --- anagrafica dipendente / contrattuale (fine riga, no DOTALL)
-    name = get([r"DIPENDENTE\s+([^\n]+?)\s+(?:QUALIFICA|CODICE\s+FISCALE|RETRIBUZIONE|TIPO|MANSIONE)\b"])
-    if not name:
-        name = get([r"DIPENDENTE\s+([^\n]+)"])
-    rec["dipendente_nome"] = " ".join((name or "").split()) or None
-
-    rec["dipendente_cf"] = get([CF_RE])
-    rec["matricola_inps"] = get([r"\bMATRICOLA\s+INPS\s+([0-9/]+)\b"])
-    rec["qualifica"] = get([r"\bQUALIFICA\s+([^\n]+)"])
-    rec["mansione"] = get([r"\bMANSIONE\s+([^\n]+)"])
-    rec["livello"] = get([r"\bLIVELLO\s+([^\n]+)"])
-    rec["tipo_rapporto"] = get([r"\bTIPO\s+RAPPORTO\s+([^\n]+)"])
-    rec["data_assunzione"] = get([r"\bDATA\s+ASSUNZIONE\s+(\d{1,2}/\d{1,2}/\d{4})\b"])
-    rec["data_cessazione"] = get([r"\bDATA\s+CESSAZIONE\s+(\d{1,2}/\d{1,2}/\d{4})\b"])
-
-    # --- retribuzione variabili / fisse (token tipici LUL Datev)
-    rec["totale_competenze"] = euro_to_float(get([rf"\bTOTALE\s+COMPETENZE[^\d]*({EU_NUM})"]))
-    rec["totale_trattenute"] = euro_to_float(get([rf"\bTOTALE\s+RITENUTE[^\d]*({EU_NUM})", rf"\bTOTALE\s+TRATTENUTE[^\d]*({EU_NUM})"]))
-    rec["netto_a_pagare"] = euro_to_float(get([rf"\bNETTO\s*(?:IN\s*BUSTA|A\s*PAGARE)[^\d]*({EU_NUM})"]))
-    rec["imponibile_previdenziale"] = euro_to_float(get([rf"\bTOTALE\s+IMPONIBILE\s+INPS[^\d]*({EU_NUM})", rf"\bIMPO[NM]IBILE\s+PREVIDENZIALE[^\d]*({EU_NUM})"]))
-    rec["imponibile_fiscale"] = euro_to_float(get([rf"\bIMPO[NM]IBILE\s+FISCALE[^\d]*({EU_NUM})"]))
-    rec["inps_dip"] = euro_to_float(get([rf"\bRITENUTE\s+INPS[^\d]*({EU_NUM})", rf"\bCONTRIB(?:\.)?\s*INPS\s+DIP\.*[^\d]*({EU_NUM})"]))
-    rec["inps_azienda"] = euro_to_float(get([rf"(?:\bINPS\s+DITTA|\bCONTRIB(?:\.)?\s*INPS\s+DITTA)[^\d]*({EU_NUM})"]))
-    rec["inail_azienda"] = euro_to_float(get([rf"\bINAIL[^\d]*({EU_NUM})"]))
-    rec["tfr_mese"] = euro_to_float(get([rf"\bTFR\s+DEL\s+MESE[^\d]*({EU_NUM})"]))
-    rec["quota_anno_tfr"] = euro_to_float(get([rf"\bRIVALUTAZIONE\s+QUOTA\s+ANNO\s+TFR[^\d]*({EU_NUM})",
-                                               rf"\bQUOTA\s+ANNO\s+TFR[^\d]*({EU_NUM})"]))
+    name = found["dipendente_nome"] or found["dipendente_nome_riga"]
+    rec = PayslipRecord(dipendente_nome=" ".join((name or "").split()) or None,
+                        **{field: found[field] for field in TEXT_FIELDS},
+                        # --- retribuzione variabili / fisse (token tipici LUL Datev), in centesimi
+                        **{field: to_cents(found[field]) for field in AMOUNT_FIELDS})
+    set_company(rec, comp)
+
     # spesso “costo azienda” non è stampato: lo calcoliamo se i pezzi ci sono
-    costo_az = euro_to_float(get([rf"\bCOSTO\s+AZIENDA[^\d]*({EU_NUM})"]))
+    costo_az = to_cents(found["costo_azienda"])
     if costo_az is None:
-        parts = [rec["totale_competenze"], rec["inps_azienda"], rec["inail_azienda"], rec["tfr_mese"]]
+        parts = [rec.totale_competenze, rec.inps_azienda, rec.inail_azienda, rec.tfr_mese]
         if any(x is not None for x in parts):
-            costo_az = sum(x or 0.0 for x in parts)
-    rec["costo_azienda"] = costo_az
+            costo_az = sum(x or 0 for x in parts)
+    rec.costo_azienda = costo_az
 
-    # --- presenze: conta codici (upper per sicurezza)
-    up = chunk.upper()
-    for code in PRES_CODES:
-        rec[f"occ_{code}"] = len(re.findall(rf"\b{code}\b", up))
+    # --- presenze: conta codici (upper per sicurezza), una sola tokenizzazione
+    occ = count_tokens(chunk.upper(), PRES_CODES)
+    rec.presenze = array(PRES_TYPECODE, [occ[code] for code in PRES_CODES])
 
     # scarto chunk “fantasma”: servono almeno CF o nome + qualifica
-    if not rec["dipendente_cf"] and not (rec["dipendente_nome"] and (rec["qualifica"] or rec["mansione"])):
+    if not rec.dipendente_cf and not (rec.dipendente_nome and (rec.qualifica or rec.mansione)):
         return None
 
     if verbose:
-        who = rec.get("dipendente_nome") or rec.get("dipendente_cf")
-        print(f"   → {who} | competenze={rec['totale_competenze']} netto={rec['netto_a_pagare']}")
+        who = rec.dipendente_nome or rec.dipendente_cf
+        print(f"   → {who} | competenze={to_euros(rec.totale_competenze)} netto={to_euros(rec.netto_a_pagare)}")
     return rec
 
-def parse_pdf_to_records(path: Path, verbose=False):
-    txt = extract_text(str(path)) or ""
-    txt = clean_text(txt)
-    comp = {
-        "azienda_denominazione": find_first_line(txt, [r"\bAZIENDA\s+([^\n]+)"]),
-        "azienda_cf": find_first_line(txt, [r"\bCODICE\s+FISCALE\s+([0-9/]{5,})"]),
-        "azienda_piva": find_first_line(txt, [r"\bPARTITA\s+IVA\s+([0-9/]{5,})"]),
-        "mese_retribuito": parse_month(txt),
-        "anno": parse_year(txt, path.name),
-        "source_file": path.name,
-    }
-    chunks = split_employees(txt)
-    if verbose: print(f"[{path.name}] blocchi validi: {len(chunks)} | mese={comp['mese_retribuito']} anno={comp['anno']}")
-    recs = []
-    for ch in chunks:
-        r = parse_chunk(ch, comp, verbose=verbose)
-        if r: recs.append(r)
+# ---------- lettura a pagine: record man mano che il PDF viene letto ----------
+# pagine lette prima di fissare i campi azienda/periodo: l'intestazione è a pagina 1; se un campo
+# manca del tutto (LUL senza "PARTITA IVA") i record non aspettano la fine del documento.
+# Un campo stampato per la prima volta dopo COMPANY_PAGES resta vuoto in tutti i record
+# (parse_text sul testo intero lo troverebbe): i record già usciti non si possono correggere
+COMPANY_PAGES = 1
+
+class CompanyFields:
+    # COMPANY_PATTERNS cercati finestra per finestra: un campo resta aperto finché non trova
+    # il suo pattern principale (un fallback trovato prima può ancora essere sostituito)
+    def __init__(self, source_name):
+        self.source_name = source_name
+        self.best = {}  # campo -> (priorità del pattern, valore)
+
+    def update(self, text):
+        for field, patterns in COMPANY_PATTERNS.items():
+            rank = self.best.get(field, (len(patterns),))[0]
+            for i, pat in enumerate(patterns[:rank]):
+                m = re.search(pat, text, re.IGNORECASE)
+                if m:
+                    self.best[field] = (i, m.group(1).strip())
+                    break
+
+    @property
+    def final(self):
+        return all(self.best.get(field, (1,))[0] == 0 for field in COMPANY_PATTERNS)
+
+    def values(self):
+        comp = {field: self.best[field][1] if field in self.best else None for field in COMPANY_PATTERNS}
+        comp["anno"] = to_year(comp["anno"] or year_from_name(self.source_name))
+        comp["source_file"] = self.source_name
+        return comp
+
+def iter_text_records(pages, source_name, verbose=False):
+    # pages: testi pagina in ordine (iter_page_texts). Restano in memoria solo la pagina corrente e
+    # il blocco del dipendente non ancora chiuso; i record escono appena il blocco successivo
+    # comincia. I campi azienda/periodo si fissano appena tutti hanno il pattern principale, al
+    # più tardi dopo COMPANY_PAGES pagine (con quanto trovato fin lì); i record aspettano solo
+    # fino ad allora. Stessi record di split_employees + parse_chunk sul testo intero quando
+    # l'intestazione sta nelle prime COMPANY_PAGES pagine
+    company = CompanyFields(source_name)
+    comp, tail, held, n_chunks, n_recs = {}, "", [], 0, 0
+    pages = iter(pages)
+    for page_num in itertools.count(1):
+        with tracing.span("text_extract", page=page_num):
+            page = next(pages, None)
+        last = page is None
+        with tracing.span("parse", page=page_num) as sp:
+            buf = tail + (clean_text(page) if page else "")
+            if not comp:
+                company.update(buf)
+                if company.final or last or page_num >= COMPANY_PAGES:
+                    comp = company.values()
+            starts = [m.start() for m in EMPLOYEE_START.finditer(buf)]
+            # l'ultimo blocco può continuare nella pagina successiva (tutto, a fine documento)
+            bounds = [0, *starts, len(buf)] if last else [0, *starts]
+            tail = "" if last else buf[bounds[-1]:]
+            ready = []
+            for a, b in zip(bounds, bounds[1:]):
+                if not is_employee_chunk(buf[a:b]):
+                    continue
+                n_chunks += 1
+                rec = parse_chunk(buf[a:b], comp, verbose=verbose)
+                if rec:
+                    held.append(rec)
+            if comp:
+                for rec in held:
+                    set_company(rec, comp)
+                ready, held = held, []
+            sp.set(records=len(ready))
+        n_recs += len(ready)
+        yield from ready
+        if last:
+            break
+    tracing.count("chunks", n_chunks)
+    tracing.count("records", n_recs)
+    if verbose:
+        print(f"[{source_name}] blocchi validi: {n_chunks} | mese={comp['mese_retribuito']} anno={comp['anno']}")
+
+def iter_pdf_records(path: Path, verbose=False, backend=DEFAULT_BACKEND):
+    # record di un PDF uno alla volta, pagina per pagina (LUL mensili da centinaia di pagine)
+    return iter_text_records(iter_page_texts(path, backend), path.name, verbose=verbose)
+
+def parse_pdf_to_records(path: Path, verbose=False, backend=DEFAULT_BACKEND):
+    # backend: "pymupdf" (veloce, default) o "pdfminer" (originale), vedi text_backends.py
+    with tracing.document(path, backend=backend):
+        return list(iter_pdf_records(path, verbose=verbose, backend=backend))
+
+def parse_text(txt, path: Path, verbose=False):
+    return list(iter_text_records([txt], path.name, verbose=verbose))
+
+def parse_pdf_cached(path: Path, verbose=False, backend=DEFAULT_BACKEND):
+    # cache su hash del PDF + versione parser (CEDOLINI_CACHE = file SQLite; senza, nessuna cache);
+    # in cache i record sono nella forma piatta (to_dict)
+    cache_path = os.environ.get("CEDOLINI_CACHE")
+    if not cache_path:
+        return parse_pdf_to_records(path, verbose=verbose, backend=backend)
+    with tracing.document(path, backend=backend):
+        with tracing.span("cache_lookup"):
+            key = file_key(path, PARSER_VERSION, backend, path.name)
+            recs = open_cache(cache_path).get(key)
+        if recs is not None:
+            tracing.count("parse_cache_hits")
+            flush_caches()
+            return [PayslipRecord.from_fields(r) for r in recs]
+        tracing.count("parse_cache_misses")
+        recs = parse_pdf_to_records(path, verbose=verbose, backend=backend)
+        open_cache(cache_path).set(key, [r.to_dict() for r in recs])
     return recs
 
 # ---------- sanitizzazione & QA ----------
-def sanitize_df(df):
-    df2 = df.copy()
-    for c in df2.columns:
-        if df2[c].dtype == object:
-            df2[c] = df2[c].astype(str).map(lambda x: CONTROL_CHARS.sub("", x))
+def map_unique(s, fn):
+    # fn una volta per valore distinto (le colonne testo ripetono pochi valori), mancanti -> None
+    import numpy as np
+    import pandas as pd
+    codes, uniques = pd.factorize(s)
+    mapped = np.array([fn(v) for v in uniques] + [None], dtype=object)
+    return pd.Series(mapped[codes], index=s.index, dtype=object)
+
+def eu_to_float_series(s):
+    # euro_to_float su una colonna intera: numeri lasciati come sono, stringhe "1.169,62" convertite
+    # in blocco; solo le stringhe irregolari (testo attorno al numero) passano da euro_to_float
+    import pandas as pd
+    if pd.api.types.is_numeric_dtype(s):
+        return s
+    if not (s.dtype == object or pd.api.types.is_string_dtype(s)):
+        return pd.to_numeric(s, errors="coerce")
+    is_str = s.str.len().notna()
+    out = pd.to_numeric(s.where(~is_str), errors="coerce")
+    if is_str.any():
+        txt = s[is_str]
+        norm = (txt.str.replace("\xa0", "", regex=False).str.replace(" ", "", regex=False)
+                   .str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+        parsed = pd.to_numeric(norm, errors="coerce")
+        odd = parsed.isna() & norm.str.contains(r"\d", regex=True)
+        if odd.any():
+            parsed[odd] = map_unique(txt[odd], euro_to_float).astype(float)
+        out[is_str] = parsed.astype(float)
+    return out
+
+def prepare_frame(df):
+    # pulizia + tipizzazione in un passaggio, sul dettaglio: aggregati e anagrafica derivano da qui.
+    # I mancanti restano mancanti (None/NaN), non la stringa "None".
+    df = df.copy()
+    for c in NUM_COLUMNS:
+        if c in df.columns:
+            df[c] = eu_to_float_series(df[c])
+    strip = lambda v: CONTROL_CHARS.sub("", v) if isinstance(v, str) else v
+    for c in TEXT_COLUMNS:
+        if c in df.columns:
+            df[c] = map_unique(df[c], strip)
+
+    # anno come testo ("2025"), anche se letto da una colonna numerica con mancanti (float)
+    df["anno"] = map_unique(df["anno"], lambda v: str(int(v)))
+    # Chiave tecnica
+    df["key_dipendente"] = df["dipendente_cf"].where(
+        df["dipendente_cf"].notna(),
+        (df["dipendente_nome"].fillna("")+"|"+df["mese_retribuito"].fillna("")+"|"+df["anno"].fillna("").astype(str))
+    )
     # normalizza capitalizzazione nome
-    if "dipendente_nome" in df2.columns:
-        df2["dipendente_nome"] = df2["dipendente_nome"].replace({"": None, "None": None})
-        df2["dipendente_nome"] = df2["dipendente_nome"].dropna().map(str.title).reindex(df2.index, fill_value=None)
-    return df2
+    df["dipendente_nome"] = map_unique(df["dipendente_nome"], lambda v: v.title() if isinstance(v, str) and v else None)
+    # mese/anno: pochi valori ripetuti su tutte le righe
+    for c in ["mese_retribuito", "anno"]:
+        df[c] = df[c].astype("category")
+    return df
 
 def qa_checks(df):
     out = []
@@ -199,6 +367,10 @@ def qa_checks(df):
     return out
 
 def write_excel_with_dropdown(df_det, df_agg, df_anag, out_xlsx):
+    import pandas as pd
+    from openpyxl.utils import get_column_letter
+    from openpyxl.worksheet.datavalidation import DataValidation
+
     with pd.ExcelWriter(out_xlsx, engine="openpyxl") as xlw:
         df_det.to_excel(xlw, sheet_name="DettaglioCedolini", index=False)
         df_agg.to_excel(xlw, sheet_name="AggregatiMensili", index=False)
@@ -222,29 +394,109 @@ def write_excel_with_dropdown(df_det, df_agg, df_anag, out_xlsx):
             # se la colonna non esiste, non fa nulla
             pass
 
-def build_outputs(pdf_paths, out_xlsx, verbose=False):
-    # Parse tutti i PDF
-    records = []
-    for i, p in enumerate(pdf_paths, 1):
-        if verbose: print(f"[{i}/{len(pdf_paths)}] {p.name}")
-        records += parse_pdf_to_records(p, verbose=verbose)
-    df = pd.DataFrame(records)
+def parse_files(pdf_paths, verbose=False, workers=1, backend=DEFAULT_BACKEND):
+    # (pdf, record) per ogni PDF nell'ordine di input; con workers > 1 su un pool di processi
+    if workers <= 1:
+        for i, p in enumerate(pdf_paths, 1):
+            if verbose: print(f"[{i}/{len(pdf_paths)}] {p.name}")
+            try:
+                recs = parse_pdf_cached(p, verbose=verbose, backend=backend)
+            except Exception as e:
+                print(f"[ERRORE] {p.name}: {e!r}", file=sys.stderr)
+                continue
+            yield p, recs
+        return
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        parse = partial(parse_pdf_cached, backend=backend)
+        results = map_ordered(ex, parse, pdf_paths, max_pending=2 * workers)
+        for i, (p, recs, err) in enumerate(results, 1):
+            if err is not None:
+                print(f"[ERRORE] {p.name}: {err}", file=sys.stderr)
+                continue
+            if verbose: print(f"[{i}/{len(pdf_paths)}] {p.name}: {len(recs)} record")
+            yield p, recs
+
+def parse_all(pdf_paths, verbose=False, workers=1, backend=DEFAULT_BACKEND):
+    for _, recs in parse_files(pdf_paths, verbose=verbose, workers=workers, backend=backend):
+        yield from recs
+
+# ---------- modalità incrementale (manifest + record salvati nel DB) ----------
+def init_record_store(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS cedolini_record (
+        source_path TEXT NOT NULL, seq INTEGER NOT NULL, payload TEXT NOT NULL,
+        PRIMARY KEY (source_path, seq)
+    );""")
+    conn.commit()
+
+def update_incremental(conn, pdf_paths, verbose=False, workers=1, backend=DEFAULT_BACKEND):
+    # riparsa solo i PDF nuovi/modificati ed elimina i record dei PDF cancellati
+    init_record_store(conn)
+    init_manifest(conn)
+    todo, deleted = plan(conn, "cedolini", pdf_paths)
+    print(f"[INCREMENTALE] {len(todo)} PDF nuovi o modificati, {len(deleted)} rimossi")
+    conn.executemany("DELETE FROM cedolini_record WHERE source_path = ?",
+                     [(p,) for p in deleted + [st.path for st in todo]])
+    forget(conn, "cedolini", deleted)
+    conn.commit()
+
+    states = {st.path: st for st in todo}
+    for p, recs in parse_files([Path(st.path) for st in todo], verbose=verbose, workers=workers, backend=backend):
+        with tracing.span("sqlite", doc=str(p), rows=len(recs)):
+            conn.executemany("INSERT INTO cedolini_record (source_path, seq, payload) VALUES (?,?,?)",
+                             [(str(p), i, json.dumps(r.to_dict(), ensure_ascii=False)) for i, r in enumerate(recs)])
+            mark_processed(conn, "cedolini", states[str(p)])
+            conn.commit()  # file per file: un crash non perde quanto già fatto
+
+def iter_stored_records(conn):
+    # tutti i record dell'archivio salvati nel DB, uno alla volta
+    for (payload,) in conn.execute("SELECT payload FROM cedolini_record ORDER BY source_path, seq"):
+        yield PayslipRecord.from_fields(json.loads(payload))
+
+def parse_incremental(pdf_paths, db_path, verbose=False, workers=1, backend=DEFAULT_BACKEND):
+    # restituisce tutti i record dell'archivio letti dal DB dopo l'aggiornamento
+    conn = sqlite3.connect(db_path)
+    update_incremental(conn, pdf_paths, verbose=verbose, workers=workers, backend=backend)
+    records = list(iter_stored_records(conn))
+    conn.close()
+    return records
+
+def stream_records(pdf_paths, stream_path, verbose=False, workers=1, db_path=None, backend=DEFAULT_BACKEND):
+    # scrive i record su JSONL/CSV/Parquet man mano che ogni PDF è parsato (memoria costante);
+    # in modalità incrementale aggiorna il DB e poi riversa tutto l'archivio dal DB
+    with open_sink(stream_path, RECORD_COLUMNS) as sink:
+        if db_path:
+            conn = sqlite3.connect(db_path)
+            try:
+                update_incremental(conn, pdf_paths, verbose=verbose, workers=workers, backend=backend)
+                sink.write(iter_stored_records(conn))
+            finally:
+                conn.close()
+        elif workers <= 1 and not os.environ.get("CEDOLINI_CACHE"):
+            # un solo processo, senza cache: i record arrivano al sink pagina per pagina, mentre il
+            # resto del PDF è ancora da leggere (un PDF che fallisce a metà lascia i record già scritti)
+            for i, p in enumerate(pdf_paths, 1):
+                if verbose: print(f"[{i}/{len(pdf_paths)}] {p.name}")
+                try:
+                    with tracing.document(p, backend=backend):
+                        sink.write(iter_pdf_records(p, verbose=verbose, backend=backend))
+                except Exception as e:
+                    print(f"[ERRORE] {p.name}: {e!r}", file=sys.stderr)
+        else:
+            for p, recs in parse_files(pdf_paths, verbose=verbose, workers=workers, backend=backend):
+                with tracing.span("sink", doc=str(p), rows=len(recs)):
+                    sink.write(recs)
+    print(f"[OK] {sink.count} record scritti in {stream_path}")
+    return sink.count
+
+def write_report(df, out_xlsx):
+    # Dettaglio + Aggregati + Anagrafica (XLSX) dai record già estratti
     if df.empty:
         raise SystemExit("Nessun record estratto: controlla i PDF o le regex.")
 
-    # Tipizzazioni numeriche
-    num_cols = ["totale_competenze","totale_trattenute","netto_a_pagare","imponibile_fiscale",
-                "imponibile_previdenziale","inps_dip","inps_azienda","inail_azienda",
-                "tfr_mese","quota_anno_tfr","costo_azienda"] + [f"occ_{c}" for c in PRES_CODES]
-    for c in num_cols:
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors="coerce")
-
-    # Chiave tecnica
-    df["key_dipendente"] = df["dipendente_cf"].where(
-        df["dipendente_cf"].notna(),
-        (df["dipendente_nome"].fillna("")+"|"+df["mese_retribuito"].fillna("")+"|"+df["anno"].fillna("").astype(str))
-    )
+    # Pulizia + tipizzazione (una volta, sul dettaglio)
+    with tracing.span("prepare_frame", rows=len(df)):
+        df = prepare_frame(df)
 
     # Anagrafica storica
     df_anag = (df.sort_values(["dipendente_cf","data_assunzione"])
@@ -262,35 +514,65 @@ def build_outputs(pdf_paths, out_xlsx, verbose=False):
 
     # Aggregati mensili per CFO (per sede_operativa manuale)
     group_keys = ["key_dipendente","dipendente_nome","dipendente_cf","mese_retribuito","anno","sede_operativa"]
-    df_mensile = (df.groupby(group_keys, dropna=False)[num_cols]
+    df_mensile = (df.groupby(group_keys, dropna=False, observed=True)[NUM_COLUMNS]
                     .sum(min_count=1)
                     .reset_index())
 
-    # Sanitize + QA
-    df_det_s = sanitize_df(df)
-    df_agg_s = sanitize_df(df_mensile)
-    df_anag_s = sanitize_df(df_anag)
-    msgs = qa_checks(df_det_s)
+    # QA
+    msgs = qa_checks(df)
     if msgs:
         print("\n".join(msgs))
 
     # Scrittura Excel con dropdown
-    write_excel_with_dropdown(df_det_s, df_agg_s, df_anag_s, out_xlsx)
+    with tracing.span("xlsx", rows=len(df)):
+        write_excel_with_dropdown(df, df_mensile, df_anag, out_xlsx)
     print(f"[OK] Creato: {out_xlsx}")
     return out_xlsx
 
+def build_outputs(pdf_paths, out_xlsx=None, verbose=False, workers=1, db_path=None, backend=DEFAULT_BACKEND,
+                  stream=None):
+    # con stream: record scritti su file man mano, il report XLSX (se richiesto) è letto da lì
+    if stream:
+        stream_records(pdf_paths, stream, verbose=verbose, workers=workers, db_path=db_path, backend=backend)
+        if out_xlsx:
+            return write_report(read_frame(stream, RECORD_COLUMNS), out_xlsx)
+        return stream
+    # Parse tutti i PDF (con db_path: solo quelli nuovi o modificati)
+    if db_path:
+        records = parse_incremental(pdf_paths, db_path, verbose=verbose, workers=workers, backend=backend)
+    else:
+        records = list(parse_all(pdf_paths, verbose=verbose, workers=workers, backend=backend))
+    return write_report(to_frame(records), out_xlsx)
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--cartella", required=True, help="Cartella con cedolini PDF")
-    ap.add_argument("--out", required=True, help="Percorso XLSX di output")
+    ap.add_argument("--out", help="Percorso XLSX di output (report con aggregati e anagrafica)")
+    ap.add_argument("--stream", help="Scrive i record PDF per PDF su " + "/".join(sorted(SINKS)) +
+                    " (formato dall'estensione); con --out il report è generato da questo file")
     ap.add_argument("--verbose", action="store_true", help="Log di avanzamento parsing")
+    ap.add_argument("--workers", type=int, default=1, help="Processi per il parsing (default: 1, seriale)")
+    ap.add_argument("--cache", help="File SQLite per la cache dei risultati (hash PDF + versione parser)")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Parsa solo i PDF nuovi o modificati; record e manifest in --db")
+    ap.add_argument("--db", default="gestionale_loves.db", help="DB SQLite per la modalità incrementale")
+    ap.add_argument("--backend", choices=sorted(TEXT_BACKENDS), default=DEFAULT_BACKEND,
+                    help="Estrazione testo: pymupdf (veloce) o pdfminer")
+    tracing.add_arguments(ap)
     args = ap.parse_args()
+    if not args.out and not args.stream:
+        ap.error("serve --out e/o --stream")
+    if args.cache:
+        os.environ["CEDOLINI_CACHE"] = args.cache  # ereditata dai worker
+    tracing.from_args(args)  # idem TRACE_FILE: i worker scrivono i loro span nello stesso file
 
     pdfs = list(Path(args.cartella).glob("*.pdf"))
     if not pdfs:
         raise SystemExit("Nessun PDF trovato nella cartella")
 
-    build_outputs(pdfs, args.out, verbose=args.verbose)
+    build_outputs(pdfs, args.out, verbose=args.verbose, workers=args.workers,
+                  db_path=args.db if args.incremental else None, backend=args.backend, stream=args.stream)
+    tracing.finish(args)
 
 if __name__ == "__main__":
     main()
@@ -1,16 +1,31 @@
 # estrattore_cedolini_con_mappa_v1.py
 import os
 import re
+import sys
+import bisect
+import queue
+import argparse
 import sqlite3
-import pandas as pd
+import threading
+from pathlib import Path
 import pdfplumber
-from tqdm import tqdm
-from typing import Dict, Any, Optional, List
+from pdfplumber.utils import chars_to_textmap, clip_obj
+# pandas (report) e tqdm (barra del main) importati dove servono: chi usa solo l'estrazione
+# (batch.py, templates.py, i worker del pool) non li carica
+from typing import Dict, Any, Optional, List, Iterator
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # moduli condivisi nella root del progetto
+from parallel import map_documents
+from manifest import init_manifest, plan, mark_processed, forget
+from schema import PayslipRecord, to_euros
+import tracing
 
 # --- CONFIGURAZIONE ---
 DB_PATH = "gestionale_loves.db"
 PDF_FOLDER = "cedolini1"
 EXCEL_REPORT_PATH = "report_cedolini_finale.xlsx"
+MAX_WORKERS = 1  # processi per l'estrazione (1 = seriale nel processo; più processi con --workers)
+BATCH_SIZE = 5000  # righe di dettaglio per executemany/commit del loader
 
 # ==============================================================================
 # === MAPPA DEL LAYOUT (GENERATA DALL'ANALISI DELL'ALTRO LLM) ===
@@ -42,13 +57,6 @@ LAYOUT_MAP = {
 # ==============================================================================
 
 # --- FUNZIONI DI SUPPORTO E DB (Invariate) ---
-def _parse_float(s: Optional[str]) -> Optional[float]:
-    if not s: return None
-    s = str(s).strip().replace(".", "").replace(",", ".")
-    s = re.sub(r'[^\d.-]', '', s)
-    try: return float(s)
-    except (ValueError, TypeError): return None
-
 def init_db(conn: sqlite3.Connection):
     cursor = conn.cursor()
     cursor.execute("""
@@ -63,33 +71,145 @@ def init_db(conn: sqlite3.Connection):
         imponibile_fiscale REAL, ritenute_inps REAL, tfr_mese REAL, source_file TEXT,
         FOREIGN KEY (dipendente_id) REFERENCES dim_dipendente (id)
     );""")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_dettaglio_periodo ON bi_labor_dettaglio (dipendente_id, anno, mese_retribuito)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_dettaglio_source ON bi_labor_dettaglio (source_file)")
     conn.commit()
 
-def load_data(conn: sqlite3.Connection, data: dict):
+def set_pragmas(conn: sqlite3.Connection):
+    # WAL: il writer non blocca i lettori (report, query BI); NORMAL basta con WAL
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+INSERT_DIPENDENTE = ("INSERT INTO dim_dipendente (dipendente_cf, dipendente_nome, qualifica, mansione, livello, data_assunzione, data_nascita) "
+                     "VALUES (?,?,?,?,?,?,?)")
+INSERT_DETTAGLIO = """
+    INSERT OR REPLACE INTO bi_labor_dettaglio (key_dipendente, dipendente_id, mese_retribuito, anno,
+    totale_competenze, totale_trattenute, netto_a_pagare, imponibile_fiscale, ritenute_inps, tfr_mese, source_file)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?)
+    """
+
+def record_key(rec: PayslipRecord) -> str:
+    return f"{rec.dipendente_cf}_{rec.anno}{rec.mese_retribuito}"
+
+def _dipendente_row(cf: str, rec: PayslipRecord) -> tuple:
+    return (cf, rec.dipendente_nome, rec.qualifica, rec.mansione, rec.livello, rec.data_assunzione, rec.data_nascita)
+
+def _dettaglio_row(dipendente_id: int, rec: PayslipRecord) -> tuple:
+    # importi del record in centesimi, nel DB in euro (colonne REAL)
+    return (
+        record_key(rec), dipendente_id, rec.mese_retribuito, rec.anno,
+        to_euros(rec.totale_competenze), to_euros(rec.totale_trattenute),
+        to_euros(rec.netto_a_pagare), to_euros(rec.imponibile_fiscale), to_euros(rec.inps_dip),
+        to_euros(rec.tfr_mese), rec.source_file
+    )
+
+def load_data(conn: sqlite3.Connection, data: PayslipRecord):
     cursor = conn.cursor()
-    cf = data.get('codice_fiscale')
+    cf = data.dipendente_cf
     if not cf: return
     cursor.execute("SELECT id FROM dim_dipendente WHERE dipendente_cf = ?", (cf,))
     res = cursor.fetchone()
     if res:
         dipendente_id = res[0]
     else:
-        cursor.execute("INSERT INTO dim_dipendente (dipendente_cf, dipendente_nome, qualifica, mansione, livello, data_assunzione, data_nascita) VALUES (?,?,?,?,?,?,?)",
-                       (cf, data.get('dipendente'), data.get('qualifica'), data.get('mansione'), data.get('livello'), data.get('data_assunzione'), data.get('data_di_nascita')))
+        cursor.execute(INSERT_DIPENDENTE, _dipendente_row(cf, data))
         dipendente_id = cursor.lastrowid
     
-    cursor.execute("""
-    INSERT OR REPLACE INTO bi_labor_dettaglio (key_dipendente, dipendente_id, mese_retribuito, anno,
-    totale_competenze, totale_trattenute, netto_a_pagare, imponibile_fiscale, ritenute_inps, tfr_mese, source_file)
-    VALUES (?,?,?,?,?,?,?,?,?,?,?)
-    """,(
-        data.get('key_dipendente'), dipendente_id, data.get('mese_retribuito'), data.get('anno'),
-        data.get('totale_competenze'), data.get('totale_trattenute'),
-        data.get('netto_in_busta'), data.get('imponibile_fiscale'), data.get('ritenute_inps'),
-        data.get('tfr_del_mese'), data.get('source_file')
-    ))
+    cursor.execute(INSERT_DETTAGLIO, _dettaglio_row(dipendente_id, data))
+
+class BulkLoader:
+    # stesso risultato di load_data riga per riga, ma: mappa cf -> id in memoria (una INSERT solo per
+    # i dipendenti nuovi), dettagli accumulati e scritti con executemany, un commit ogni batch_size righe.
+    # I file segnati con mark() entrano nel manifest nello stesso commit delle loro righe.
+    def __init__(self, conn: sqlite3.Connection, batch_size: int = BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.ids = dict(conn.execute("SELECT dipendente_cf, id FROM dim_dipendente"))
+        self.rows: List[tuple] = []
+        self.processed = []
+        self.loaded = 0
+
+    def add(self, data: PayslipRecord):
+        cf = data.dipendente_cf
+        if not cf: return
+        dipendente_id = self.ids.get(cf)
+        if dipendente_id is None:
+            dipendente_id = self.conn.execute(INSERT_DIPENDENTE, _dipendente_row(cf, data)).lastrowid
+            self.ids[cf] = dipendente_id
+        self.rows.append(_dettaglio_row(dipendente_id, data))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def mark(self, pipeline: str, state):
+        self.processed.append((pipeline, state))
+
+    def flush(self):
+        with tracing.span("sqlite", rows=len(self.rows), files=len(self.processed)):
+            self.conn.executemany(INSERT_DETTAGLIO, self.rows)
+            for pipeline, state in self.processed:
+                mark_processed(self.conn, pipeline, state)
+            self.conn.commit()
+        self.loaded += len(self.rows)
+        self.rows, self.processed = [], []
+
+class WriterThread(threading.Thread):
+    # unico writer SQLite: i risultati dei worker arrivano da una coda limitata, così il parsing
+    # nel processo principale non aspetta i commit e la memoria resta limitata
+    def __init__(self, db_path: str, batch_size: int = BATCH_SIZE, max_queue: int = 256):
+        super().__init__(name="sqlite-writer", daemon=True)
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.error: Optional[BaseException] = None
+        self.loaded = 0
+
+    def run(self):
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            set_pragmas(conn)
+            loader = BulkLoader(conn, self.batch_size)
+            while (item := self.queue.get()) is not None:
+                records, processed = item
+                for record in records:
+                    loader.add(record)
+                if processed is not None:
+                    loader.mark(*processed)
+            loader.flush()
+            self.loaded = loader.loaded
+        except BaseException as e:
+            self.error = e
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _put(self, item):
+        while True:
+            if self.error is not None or not self.is_alive():
+                raise RuntimeError(f"writer SQLite terminato: {self.error!r}")
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def add_file(self, records: List[PayslipRecord], pipeline: Optional[str] = None, state=None):
+        # tutte le righe di un PDF in un solo elemento della coda (+ manifest, se incrementale)
+        self._put((records, (pipeline, state) if pipeline else None))
+
+    def close(self):
+        if self.is_alive():
+            self._put(None)
+            self.join()
+        if self.error is not None:
+            raise self.error
+
+def remove_file_records(conn: sqlite3.Connection, filenames: List[str]):
+    # righe di dettaglio di PDF cancellati o da rielaborare
+    conn.executemany("DELETE FROM bi_labor_dettaglio WHERE source_file = ?", [(f,) for f in filenames])
 
 def create_excel_report(conn: sqlite3.Connection):
+    import pandas as pd
     print(f"\nCreazione del report Excel: {EXCEL_REPORT_PATH}...")
     try:
         df_dettaglio = pd.read_sql_query("SELECT * FROM bi_labor_dettaglio", conn)
@@ -105,22 +225,65 @@ def create_excel_report(conn: sqlite3.Connection):
 
 # --- LOGICA DI ESTRAZIONE CON MAPPA ---
 
-def extract_data_with_layout(page, layout_map: Dict[str, Dict], source_file: str) -> Optional[Dict[str, Any]]:
+CF_PATTERN = re.compile(r'\b([A-Z]{6}\d{2}[A-Z]\d{2}[A-Z]\d{3}[A-Z])\b')
+YEAR_PATTERN = re.compile(r'\b(20\d{2})\b')
+LABEL_PATTERNS = {label: re.compile(label, re.IGNORECASE) for label in LAYOUT_MAP}
+
+# indice della pagina: caratteri ordinati per 'top', ogni riquadro valore è una bisect invece di un
+# page.crop() (che ritaglia tutti i caratteri della pagina e rifà il clustering a ogni etichetta)
+class PageIndex:
+    def __init__(self, page):
+        self.page = page
+        chars = page.chars
+        # indici dei caratteri ordinati per top (i caratteri restano nell'ordine originale nel testo estratto)
+        self._order = sorted(range(len(chars)), key=lambda i: chars[i]['top'])
+        self._tops = [chars[i]['top'] for i in self._order]
+        self._max_height = max((c['bottom'] - c['top'] for c in chars), default=0)
+
+    def textmap(self, **kwargs):
+        # pdfplumber memorizza già la TextMap della pagina per combinazione di parametri
+        return self.page.get_textmap(**kwargs)
+
+    def text(self, **kwargs) -> str:
+        return self.textmap(**kwargs).as_string
+
+    def find_label(self, label: str) -> Optional[Dict[str, Any]]:
+        # stessa TextMap (parametri di default) di page.search(label, case=False) ed extract_text()
+        matches = self.textmap().search(LABEL_PATTERNS.get(label) or re.compile(label, re.IGNORECASE))
+        return matches[0] if matches else None
+
+    def chars_in(self, bbox) -> List[Dict[str, Any]]:
+        # come page.crop(bbox).chars: caratteri che toccano il riquadro, ritagliati sul riquadro
+        x0, top, x1, bottom = bbox
+        chars = self.page.chars
+        lo = bisect.bisect_left(self._tops, top - self._max_height)
+        hi = bisect.bisect_right(self._tops, bottom)
+        hits = sorted(i for i in self._order[lo:hi]
+                      if chars[i]['x0'] <= x1 and chars[i]['x1'] >= x0 and chars[i]['bottom'] >= top)
+        return [c for c in (clip_obj(chars[i], bbox) for i in hits) if c]
+
+    def text_in(self, bbox, **kwargs) -> str:
+        chars = self.chars_in(bbox)
+        if not chars:
+            return ""
+        return chars_to_textmap(chars, layout_bbox=bbox, **kwargs).as_string
+
+def extract_data_with_layout(page, layout_map: Dict[str, Dict], source_file: str) -> Optional[PayslipRecord]:
     data = {'source_file': source_file}
+    with tracing.span("index"):  # include il parsing dei caratteri della pagina (pdfminer)
+        index = PageIndex(page)
     
     # Trova il codice fiscale come ancora principale per assicurarsi che sia un cedolino valido
-    cf_match = re.search(r'\b([A-Z]{6}\d{2}[A-Z]\d{2}[A-Z]\d{3}[A-Z])\b', page.extract_text(x_tolerance=2) or "")
+    cf_match = CF_PATTERN.search(index.text(x_tolerance=2) or "")
     if not cf_match:
         return None
     
     for label, properties in layout_map.items():
         # Usiamo una ricerca flessibile per l'etichetta
-        label_occurrences = page.search(label, case=False, whole_words=True)
-        if not label_occurrences:
+        label_bbox = index.find_label(label)
+        if not label_bbox:
             continue
         
-        label_bbox = label_occurrences[0]
-        
         # Applica l'offset appreso per definire l'area del valore
         value_bbox = (
             label_bbox['x0'] + properties['offset_x'],
@@ -135,8 +298,7 @@ def extract_data_with_layout(page, layout_map: Dict[str, Dict], source_file: str
                 value_bbox[2] <= page.width and value_bbox[3] <= page.height):
             continue
 
-        cropped_page = page.crop(value_bbox)
-        extracted_value = cropped_page.extract_text(x_tolerance=2, y_tolerance=2)
+        extracted_value = index.text_in(value_bbox, x_tolerance=2, y_tolerance=2)
         
         if extracted_value:
             # Crea una chiave pulita per il dizionario (es. 'NETTO IN BUSTA' -> 'netto_in_busta')
@@ -147,46 +309,93 @@ def extract_data_with_layout(page, layout_map: Dict[str, Dict], source_file: str
     if not data.get('codice_fiscale'):
         data['codice_fiscale'] = cf_match.group(1)
         
-    anno_match = re.search(r'\b(20\d{2})\b', page.extract_text() or "")
+    anno_match = YEAR_PATTERN.search(index.text() or "")
     data['anno'] = int(anno_match.group(1)) if anno_match else None
     
     if not all([data.get('codice_fiscale'), data.get('anno'), data.get('mese_retribuito')]):
         return None # Salta se i dati chiave non sono stati estratti
         
-    data['key_dipendente'] = f"{data['codice_fiscale']}_{data['anno']}{data['mese_retribuito']}"
-    
-    # Converte i valori numerici
-    for key, value in data.items():
-        if key in ['totale_competenze', 'totale_trattenute', 'netto_in_busta', 'imponibile_fiscale', 'ritenute_inps', 'tfr_del_mese']:
-            data[key] = _parse_float(value)
-            
-    return data
+    # chiavi delle etichette -> campi di schema.PayslipRecord (importi in centesimi); le etichette
+    # fuori schema (INDIRIZZO, SEDE INAIL, ... o quelle di altri template) restano in extra
+    return PayslipRecord.from_fields(data)
+
+def iter_file_records(file_path: str, layout_map: Dict[str, Dict] = LAYOUT_MAP) -> Iterator[PayslipRecord]:
+    # record pagina per pagina; page.close() libera caratteri e TextMap già letti, così un LUL da
+    # centinaia di pagine tiene in memoria una pagina alla volta
+    filename = os.path.basename(file_path)
+    with pdfplumber.open(file_path) as pdf:
+        for page_num, page in enumerate(pdf.pages, 1):
+            with tracing.span("page", page=page_num):
+                record = extract_data_with_layout(page, layout_map, filename)
+            page.close()
+            tracing.count("pages")
+            if record:
+                tracing.count("records")
+                yield record
+
+def extract_file_records(file_path: str, layout_map: Dict[str, Dict] = LAYOUT_MAP) -> List[PayslipRecord]:
+    # tutte le pagine valide di un PDF (eseguita anche nei processi worker); layout_map: altro
+    # template del registro (templates.py), di default quello appreso sopra
+    with tracing.document(file_path):
+        return list(iter_file_records(file_path, layout_map))
 
 # --- MAIN ---
 def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--incremental", action="store_true",
+                    help="Elabora solo i PDF nuovi o modificati e rimuove i dati dei PDF cancellati (manifest nel DB)")
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                    help="Righe di dettaglio per executemany/commit (default: %(default)s)")
+    ap.add_argument("--workers", type=int, default=MAX_WORKERS,
+                    help="Processi per l'estrazione in parallelo (default: %(default)s, seriale)")
+    tracing.add_arguments(ap)
+    args = ap.parse_args()
+    tracing.from_args(args)  # prima del pool: i worker ereditano TRACE_FILE
+
     if not os.path.exists(PDF_FOLDER):
         print(f"ERRORE: La cartella '{PDF_FOLDER}' non esiste.")
         return
 
     conn = sqlite3.connect(DB_PATH)
+    set_pragmas(conn)
     init_db(conn)
     
     pdf_files = [f for f in os.listdir(PDF_FOLDER) if f.lower().endswith('.pdf')]
+    file_paths = [os.path.join(PDF_FOLDER, f) for f in pdf_files]
     
-    for filename in tqdm(pdf_files, desc="Processing PDFs"):
-        file_path = os.path.join(PDF_FOLDER, filename)
-        try:
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    record = extract_data_with_layout(page, LAYOUT_MAP, filename)
-                    if record:
-                        load_data(conn, record)
-        except Exception as e:
-            print(f"\nErrore durante l'elaborazione del file {filename}: {e}")
+    states = {}
+    if args.incremental:
+        init_manifest(conn)
+        todo, deleted = plan(conn, "pc", file_paths)
+        remove_file_records(conn, [os.path.basename(p) for p in deleted] + [os.path.basename(s.path) for s in todo])
+        forget(conn, "pc", deleted)
+        conn.commit()
+        states = {s.path: s for s in todo}
+        file_paths = [s.path for s in todo]
+        print(f"Incrementale: {len(todo)} PDF nuovi o modificati, {len(deleted)} rimossi")
     
-    conn.commit()
-    create_excel_report(conn)
+    # estrazione (in parallelo con --workers); un solo thread scrive su SQLite a batch (ordine dei file preservato)
+    from tqdm import tqdm
+    writer = WriterThread(DB_PATH, args.batch_size)
+    writer.start()
+    try:
+        results = map_documents(extract_file_records, file_paths, args.workers)
+        for file_path, records, error in tqdm(results, total=len(file_paths), desc="Processing PDFs"):
+            if error is not None:
+                print(f"\nErrore durante l'elaborazione del file {os.path.basename(file_path)}: {error}")
+                continue
+            if args.incremental:
+                writer.add_file(records, "pc", states[file_path])
+            else:
+                writer.add_file(records)
+    finally:
+        writer.close()
+    print(f"{writer.loaded} righe di dettaglio caricate")
+    
+    with tracing.span("report"):
+        create_excel_report(conn)
     conn.close()
+    tracing.finish(args)
     print("\nProcesso completato.")
 
 if __name__ == "__main__":
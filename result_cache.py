@@ -0,0 +1,171 @@
+# result_cache.py — content-addressed result cache: in-memory LRU in front of SQLite
+#
+# Keys are hashes of the input content (preprocessed crop bytes, PDF bytes) plus whatever
+# changes the output (OCR config, parser version), so a changed input or a new parser
+# version simply misses. The SQLite tier is bounded by total value size and evicts the
+# least recently used rows; several processes can share one file. Disk hits do not
+# write: the keys they touch are buffered and their last_access goes out in one
+# executemany per document (flush_caches()), at TOUCH_BATCH keys, on set() and close().
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+_MISSING = object()
+TOUCH_BATCH = 256
+
+
+def _digest(*parts):
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else repr(part).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def array_key(array, *parts):
+    # numpy image + config: hash the pixels, not the object
+    return _digest(str(array.dtype), array.shape, array.tobytes(), *parts)
+
+
+def file_key(path, *parts, chunk_size=1 << 20):
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return _digest(h.digest(), *parts)
+
+
+class ResultCache:
+    def __init__(self, path=None, memory_items=4096, max_disk_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.memory_items = memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = self.misses = 0
+        self._memory = OrderedDict()
+        self._conn = None
+        self._pid = None
+        self._disk_bytes = 0
+        self._touched = {}  # key -> last access time not written yet
+
+    def _db(self):
+        # one connection per process: never reuse a connection inherited through fork
+        if self.path is None:
+            return None
+        if self._conn is None or self._pid != os.getpid():
+            self._touched = {}  # the parent's pending touches are the parent's to write
+            self._conn = sqlite3.connect(self.path, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL
+            )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_access ON results (last_access)")
+            self._conn.commit()
+            self._pid = os.getpid()
+            self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        return self._conn
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key, default=None):
+        value = self._memory.get(key, _MISSING)
+        if value is not _MISSING:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return value
+        db = self._db()
+        row = db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone() if db else None
+        if row is None:
+            self.misses += 1
+            return default
+        self._touched[key] = time.time()
+        if len(self._touched) >= TOUCH_BATCH:
+            self.flush()
+        value = json.loads(row[0])
+        self._remember(key, value)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._remember(key, value)
+        db = self._db()
+        if db is None:
+            return
+        payload = json.dumps(value, ensure_ascii=False)
+        # an overwritten row gives its size back (workers setting the same key, a recomputed result)
+        old = db.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+        db.execute("INSERT OR REPLACE INTO results (key, value, size, last_access) VALUES (?,?,?,?)",
+                   (key, payload, len(payload), time.time()))
+        self._touched.pop(key, None)
+        self._write_touched(db)
+        db.commit()
+        self._disk_bytes += len(payload) - (old[0] if old else 0)
+        if self._disk_bytes > self.max_disk_bytes:
+            self._evict()
+
+    def _write_touched(self, db):
+        if self._touched:
+            db.executemany("UPDATE results SET last_access = ? WHERE key = ?",
+                           [(when, key) for key, when in self._touched.items()])
+            self._touched = {}
+
+    def flush(self):
+        # write the buffered last_access times of disk hits
+        if self._touched and self._conn is not None and self._pid == os.getpid():
+            self._write_touched(self._conn)
+            self._conn.commit()
+
+    def _evict(self):
+        # drop least recently used rows until 90% of the budget is free again
+        db = self._db()
+        self._disk_bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        target = int(self.max_disk_bytes * 0.9)
+        while self._disk_bytes > target:
+            rows = db.execute("SELECT key, size FROM results ORDER BY last_access LIMIT 256").fetchall()
+            if not rows:
+                break
+            victims = []
+            for key, size in rows:
+                if self._disk_bytes <= target:
+                    break
+                victims.append((key,))
+                self._disk_bytes -= size
+            db.executemany("DELETE FROM results WHERE key = ?", victims)
+        db.commit()
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self.flush()
+            self._conn.close()
+        self._conn = None
+
+
+_caches = {}
+
+
+def open_cache(path=None, **kwargs):
+    # one ResultCache per path and process (path None = memory only)
+    cache = _caches.get(path)
+    if cache is None:
+        cache = _caches[path] = ResultCache(path, **kwargs)
+    return cache
+
+
+def flush_caches():
+    # end of a document: one last_access write per open cache instead of one per hit
+    for cache in _caches.values():
+        cache.flush()
@@ -0,0 +1,292 @@
+# schema.py — one typed record for the payslips read by every extractor
+#
+# The three extractors name the same values differently: parse_cedolini.py (LUL text) has
+# "netto_a_pagare" and "tfr_mese", pc.py derives keys from its labels ("netto_in_busta",
+# "tfr_del_mese", "totale_ritenute") and main.py data_map has its own set. PayslipRecord
+# has one fixed set of fields, the LUL parser's names; ALIASES maps the other names onto it.
+#
+# A record is a slots dataclass, not a ~40-key dict: amounts are integer cents (exact
+# sums, no float parsing in the hot loop), the 11 presence counters are one small
+# unsigned array in PRES_CODES order, and labels outside the schema (pc.py layout maps of
+# other templates) go to `extra`. Per record that is ~930 bytes instead of ~1600 for the
+# dict (the per-key hash table goes, the values remain); as Arrow columns ~320 bytes:
+#
+#     uv run schema.py --records 100000        # bytes per record: dict, PayslipRecord, Arrow
+#
+# Outside the process the records keep their flat form: to_dict() gives the historical
+# keys (amounts in euros, one occ_<CODE> column per presence code), which is what the
+# JSONL/CSV/Parquet sinks, the result cache and the XLSX report read. Many records at once
+# become columns with to_frame() (pandas, euros, for the report) or to_arrow() (typed
+# Arrow table: amounts int64 cents, presences uint16).
+from array import array
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+import argparse
+import re
+import time
+
+PRES_CODES = ("FE", "FT", "A1", "RS", "ROL", "MAL", "INF", "MAT", "PERM", "STRAORD", "FG")  # FG = festività non goduta
+PRES_TYPECODE = "H"  # uint16 per counter
+
+TEXT_FIELDS = ("azienda_denominazione", "azienda_cf", "azienda_piva", "mese_retribuito", "source_file",
+               "sede_operativa", "dipendente_nome", "dipendente_cf", "matricola_inps", "qualifica", "mansione",
+               "livello", "tipo_rapporto", "data_assunzione", "data_cessazione", "data_nascita")
+AMOUNT_FIELDS = ("totale_competenze", "totale_trattenute", "netto_a_pagare", "imponibile_previdenziale",
+                 "imponibile_fiscale", "inps_dip", "inps_azienda", "inail_azienda", "tfr_mese", "quota_anno_tfr",
+                 "costo_azienda")
+
+# names used by pc.py (label -> key) and main.py data_map -> schema field
+ALIASES = {
+    "azienda": "azienda_denominazione",
+    "partita_iva": "azienda_piva",
+    "dipendente": "dipendente_nome",
+    "codice_fiscale": "dipendente_cf",
+    "data_di_nascita": "data_nascita",
+    "totale_ritenute": "totale_trattenute",
+    "netto_in_busta": "netto_a_pagare",
+    "ritenute_inps": "inps_dip",
+    "tfr_del_mese": "tfr_mese",
+}
+
+# flat columns of to_dict(), in order, as {name: "str" | "int" | "float"} (sinks.py schema)
+RECORD_COLUMNS = {
+    **{name: "str" for name in ("azienda_denominazione", "azienda_cf", "azienda_piva", "mese_retribuito")},
+    "anno": "int",
+    **{name: "str" for name in TEXT_FIELDS[4:]},
+    **{name: "float" for name in AMOUNT_FIELDS},
+    **{f"occ_{code}": "int" for code in PRES_CODES},
+}
+
+NUMBER_RE = re.compile(r"[-+]?\d+(?:\.\d+)?")
+YEAR_RE = re.compile(r"\b((?:19|20)\d{2})\b")
+
+
+def to_cents(value):
+    # "1.169,62" / "€ 1.169,62-" / 1169.62 -> 116962; the last number in the text counts
+    # (parse_cedolini.euro_to_float), None when there is none
+    if value is None or value == "":
+        return None
+    if isinstance(value, int):
+        return value * 100
+    if isinstance(value, float):
+        return round(value * 100)
+    text = str(value).replace("\xa0", "").replace(" ", "").replace(".", "").replace(",", ".")
+    numbers = NUMBER_RE.findall(text)
+    if not numbers:
+        return None
+    try:
+        return int((Decimal(numbers[-1]) * 100).to_integral_value())
+    except InvalidOperation:
+        return None
+
+
+def to_euros(cents):
+    return None if cents is None else cents / 100
+
+
+def to_year(value):
+    if value is None or isinstance(value, int):
+        return value
+    m = YEAR_RE.search(str(value))
+    return int(m.group(1)) if m else None
+
+
+def empty_presences():
+    return array(PRES_TYPECODE, bytes(len(PRES_CODES) * array(PRES_TYPECODE).itemsize))
+
+
+@dataclass(slots=True)
+class PayslipRecord:
+    # company and period
+    azienda_denominazione: str | None = None
+    azienda_cf: str | None = None
+    azienda_piva: str | None = None
+    mese_retribuito: str | None = None
+    anno: int | None = None
+    source_file: str | None = None
+    sede_operativa: str | None = None  # filled by hand in the XLSX report
+    # employee
+    dipendente_nome: str | None = None
+    dipendente_cf: str | None = None
+    matricola_inps: str | None = None
+    qualifica: str | None = None
+    mansione: str | None = None
+    livello: str | None = None
+    tipo_rapporto: str | None = None
+    data_assunzione: str | None = None
+    data_cessazione: str | None = None
+    data_nascita: str | None = None
+    # amounts, integer cents
+    totale_competenze: int | None = None
+    totale_trattenute: int | None = None
+    netto_a_pagare: int | None = None
+    imponibile_previdenziale: int | None = None
+    imponibile_fiscale: int | None = None
+    inps_dip: int | None = None
+    inps_azienda: int | None = None
+    inail_azienda: int | None = None
+    tfr_mese: int | None = None
+    quota_anno_tfr: int | None = None
+    costo_azienda: int | None = None
+    # occurrences of each PRES_CODES code
+    presenze: array = field(default_factory=empty_presences)
+    # values outside the schema (labels of other layout templates), None when there are none
+    extra: dict | None = None
+
+    def presence(self, code):
+        return self.presenze[PRES_CODES.index(code)]
+
+    def get(self, name, default=None):
+        # flat-dict style access by schema field, alias, occ_<CODE> or extra key (scoring, QA)
+        name = ALIASES.get(name, name)
+        if name.startswith("occ_") and name[4:] in PRES_CODES:
+            return self.presence(name[4:])
+        if name in AMOUNT_FIELDS:
+            return to_euros(getattr(self, name))
+        if name in RECORD_COLUMNS:
+            return getattr(self, name)
+        return (self.extra or {}).get(name, default)
+
+    def to_dict(self):
+        # flat form: historical keys, amounts in euros, occ_<CODE> columns, then the extra values
+        out = {name: getattr(self, name) for name in RECORD_COLUMNS if not name.startswith("occ_")}
+        for name in AMOUNT_FIELDS:
+            out[name] = to_euros(out[name])
+        out.update(zip((f"occ_{code}" for code in PRES_CODES), self.presenze))
+        if self.extra:
+            out.update(self.extra)
+        return out
+
+    @classmethod
+    def from_fields(cls, values, **defaults):
+        # any extractor's dict (or to_dict() output) -> record; text amounts are parsed, keys
+        # outside the schema end up in extra
+        rec = cls(**defaults)
+        for key, value in values.items():
+            name = ALIASES.get(key, key)
+            if name in AMOUNT_FIELDS:
+                setattr(rec, name, to_cents(value))
+            elif name == "anno":
+                rec.anno = to_year(value)
+            elif name in TEXT_FIELDS:
+                setattr(rec, name, None if value is None or value == "" else str(value))
+            elif name.startswith("occ_") and name[4:] in PRES_CODES:
+                rec.presenze[PRES_CODES.index(name[4:])] = int(value or 0)
+            elif not key.startswith("_"):  # "_errors" of the OCR extractor is not data
+                if rec.extra is None:
+                    rec.extra = {}
+                rec.extra[key] = value
+        return rec
+
+
+def json_default(obj):
+    # json.dumps(default=...) for results holding records (batch.py, service.py)
+    if isinstance(obj, PayslipRecord):
+        return obj.to_dict()
+    return str(obj)
+
+
+def records_from_result(result, extractor, source_file=None):
+    # output of any batch.EXTRACTORS entry -> list of PayslipRecord
+    if extractor == "auto":
+        extractor, result = result["extractor"], result.get("fields", result.get("records"))
+    if extractor == "ocr":
+        return [PayslipRecord.from_fields(result, source_file=source_file)]
+    return [rec if isinstance(rec, PayslipRecord) else PayslipRecord.from_fields(rec) for rec in result]
+
+
+# --- columns ---
+
+def columns(records):
+    # {flat column: list of values} in RECORD_COLUMNS order; amounts stay in cents
+    records = list(records)
+    out = {name: [getattr(rec, name) for rec in records]
+           for name in RECORD_COLUMNS if not name.startswith("occ_")}
+    for i, code in enumerate(PRES_CODES):
+        out[f"occ_{code}"] = [rec.presenze[i] for rec in records]
+    return out
+
+
+ARROW_TYPES = {"str": "string", "int": "int16", "amount": "int64", "presence": "uint16"}
+
+
+def arrow_schema():
+    import pyarrow as pa
+
+    kinds = {name: "amount" if name in AMOUNT_FIELDS else "presence" if name.startswith("occ_") else kind
+             for name, kind in RECORD_COLUMNS.items()}
+    return pa.schema([(name, ARROW_TYPES[kind]) for name, kind in kinds.items()])
+
+
+def to_arrow(records):
+    # typed columnar batch: text as strings, anno int16, amounts int64 cents, presences uint16
+    import pyarrow as pa
+
+    schema = arrow_schema()
+    cols = columns(records)
+    return pa.Table.from_arrays([pa.array(cols[f.name], type=f.type) for f in schema], schema=schema)
+
+
+def to_frame(records):
+    # DataFrame in the flat layout (amounts in euros) built column by column, no dict per row
+    import pandas as pd
+
+    cols = columns(records)
+    for name in AMOUNT_FIELDS:
+        cols[name] = [to_euros(v) for v in cols[name]]
+    df = pd.DataFrame(cols)
+    for name in AMOUNT_FIELDS:
+        df[name] = df[name].astype(float)
+    return df
+
+
+# --- memory benchmark ---
+
+def sample_fields(i):
+    # one LUL record in the flat form parse_chunk used to build (fresh strings per record)
+    return {
+        "azienda_denominazione": "ROSSI SRL", "azienda_cf": "01234567890", "azienda_piva": "01234567890",
+        "mese_retribuito": "Luglio", "anno": "2025", "source_file": "LUL_2025_07.pdf", "sede_operativa": None,
+        "dipendente_nome": f"DIPENDENTE {i}", "dipendente_cf": f"RSSMRA80A01H{i % 1000:03d}Z",
+        "matricola_inps": str(4809923564 + i), "qualifica": "Operai Part-Time", "mansione": "BARMAN",
+        "livello": "4", "tipo_rapporto": "Tempo indeterminato", "data_assunzione": "10/09/2015",
+        "data_cessazione": None, "totale_competenze": 1169.62 + i, "totale_trattenute": 23.46,
+        "netto_a_pagare": 1012.0 + i, "imponibile_previdenziale": 1169.0, "imponibile_fiscale": 1080.0,
+        "inps_dip": 107.4, "inps_azienda": 345.0, "inail_azienda": 12.0, "tfr_mese": 86.64,
+        "quota_anno_tfr": 15.0, "costo_azienda": 1613.26 + i,
+        **{f"occ_{code}": n for code, n in zip(PRES_CODES, (i % 3, 0, 1, 0, 2, 0, 0, 0, 1, 0, 0))},
+    }
+
+
+def measure(build, n):
+    import gc
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    recs = [build(i) for i in range(n)]
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return recs, size / n, elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Memory of PayslipRecord vs the flat dict records")
+    ap.add_argument("--records", type=int, default=100_000)
+    args = ap.parse_args()
+
+    for name, build in (("dict", sample_fields),
+                        ("PayslipRecord", lambda i: PayslipRecord.from_fields(sample_fields(i)))):
+        recs, per_record, elapsed = measure(build, args.records)
+        print(f"{name:<14} {per_record:8.0f} bytes/record   built in {elapsed:.2f} s (traced)")
+    try:
+        table = to_arrow(recs)
+    except ImportError:
+        return
+    print(f"{'arrow':<14} {table.nbytes / len(recs):8.0f} bytes/record")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+# service.py — HTTP job service around the extractors (aiohttp)
+#
+#   uv run --extra service service.py --port 8080 --workers 8 --allow-paths /srv/cedolini
+#
+#   POST   /jobs              multipart with a "file" part (PDF upload), or JSON {"path": ...}
+#                             (only below --allow-paths). Options as form fields / JSON keys:
+#                             extractor (ocr|cedolini|layout|auto), mode, dpi, batched, adaptive, source,
+#                             split_fields
+#                             -> 202 {"job_id", "status"}; 503 + Retry-After when the queue is full
+#   GET    /jobs/{id}         -> {"job_id", "status", "result" | "error"}
+#   GET    /jobs/{id}/stream  -> NDJSON: status lines, one {"field", "value"} line per data_map field
+#                             (one {"record"} line per record for cedolini/layout; auto first sends
+#                             {"template", "extractor"}), last line = final status
+#   DELETE /jobs/{id}         forget a finished job
+#   GET    /health
+#
+# The process pool is started once and every worker keeps its OCR engine and the extractor
+# modules loaded (batch.warm_worker), so a request does not pay the Python + OpenCV +
+# PyMuPDF + pandas startup. Jobs wait in a bounded queue (--queue); when it is full new
+# submissions are refused instead of piling up. With split_fields every data_map field
+# is its own pool task and is streamed as soon as it is done.
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import shutil
+import tempfile
+import time
+import uuid
+
+from aiohttp import web
+
+import batch
+import main as ocr
+import schema
+
+MODES = ("region", "page")
+SOURCES = ("auto", "text", "ocr")
+
+
+class Job:
+    def __init__(self, job_id, path, options, upload=False):
+        self.id = job_id
+        self.path = path
+        self.options = options
+        self.upload = upload
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.events = [{"status": "queued"}]
+        self.changed = asyncio.Condition()
+
+    @property
+    def done(self):
+        return self.status in ("done", "failed")
+
+    async def emit(self, event, status=None):
+        async with self.changed:
+            if status:
+                self.status = status
+            self.events.append(event)
+            self.changed.notify_all()
+
+    def to_json(self):
+        out = {"job_id": self.id, "status": self.status, "extractor": self.options["extractor"]}
+        if self.status == "done":
+            out["result"] = self.result
+        elif self.status == "failed":
+            out["error"] = self.error
+        return out
+
+
+def parse_options(raw):
+    # request options -> validated dict; ValueError with a client-facing message
+    options = {
+        "extractor": raw.get("extractor", "ocr"),
+        "mode": raw.get("mode", "region"),
+        "source": raw.get("source", "auto"),
+        "dpi": int(raw.get("dpi", ocr.DPI)),
+        "batched": str(raw.get("batched", "")).lower() in ("1", "true", "yes"),
+        "adaptive": str(raw.get("adaptive", "")).lower() in ("1", "true", "yes"),
+        "split_fields": str(raw.get("split_fields", "")).lower() in ("1", "true", "yes"),
+    }
+    if options["extractor"] not in batch.EXTRACTORS:
+        raise ValueError(f"extractor must be one of {sorted(batch.EXTRACTORS)}")
+    if options["mode"] not in MODES:
+        raise ValueError(f"mode must be one of {list(MODES)}")
+    if options["source"] not in SOURCES:
+        raise ValueError(f"source must be one of {list(SOURCES)}")
+    if not 50 <= options["dpi"] <= 1200:
+        raise ValueError("dpi must be between 50 and 1200")
+    return options
+
+
+def json_error(cls, message, **kwargs):
+    return cls(text=json.dumps({"error": message}), content_type="application/json", **kwargs)
+
+
+def queue_full():
+    return json_error(web.HTTPServiceUnavailable, "queue full, retry later", headers={"Retry-After": "1"})
+
+
+class JobService:
+    def __init__(self, workers, queue_size, allow_paths=None, max_jobs=1000, max_upload=50 * 2**20):
+        self.workers = workers
+        self.allow_paths = Path(allow_paths).resolve() if allow_paths else None
+        self.max_jobs = max_jobs
+        self.max_upload = max_upload
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.jobs = OrderedDict()
+        self.pool = None
+        self._pool_lock = asyncio.Lock()
+        self.upload_dir = None
+        self._dispatchers = []
+
+    # --- lifecycle ---
+
+    async def start(self, app):
+        self.upload_dir = Path(tempfile.mkdtemp(prefix="pdf-jobs-"))
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=batch.warm_worker)
+        self._dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+
+    async def stop(self, app):
+        for task in self._dispatchers:
+            task.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        shutil.rmtree(self.upload_dir, ignore_errors=True)
+
+    # --- running jobs ---
+
+    async def _dispatch(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self.queue.task_done()
+
+    async def _submit(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        pool = self.pool
+        try:
+            return await loop.run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            # a worker died (e.g. killed by the OOM killer): replace the pool for the next jobs,
+            # once: the other jobs that were on the same pool fail too, and find it replaced
+            async with self._pool_lock:
+                if self.pool is pool:
+                    self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=batch.warm_worker)
+                    pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    async def _run(self, job):
+        opts = job.options
+        await job.emit({"status": "running"}, status="running")
+        try:
+            if opts["extractor"] == "ocr" and opts["split_fields"]:
+                result = await self._run_fields(job)
+            else:
+                fn = batch.EXTRACTORS[opts["extractor"]]
+                if opts["extractor"] in ("ocr", "auto"):
+                    fn = partial(fn, mode=opts["mode"], dpi=opts["dpi"], batched=opts["batched"],
+                                 source=opts["source"], adaptive=opts["adaptive"])
+                result = await self._submit(fn, str(job.path))
+                kind, body = opts["extractor"], result
+                if kind == "auto":
+                    await job.emit({"template": result["template"], "extractor": result["extractor"]})
+                    kind, body = result["extractor"], result.get("fields", result.get("records"))
+                if kind == "ocr":
+                    for key, value in body.items():
+                        await job.emit({"field": key, "value": value})
+                else:
+                    for record in body:
+                        await job.emit({"record": record})
+            job.result = json.loads(json.dumps(result, default=schema.json_default))
+            job.finished = time.time()
+            await job.emit({"status": "done"}, status="done")
+        except Exception as e:
+            job.error = repr(e)
+            job.finished = time.time()
+            await job.emit({"status": "failed", "error": job.error}, status="failed")
+        finally:
+            if job.upload:
+                job.path.unlink(missing_ok=True)
+            self._evict()
+
+    async def _run_fields(self, job):
+        fn = partial(batch.ocr_field, dpi=job.options["dpi"], source=job.options["source"])
+
+        async def one(key):
+            try:
+                return key, await self._submit(fn, (str(job.path), key)), None
+            except Exception as e:
+                return key, None, repr(e)
+
+        values = {}
+        for next_done in asyncio.as_completed([one(key) for key in ocr.data_map]):
+            key, value, error = await next_done
+            if error is not None:
+                values.setdefault("_errors", {})[key] = error
+                await job.emit({"field": key, "error": error})
+            else:
+                values[key] = value
+                await job.emit({"field": key, "value": value})
+        # same key order as data_map, like the whole-document extractor
+        return {key: values[key] for key in [*ocr.data_map, "_errors"] if key in values}
+
+    def _evict(self):
+        # keep at most max_jobs, dropping the oldest finished ones
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_jobs)]:
+            del self.jobs[job_id]
+
+    # --- HTTP handlers ---
+
+    async def create_job(self, request):
+        # refuse before reading the body: backpressure also covers the upload bandwidth
+        if self.queue.full():
+            raise queue_full()
+        job_id = uuid.uuid4().hex
+        path, upload = None, request.content_type.startswith("multipart/")
+        try:
+            if upload:
+                path, raw = await self._read_upload(request, job_id)
+            else:
+                raw = await request.json()
+                if not isinstance(raw, dict):
+                    raise ValueError("expected a JSON object")
+                path = self._checked_path(raw.get("path"))
+            options = parse_options(raw)
+        except ValueError as e:
+            if upload and path is not None:
+                path.unlink(missing_ok=True)
+            raise json_error(web.HTTPBadRequest, str(e))
+
+        job = Job(job_id, path, options, upload=upload)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            if upload:
+                path.unlink(missing_ok=True)
+            raise queue_full()
+        self.jobs[job_id] = job
+        return web.json_response({"job_id": job_id, "status": job.status}, status=202,
+                                 headers={"Location": f"/jobs/{job_id}"})
+
+    async def _read_upload(self, request, job_id):
+        reader = await request.multipart()
+        raw, path = {}, None
+        while (part := await reader.next()) is not None:
+            if part.name == "file":
+                path = self.upload_dir / f"{job_id}.pdf"
+                size, head = 0, b""
+                with open(path, "wb") as f:
+                    while chunk := await part.read_chunk():
+                        size += len(chunk)
+                        if size > self.max_upload:
+                            f.close()
+                            path.unlink(missing_ok=True)
+                            raise ValueError(f"upload larger than {self.max_upload} bytes")
+                        head = head or chunk[:5]
+                        f.write(chunk)
+                if not head.startswith(b"%PDF"):
+                    path.unlink(missing_ok=True)
+                    raise ValueError("the uploaded file is not a PDF")
+            else:
+                raw[part.name] = await part.text()
+        if path is None:
+            raise ValueError('missing "file" part')
+        return path, raw
+
+    def _checked_path(self, value):
+        if not value:
+            raise ValueError('send a multipart "file" upload or a JSON "path"')
+        if self.allow_paths is None:
+            raise ValueError("path submissions are disabled (start the service with --allow-paths)")
+        path = Path(value).resolve()
+        if not path.is_relative_to(self.allow_paths) or not path.is_file():
+            raise ValueError(f"no such PDF below {self.allow_paths}: {value}")
+        return path
+
+    def _job(self, request):
+        job = self.jobs.get(request.match_info["job_id"])
+        if job is None:
+            raise json_error(web.HTTPNotFound, "unknown job")
+        return job
+
+    async def get_job(self, request):
+        return web.json_response(self._job(request).to_json())
+
+    async def stream_job(self, request):
+        job = self._job(request)
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        sent = 0
+        while True:
+            async with job.changed:
+                await job.changed.wait_for(lambda: len(job.events) > sent)
+                events, done = job.events[sent:], job.done
+            for event in events:
+                await response.write((json.dumps({"job_id": job.id, **event}, ensure_ascii=False, default=schema.json_default)
+                                      + "\n").encode("utf-8"))
+            sent += len(events)
+            if done:
+                break
+        await response.write_eof()
+        return response
+
+    async def delete_job(self, request):
+        job = self._job(request)
+        if not job.done:
+            raise json_error(web.HTTPConflict, "job still running")
+        del self.jobs[job.id]
+        return web.json_response({"job_id": job.id, "status": "deleted"})
+
+    async def health(self, request):
+        return web.json_response({"workers": self.workers, "queued": self.queue.qsize(),
+                                  "queue_size": self.queue.maxsize, "jobs": len(self.jobs)})
+
+
+def make_app(workers, queue_size, allow_paths=None, max_jobs=1000, max_upload=50 * 2**20):
+    service = JobService(workers, queue_size, allow_paths, max_jobs, max_upload)
+    app = web.Application(client_max_size=max_upload + 2**20)
+    app.on_startup.append(service.start)
+    app.on_cleanup.append(service.stop)
+    app.add_routes([
+        web.post("/jobs", service.create_job),
+        web.get("/jobs/{job_id}", service.get_job),
+        web.get("/jobs/{job_id}/stream", service.stream_job),
+        web.delete("/jobs/{job_id}", service.delete_job),
+        web.get("/health", service.health),
+    ])
+    app["service"] = service
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP job service for payslip PDF extraction")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=batch.default_workers(), help="process pool size")
+    parser.add_argument("--queue", type=int, default=None, help="max jobs waiting for a worker (default: 4 x workers)")
+    parser.add_argument("--allow-paths", help="accept JSON {\"path\": ...} submissions for PDFs below this folder")
+    parser.add_argument("--max-jobs", type=int, default=1000, help="finished jobs kept for polling")
+    parser.add_argument("--max-upload", type=int, default=50, help="max upload size in MB")
+    args = parser.parse_args()
+    app = make_app(args.workers, args.queue or 4 * args.workers, args.allow_paths, args.max_jobs,
+                   args.max_upload * 2**20)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# sinks.py — streaming record writers: JSONL, CSV, Parquet
+#
+# Records (dicts) are written as soon as a document is parsed instead of being collected
+# for one final DataFrame, so memory stays flat on large archives. JSONL and CSV are
+# flushed after every write(): a crashed run keeps everything written so far. Parquet
+# is buffered into row groups and only readable once close() has written the footer
+# (the context manager closes it on errors too).
+#
+# columns: optional {name: "str" | "float" | "int"} in output order. Without it the
+# columns are taken from the first record; Parquet needs it to type all-null columns.
+# Records are dicts or objects with a to_dict() (schema.PayslipRecord), written flat.
+#
+#     with open_sink("risultati.parquet", columns) as sink:
+#         for recs in ...:
+#             sink.write(recs)
+#     df = read_frame("risultati.parquet", columns)
+import csv
+import json
+from pathlib import Path
+
+
+class Sink:
+    def __init__(self, path, columns=None):
+        self.path = Path(path)
+        self.columns = dict(columns) if columns else None
+        self.count = 0
+
+    def write(self, records):
+        for record in records:
+            if not isinstance(record, dict):
+                record = record.to_dict()
+            if self.columns is None:
+                self.columns = {name: None for name in record}
+            self._write(record)
+            self.count += 1
+        self._flush()
+
+    def _write(self, record):
+        raise NotImplementedError
+
+    def _flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JsonlSink(Sink):
+    def __init__(self, path, columns=None):
+        super().__init__(path, columns)
+        self._file = open(self.path, "w", encoding="utf-8")
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class CsvSink(Sink):
+    # None -> empty cell; the header is written with the first record
+    def __init__(self, path, columns=None):
+        super().__init__(path, columns)
+        self._file = open(self.path, "w", encoding="utf-8", newline="")
+        self._writer = None
+
+    def _write(self, record):
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._file, fieldnames=list(self.columns), extrasaction="ignore")
+            self._writer.writeheader()
+        self._writer.writerow(record)
+
+    def _flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+ARROW_TYPES = {"str": "string", "float": "float64", "int": "int64", None: "string"}
+
+
+class ParquetSink(Sink):
+    def __init__(self, path, columns=None, row_group_size=10_000):
+        import pyarrow  # noqa: F401  (fail early if the optional dependency is missing)
+
+        super().__init__(path, columns)
+        self.row_group_size = row_group_size
+        self._rows = []
+        self._writer = None
+
+    def _write(self, record):
+        self._rows.append(record)
+        if len(self._rows) >= self.row_group_size:
+            self._write_row_group()
+
+    def _write_row_group(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self._rows:
+            return
+        schema = pa.schema([(name, ARROW_TYPES[kind]) for name, kind in self.columns.items()])
+        table = pa.Table.from_pylist(self._rows, schema=schema)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, schema)
+        self._writer.write_table(table)
+        self._rows = []
+
+    def close(self):
+        self._write_row_group()
+        if self._writer is not None:
+            self._writer.close()
+
+
+SINKS = {
+    ".jsonl": JsonlSink,
+    ".csv": CsvSink,
+    ".parquet": ParquetSink,
+}
+
+
+def open_sink(path, columns=None):
+    suffix = Path(path).suffix.lower()
+    if suffix not in SINKS:
+        raise ValueError(f"unsupported output {path!r}, expected one of {sorted(SINKS)}")
+    return SINKS[suffix](path, columns)
+
+
+def read_frame(path, columns=None):
+    # the written file back as a DataFrame, with the same column types the records had
+    import pandas as pd
+
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".parquet":
+        df = pd.read_parquet(path)
+    elif suffix == ".jsonl":
+        with open(path, encoding="utf-8") as f:
+            df = pd.DataFrame([json.loads(line) for line in f if line.strip()])
+    elif suffix == ".csv":
+        text_cols = [name for name, kind in (columns or {}).items() if kind in ("str", None)]
+        df = pd.read_csv(path, dtype={name: object for name in text_cols})
+        # empty cells were None: keep them None (not NaN) in text columns
+        for name in text_cols:
+            if name in df.columns:
+                df[name] = df[name].astype(object).where(df[name].notna(), None)
+    else:
+        raise ValueError(f"unsupported input {path!r}, expected one of {sorted(SINKS)}")
+    if columns and not df.empty:
+        df = df[[name for name in columns if name in df.columns]]
+    return df
@@ -0,0 +1,331 @@
+# templates.py — layout template registry and document fingerprinting
+#
+# A template is one versioned payslip layout plus the extractor that reads it:
+#   ocr       fixed field rectangles (main.py data_map), stored in PDF points
+#   layout    label -> value offsets (pc.py LAYOUT_MAP), already in PDF points
+#   cedolini  LUL/Datev text parsed by regexes (parse_cedolini.py), no geometry
+# The built-in templates are built from data_map and LAYOUT_MAP; more layouts (or newer
+# versions of the same one) are JSON files in TEMPLATES_DIR (default ./templates):
+#
+#     {"name": "datev-ocr", "version": 2, "extractor": "ocr", "page_size": [595.3, 841.9],
+#      "anchors": ["DATEV", "CALENDARIO PRESENZE"], "thumb_hashes": ["9f3c..."], "priority": 1,
+#      "fields": {"anno": {"rect": [419.0, 70.6, 449.3, 83.5], "type": "int", "format": "year"}}}
+#
+# Routing looks at page 1 only. Text-layer documents are matched on anchors (label texts
+# that identify the layout; compared without whitespace, as PDF text layers split words
+# freely): the template with the highest share of its anchors present wins, if at least
+# MIN_SCORE; on equal scores the higher "priority" wins (a branded layout over a generic
+# label set that the same form also satisfies). Scans without text fall back to a 256-bit
+# dHash of a page thumbnail, compared with the hashes learned from sample documents
+# (Hamming distance <= MAX_DISTANCE).
+#
+#     uv run templates.py route cedolini/                  # template per PDF, routing time
+#     uv run templates.py learn datev-ocr scan.pdf         # add thumbnail hashes to templates/datev-ocr.json
+#     uv run templates.py list
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import os
+import time
+
+TEMPLATES_DIR = os.environ.get("TEMPLATES_DIR", "templates")
+MIN_SCORE = 0.8
+HASH_SIZE = 16  # dHash grid: HASH_SIZE x HASH_SIZE bits
+MAX_DISTANCE = 24
+
+
+@dataclass
+class Template:
+    name: str
+    version: int
+    extractor: str
+    anchors: tuple = ()
+    fields: dict = field(default_factory=dict)
+    page_size: tuple | None = None
+    thumb_hashes: tuple = ()
+    priority: int = 0
+
+    @property
+    def key(self):
+        return f"{self.name}@v{self.version}"
+
+    def data_map(self, dpi=None):
+        # ocr templates -> main.py data_map (pixel bboxes at main.DPI)
+        import main as ocr
+
+        scale = (dpi or ocr.DPI) / 72
+        out = {}
+        for key, spec in self.fields.items():
+            out[key] = {k: v for k, v in spec.items() if k != "rect"}
+            out[key]["type"] = int if spec.get("type") == "int" else str
+            out[key]["bbox"] = tuple(round(v * scale) for v in spec["rect"])
+        return out
+
+    def to_json(self):
+        return {**asdict(self), "anchors": list(self.anchors), "thumb_hashes": list(self.thumb_hashes)}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(name=data["name"], version=int(data["version"]), extractor=data["extractor"],
+                   anchors=tuple(data.get("anchors", ())), fields=data.get("fields", {}),
+                   page_size=tuple(data["page_size"]) if data.get("page_size") else None,
+                   thumb_hashes=tuple(data.get("thumb_hashes", ())), priority=int(data.get("priority", 0)))
+
+
+# --- built-in templates ---
+
+# dHash of page 1 of example.pdf
+EXAMPLE_THUMB_HASH = "83228b32a81e964488d638f018361892009210929892ad34a108a641bb66e160"
+
+
+def datamap_template():
+    import main as ocr
+
+    fields = {}
+    for key, spec in ocr.data_map.items():
+        rect = ocr.bbox_to_rect(spec["bbox"])
+        fields[key] = {**{k: v for k, v in spec.items() if k not in ("bbox", "type")},
+                       "type": "int" if spec["type"] == int else "str",
+                       "rect": [round(v, 3) for v in (rect.x0, rect.y0, rect.x1, rect.y1)]}
+    return Template("datev-ocr", 1, "ocr",
+                    anchors=("DATEV", "CALENDARIO PRESENZE", "RETRIBUZIONE ORARIA", "VOCE DI TARIFFA",
+                             "TOTALE IMPONIBILE INPS", "NETTO IN BUSTA"),
+                    fields=fields, page_size=(595.275, 841.889), thumb_hashes=(EXAMPLE_THUMB_HASH,), priority=1)
+
+
+def layout_template():
+    from requirements import pc
+
+    return Template("label-offsets", 1, "layout",
+                    anchors=("MESE RETRIBUITO", "CONTRATTO APPLICATO", "POSIZIONE INAIL", "SEDE INAIL",
+                             "DATA DI NASCITA", "TOTALE COMPETENZE", "NETTO IN BUSTA", "TFR DEL MESE"),
+                    fields={label: dict(box) for label, box in pc.LAYOUT_MAP.items()})
+
+
+def lul_template():
+    return Template("lul-text", 1, "cedolini",
+                    anchors=("DIPENDENTE", "QUALIFICA", "TIPO RAPPORTO", "TOTALE COMPETENZE", "NETTO IN BUSTA",
+                             "INPS DITTA", "QUOTA ANNO TFR"))
+
+
+BUILTINS = (datamap_template, layout_template, lul_template)
+
+
+# --- fingerprint ---
+
+def squash(text):
+    return "".join(text.upper().split())
+
+
+def dhash(page, size=HASH_SIZE):
+    # difference hash of a grayscale thumbnail: bit = left pixel brighter than its right neighbour
+    import fitz  # PyMuPDF
+    import numpy as np
+    from PIL import Image
+
+    pix = page.get_pixmap(dpi=24, colorspace=fitz.csGRAY)
+    img = Image.frombytes("L", (pix.width, pix.height), pix.samples).resize((size + 1, size), Image.LANCZOS)
+    px = np.asarray(img, dtype=np.int16)
+    bits = (px[:, :-1] > px[:, 1:]).flatten()
+    return np.packbits(bits).tobytes().hex()
+
+
+def hamming(a, b):
+    import numpy as np
+    return int(np.unpackbits(np.frombuffer(bytes.fromhex(a), np.uint8)
+                             ^ np.frombuffer(bytes.fromhex(b), np.uint8)).sum())
+
+
+@dataclass
+class Fingerprint:
+    text: str            # page 1 text, upper case, no whitespace ("" for scans)
+    page_size: tuple
+    thumb_hash: str | None = None
+
+    @property
+    def key(self):
+        # stable id of the layout family, for grouping unrouted documents in logs
+        return hashlib.blake2b(f"{self.page_size}|{self.thumb_hash or ''}".encode(), digest_size=6).hexdigest()
+
+
+def fingerprint(page, with_hash=False):
+    return Fingerprint(squash(page.get_text()), (round(page.rect.width), round(page.rect.height)),
+                       dhash(page) if with_hash else None)
+
+
+@dataclass
+class Match:
+    template: Template
+    score: float
+    method: str  # "anchors" | "thumbnail"
+    fingerprint: Fingerprint
+
+
+class TemplateRegistry:
+    def __init__(self, templates=()):
+        self.templates = {}
+        for template in templates:
+            self.add(template)
+
+    def add(self, template):
+        self.templates[template.key] = template
+
+    def get(self, name):
+        # "name@v2", or "name" for the latest version
+        if name in self.templates:
+            return self.templates[name]
+        versions = [t for t in self.templates.values() if t.name == name]
+        if not versions:
+            raise KeyError(f"unknown template {name!r}")
+        return max(versions, key=lambda t: t.version)
+
+    def latest(self):
+        # routing only considers the newest version of every layout
+        return [self.get(name) for name in dict.fromkeys(t.name for t in self.templates.values())]
+
+    def candidates(self, fp):
+        # newest versions whose page size (if set) is the document's, within 2 pt
+        return [t for t in self.latest() if not t.page_size
+                or all(abs(a - b) <= 2 for a, b in zip(t.page_size, fp.page_size))]
+
+    def match_page(self, page, min_score=MIN_SCORE, max_distance=MAX_DISTANCE):
+        fp = fingerprint(page)
+        templates, best = self.candidates(fp), None
+        if fp.text:
+            for template in templates:
+                if not template.anchors:
+                    continue
+                score = sum(squash(a) in fp.text for a in template.anchors) / len(template.anchors)
+                rank = (score, template.priority, len(template.anchors))
+                if score >= min_score and (best is None or rank > (best.score, best.template.priority,
+                                                                   len(best.template.anchors))):
+                    best = Match(template, score, "anchors", fp)
+        if best is None:
+            fp.thumb_hash = dhash(page)
+            for template in templates:
+                for h in template.thumb_hashes:
+                    distance = hamming(fp.thumb_hash, h)
+                    score = 1 - distance / HASH_SIZE ** 2
+                    if distance <= max_distance and (best is None or score > best.score):
+                        best = Match(template, score, "thumbnail", fp)
+        return best, fp
+
+    def route(self, path, **kwargs):
+        import fitz  # PyMuPDF
+        with fitz.open(path) as doc:
+            if doc.page_count == 0:
+                return None, None
+            return self.match_page(doc[0], **kwargs)
+
+
+def load_registry(directory=None):
+    registry = TemplateRegistry(build() for build in BUILTINS)
+    directory = Path(directory or TEMPLATES_DIR)
+    if directory.is_dir():
+        for path in sorted(directory.glob("*.json")):
+            registry.add(Template.from_json(json.loads(path.read_text(encoding="utf-8"))))
+    return registry
+
+
+_registry = None
+
+
+def get_registry():
+    # one registry per process (pool workers load it on first use)
+    global _registry
+    if _registry is None:
+        _registry = load_registry()
+    return _registry
+
+
+class NoTemplate(LookupError):
+    pass
+
+
+def extract(path, match, **kwargs):
+    # run the template's extractor; kwargs go to main.extract_fields for ocr templates
+    template = match.template
+    if template.extractor == "ocr":
+        import main as ocr
+        return ocr.extract_fields(path, template.data_map(), **kwargs)
+    if template.extractor == "layout":
+        from requirements import pc
+        return pc.extract_file_records(str(path), template.fields)
+    if template.extractor == "cedolini":
+        from requirements import parse_cedolini
+        return parse_cedolini.parse_pdf_cached(Path(path))
+    raise ValueError(f"template {template.key}: unknown extractor {template.extractor!r}")
+
+
+def route_and_extract(path, **kwargs):
+    match, fp = get_registry().route(path)
+    if match is None:
+        raise NoTemplate(f"no template matches {Path(path).name} (fingerprint {fp.key if fp else '-'})")
+    return match, extract(path, match, **kwargs)
+
+
+# --- command line ---
+
+def cmd_route(args):
+    registry = load_registry(args.templates)
+    paths = sorted(Path(args.source).glob("*.pdf")) if Path(args.source).is_dir() else [Path(args.source)]
+    counts, start = {}, time.perf_counter()
+    for path in paths:
+        t0 = time.perf_counter()
+        match, fp = registry.route(path)
+        ms = (time.perf_counter() - t0) * 1000
+        name = match.template.key if match else "-"
+        counts[name] = counts.get(name, 0) + 1
+        detail = f"{match.method} {match.score:.2f}" if match else f"fingerprint {fp.key if fp else '-'}"
+        print(f"{path.name:<40} {name:<22} {detail:<18} {ms:7.1f} ms")
+    elapsed = time.perf_counter() - start
+    print(f"\n{len(paths)} PDF in {elapsed:.2f} s: " + ", ".join(f"{k} {v}" for k, v in sorted(counts.items())))
+
+
+def cmd_learn(args):
+    import fitz  # PyMuPDF
+
+    registry = load_registry(args.templates)
+    template = registry.get(args.template)
+    hashes = list(template.thumb_hashes)
+    for sample in args.samples:
+        with fitz.open(sample) as doc:
+            h = dhash(doc[0])
+        if h not in hashes:
+            hashes.append(h)
+        print(f"{sample}: {h}")
+    template.thumb_hashes = tuple(hashes)
+    out = Path(args.templates or TEMPLATES_DIR)
+    out.mkdir(parents=True, exist_ok=True)
+    path = out / f"{template.name}.json"
+    path.write_text(json.dumps(template.to_json(), ensure_ascii=False, indent=1), encoding="utf-8")
+    print(f"{template.key}: {len(hashes)} thumbnail hashes -> {path}")
+
+
+def cmd_list(args):
+    for template in load_registry(args.templates).templates.values():
+        print(f"{template.key:<22} {template.extractor:<9} {len(template.fields):3d} fields  "
+              f"{len(template.anchors)} anchors  {len(template.thumb_hashes)} thumbnail hashes")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Layout templates: route PDFs, learn thumbnail hashes")
+    ap.add_argument("--templates", help=f"folder with template JSON files (default: {TEMPLATES_DIR})")
+    sub = ap.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("route", help="show the template chosen for each PDF")
+    p.add_argument("source", help="PDF or folder")
+    p.set_defaults(fn=cmd_route)
+    p = sub.add_parser("learn", help="add the page-1 thumbnail hash of sample PDFs to a template")
+    p.add_argument("template")
+    p.add_argument("samples", nargs="+")
+    p.set_defaults(fn=cmd_learn)
+    p = sub.add_parser("list")
+    p.set_defaults(fn=cmd_list)
+    args = ap.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
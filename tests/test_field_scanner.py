@@ -0,0 +1,52 @@
+# tests/test_field_scanner.py — FieldScanner gives what re.search per pattern gives
+#
+#     uv run -m unittest discover tests
+from pathlib import Path
+import sys
+import unittest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from field_scanner import SAMPLE_CHUNK, FieldScanner, count_tokens, reference_count, reference_scan
+from requirements import parse_cedolini as pc
+
+CHUNKS = [
+    SAMPLE_CHUNK,
+    SAMPLE_CHUNK.lower(),
+    # a keyword that occurs first where its pattern does not match ("TOTALE" before "TOTALE COMPETENZE")
+    "TOTALE ORE 160\nTOTALE COMPETENZE 2.000,00\nNETTO A PAGARE 1.500,00\n",
+    # only the second pattern of several fields
+    "DIPENDENTE VERDI LUIGI\nTOTALE TRATTENUTE 80,00\nIMPONIBILE PREVIDENZIALE 1.200,00\n"
+    "CONTRIB. INPS DIP. 110,00  CONTRIB INPS DITTA 300,00\nQUOTA ANNO TFR 75,10\n",
+    # upper() changes the length ("ß" -> "SS"): positions are not used
+    "DIPENDENTE STRAßER HANS QUALIFICA IMPIEGATO\nTOTALE COMPETENZE 1.000,00\n",
+    "",
+]
+
+
+class FieldScannerTest(unittest.TestCase):
+    def test_scan_matches_re_search(self):
+        for chunk in CHUNKS:
+            with self.subTest(chunk=chunk[:40]):
+                self.assertEqual(pc.SCANNER.scan(chunk), reference_scan(pc.FIELD_PATTERNS, chunk))
+
+    def test_count_tokens_matches_findall(self):
+        for chunk in CHUNKS:
+            with self.subTest(chunk=chunk[:40]):
+                self.assertEqual(count_tokens(chunk.upper(), pc.PRES_CODES),
+                                 reference_count(chunk.upper(), pc.PRES_CODES))
+
+    def test_sample_fields(self):
+        found = pc.SCANNER.scan(SAMPLE_CHUNK)
+        self.assertEqual(found["dipendente_cf"], "RSSMRA80A01H501U")
+        self.assertEqual(found["totale_competenze"], "1.169,62")
+
+    def test_pattern_without_keyword(self):
+        fields = {"num": [(None, r"N\.\s*(\d+)")], "cod": [("COD", r"COD\s+(\w+)"), (None, r"CODE\s*=\s*(\w+)")]}
+        scanner = FieldScanner(fields)
+        for text in ("n. 42 code=ab", "x cod zz n.7", "nothing"):
+            with self.subTest(text=text):
+                self.assertEqual(scanner.scan(text), reference_scan(fields, text))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+# tests/test_manifest.py — incremental ingestion: what plan() sends to be (re)processed
+#
+#     uv run -m unittest discover tests
+from pathlib import Path
+from unittest import mock
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import manifest
+
+
+class PlanTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name).resolve()
+        self.conn = sqlite3.connect(":memory:")
+        self.addCleanup(self.conn.close)
+        manifest.init_manifest(self.conn)
+
+    def write(self, name, data, mtime=1_700_000_000):
+        path = self.dir / name
+        path.write_bytes(data)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def ingest(self, paths, pipeline="lul"):
+        todo, deleted = manifest.plan(self.conn, pipeline, paths)
+        for state in todo:
+            manifest.mark_processed(self.conn, pipeline, state)
+        self.conn.commit()
+        return [Path(s.path).name for s in todo], deleted
+
+    def test_new_files_then_nothing(self):
+        paths = [self.write("a.pdf", b"a"), self.write("b.pdf", b"b")]
+        self.assertEqual(self.ingest(paths), (["a.pdf", "b.pdf"], []))
+        with mock.patch.object(manifest, "file_sha256", side_effect=AssertionError("hashed")):
+            self.assertEqual(self.ingest(paths), ([], []))  # same size and mtime: not even read
+
+    def test_touched_but_identical_is_skipped(self):
+        path = self.write("a.pdf", b"same")
+        self.ingest([path])
+        self.write("a.pdf", b"same", mtime=1_800_000_000)
+        self.assertEqual(self.ingest([path]), ([], []))
+        mtime = self.conn.execute("SELECT mtime FROM ingest_manifest").fetchone()[0]
+        self.assertEqual(mtime, 1_800_000_000)  # stat refreshed: the next plan does not hash it
+
+    def test_changed_content_is_reprocessed(self):
+        path = self.write("a.pdf", b"v1")
+        self.ingest([path])
+        self.write("a.pdf", b"v2-longer")  # same mtime, new size and content
+        self.assertEqual(self.ingest([path]), (["a.pdf"], []))
+
+    def test_deleted_and_pipelines(self):
+        a, b = self.write("a.pdf", b"a"), self.write("b.pdf", b"b")
+        self.ingest([a, b])
+        self.assertEqual(self.ingest([a]), ([], [str(b)]))
+        self.assertEqual(self.ingest([a], pipeline="ocr"), (["a.pdf"], []))  # manifest per pipeline
+        manifest.forget(self.conn, "lul", [b])
+        self.assertEqual(self.ingest([a]), ([], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
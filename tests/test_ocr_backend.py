@@ -0,0 +1,130 @@
+# tests/test_ocr_backend.py — batched OCR gives the per-field texts (stub engines, no tesseract)
+#
+#     uv run -m unittest discover tests
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+import hashlib
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import ocr_backend
+import tracing
+from ocr_backend import DEFAULT_CONFIG, DIGITS_CONFIG, CachedBackend, OcrBackend
+from result_cache import ResultCache
+
+
+def read(pixels, psm, whitelist):
+    # stub recognition: a function of exactly the pixels and settings the engine sees, with
+    # tesseract-like paragraph breaks and spacing that a reformatting path would lose
+    digest = hashlib.sha1(pixels.tobytes() + repr((pixels.shape, psm, whitelist)).encode()).hexdigest()
+    return f"{digest[:8]}  {digest[8:12]}\n\n{digest[12:20]}\n"
+
+
+class StubTessBaseAPI:
+    def __init__(self, lang):
+        self.psm = self.whitelist = self.image = self.rect = None
+
+    def SetPageSegMode(self, psm):
+        self.psm = psm
+
+    def SetVariable(self, name, value):
+        self.whitelist = value
+
+    def SetImage(self, image):
+        self.image, self.rect = np.asarray(image), None
+
+    def SetRectangle(self, left, top, width, height):
+        self.rect = (left, top, width, height)
+
+    def GetUTF8Text(self):
+        pixels = self.image
+        if self.rect:
+            left, top, width, height = self.rect
+            pixels = pixels[top:top + height, left:left + width]
+        return read(pixels, self.psm, self.whitelist)
+
+    def End(self):
+        pass
+
+
+stub_tesserocr = SimpleNamespace(PyTessBaseAPI=StubTessBaseAPI, PSM=SimpleNamespace(AUTO=3))
+
+
+def stub_image_to_string(image, lang=None, config=""):
+    return read(np.asarray(image), config, lang)
+
+
+stub_pytesseract = SimpleNamespace(image_to_string=stub_image_to_string, Output=SimpleNamespace(DICT="dict"))
+
+
+def crops():
+    rng = np.random.default_rng(5)
+    gray = [rng.integers(0, 256, size, dtype=np.uint8) for size in ((40, 120), (62, 300), (25, 80))]
+    colour = rng.integers(0, 256, (30, 90, 3), dtype=np.uint8)  # a chain without "gray"
+    return [("nome", gray[0], DEFAULT_CONFIG), ("anno", gray[1], DIGITS_CONFIG),
+            ("livello", gray[2], DIGITS_CONFIG), ("logo", colour, DEFAULT_CONFIG)]
+
+
+class BatchParityTest(unittest.TestCase):
+    def per_field(self, backend, items):
+        return {key: backend.image_to_string(image, config) for key, image, config in items}
+
+    def test_tesserocr_batch_matches_per_field(self):
+        with mock.patch.dict(sys.modules, tesserocr=stub_tesserocr):
+            backend = ocr_backend.TesserocrBackend()
+        items = crops()
+        self.assertEqual(backend.image_to_strings(items), self.per_field(backend, items))
+
+    def test_pytesseract_batch_matches_per_field(self):
+        with mock.patch.dict(sys.modules, pytesseract=stub_pytesseract):
+            backend = ocr_backend.PytesseractBackend()
+        items = crops()
+        self.assertEqual(backend.image_to_strings(items), self.per_field(backend, items))
+
+    def test_compose_rejects_colour_crops(self):
+        with self.assertRaises(ValueError):
+            ocr_backend.compose([crops()[3][1]])
+
+
+class CountingEngine(OcrBackend):
+    name = "stub"
+    batches = True
+
+    def __init__(self):
+        self.calls = []
+
+    def image_to_string(self, image, config=DEFAULT_CONFIG):
+        self.calls.append("field")
+        return "per-field"
+
+    def image_to_strings(self, items):
+        self.calls.append("batch")
+        return {key: "batched" for key, _, _ in items}
+
+
+class CachedBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = CountingEngine()
+        self.backend = CachedBackend(self.engine, ResultCache())
+
+    def test_batched_texts_are_not_served_per_field(self):
+        items = crops()
+        self.backend.image_to_strings(items)
+        self.assertEqual(self.backend.image_to_string(items[0][1], items[0][2]), "per-field")
+        self.assertEqual(self.engine.calls, ["batch", "field"])
+
+    def test_engine_calls_counts_config_groups(self):
+        before = tracing.counters().get("ocr_engine_calls", 0)
+        self.backend.image_to_strings(crops())
+        # two configs of 2-D crops in the composite + the colour crop on its own
+        self.assertEqual(tracing.counters()["ocr_engine_calls"] - before, 3)
+        self.backend.image_to_strings(crops())
+        self.assertEqual(tracing.counters()["ocr_engine_calls"] - before, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
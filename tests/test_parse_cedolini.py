@@ -0,0 +1,71 @@
+# tests/test_parse_cedolini.py — page streaming of the LUL text parser
+#
+#     uv run -m unittest discover tests
+from dataclasses import replace
+from pathlib import Path
+import sys
+import unittest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from requirements import parse_cedolini
+
+HEADER = "AZIENDA ROSSI SRL\nCODICE FISCALE 01234567890\nMESE RETRIBUITO Luglio 2025\n\n"
+CFS = ["RSSMRA80A01H501Z", "VRDLGI75B02F205X", "BNCNNA90C43L219Y", "NREPLA85D04A944W"]
+
+
+def employee(i):
+    return (f"DIPENDENTE MARIO ROSSI{i} QUALIFICA Operaio\nCODICE FISCALE {CFS[i % len(CFS)]}\n"
+            f"TOTALE COMPETENZE 1.169,62\nNETTO IN BUSTA 1.012,00\nPRESENZE FE FE ROL\n\n")
+
+
+class PageStreamingTest(unittest.TestCase):
+    def pages(self, header=HEADER, n_pages=3, per_page=3):
+        return [(header if n == 0 else "") + "".join(employee(n * per_page + i) for i in range(per_page)) + "\f"
+                for n in range(n_pages)]
+
+    def stream(self, pages):
+        # (pages read so far, record) for every record, in output order
+        read = []
+
+        def source():
+            for page in pages:
+                read.append(page)
+                yield page
+
+        return [(len(read), rec) for rec in parse_cedolini.iter_text_records(source(), "LUL_2025_07.pdf")]
+
+    def test_missing_company_field_does_not_hold_records(self):
+        # no "PARTITA IVA" line: azienda_piva never gets its primary pattern
+        out = self.stream(self.pages())
+        self.assertEqual(len(out), 9)
+        # every block comes out as soon as the next one starts, not at the end of the document:
+        # two after page 1, three after page 2 (the last block of page 1 included), the rest at the end
+        self.assertEqual([n for n, _ in out], [1, 1, 2, 2, 2, 3, 3, 3, 3])
+        first = out[0][1]
+        self.assertIsNone(first.azienda_piva)
+        self.assertEqual((first.azienda_denominazione, first.mese_retribuito, first.anno),
+                         ("ROSSI SRL", "Luglio", 2025))
+        self.assertEqual(first.totale_competenze, 116962)
+        self.assertEqual(first.presence("FE"), 2)
+
+    def test_same_records_as_whole_text(self):
+        pages = self.pages(header=HEADER + "PARTITA IVA 01234567890\n")
+        whole = parse_cedolini.parse_text("".join(pages), Path("LUL_2025_07.pdf"))
+        self.assertEqual([rec for _, rec in self.stream(pages)], whole)
+        self.assertEqual(whole[0].azienda_piva, "01234567890")
+
+    def test_company_field_after_company_pages_stays_empty(self):
+        # fields are fixed after COMPANY_PAGES pages: a PARTITA IVA first printed on page 2 is
+        # not picked up (the whole-text parse finds it), so records never wait past page 1
+        pages = self.pages()
+        pages[1] = "PARTITA IVA 01234567890\n" + pages[1]
+        out = self.stream(pages)
+        self.assertEqual([n for n, _ in out], [1, 1, 2, 2, 2, 3, 3, 3, 3])
+        self.assertEqual({rec.azienda_piva for _, rec in out}, {None})
+        whole = parse_cedolini.parse_text("".join(pages), Path("LUL_2025_07.pdf"))
+        self.assertEqual(whole[0].azienda_piva, "01234567890")
+        self.assertEqual([rec for _, rec in out], [replace(rec, azienda_piva=None) for rec in whole])
+
+
+if __name__ == "__main__":
+    unittest.main()
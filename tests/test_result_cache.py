@@ -0,0 +1,61 @@
+# tests/test_result_cache.py — SQLite tier of the result cache: size accounting, LRU eviction
+#
+#     uv run -m unittest discover tests
+from pathlib import Path
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from result_cache import ResultCache
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = str(Path(self.tmp.name) / "cache.sqlite")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def open(self, **kwargs):
+        cache = ResultCache(self.path, memory_items=0, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    def rows(self):
+        with sqlite3.connect(self.path) as db:
+            return dict(db.execute("SELECT key, last_access FROM results"))
+
+    def test_overwrites_keep_disk_size_exact(self):
+        cache = self.open()
+        for i in range(100):
+            cache.set("k", "x" * (i % 7))
+        with sqlite3.connect(self.path) as db:
+            self.assertEqual(cache._disk_bytes, db.execute("SELECT SUM(size) FROM results").fetchone()[0])
+
+    def test_eviction_drops_least_recently_used(self):
+        payload = "x" * 98  # 100 bytes as JSON
+        cache = self.open(max_disk_bytes=1000)
+        for i in range(9):
+            cache.set(f"k{i}", payload)
+        cache.get("k0")  # k0 becomes the most recently used
+        cache.set("k9", payload)
+        cache.set("k10", payload)  # 1100 bytes > budget: down to 900
+        self.assertEqual(set(self.rows()), {"k0", *(f"k{i}" for i in range(3, 11))})
+        self.assertEqual(cache.get("k0"), payload)
+        self.assertIsNone(cache.get("k1"))
+
+    def test_hits_are_written_in_one_batch(self):
+        cache = self.open()
+        cache.set("a", 1)
+        before = self.rows()["a"]
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(self.rows()["a"], before)  # no write per hit
+        cache.flush()
+        self.assertGreater(self.rows()["a"], before)
+
+
+if __name__ == "__main__":
+    unittest.main()
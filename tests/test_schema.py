@@ -0,0 +1,62 @@
+# tests/test_schema.py — amounts in cents and the flat form of PayslipRecord
+#
+#     uv run -m unittest discover tests
+from pathlib import Path
+import sys
+import unittest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from requirements.parse_cedolini import euro_to_float
+from schema import AMOUNT_FIELDS, RECORD_COLUMNS, PayslipRecord, sample_fields, to_cents, to_euros
+
+AMOUNTS = ["1.169,62", "€ 1.169,62-", "-23,46", "0,01", "1.000", "1 234,5", "\xa01.012,00",
+           "IMPORTO 3 10,00", "65,16", "100.000,99"]
+
+
+class CentsTest(unittest.TestCase):
+    def test_text_amounts(self):
+        self.assertEqual(to_cents("1.169,62"), 116962)
+        self.assertEqual(to_cents("€ 1.169,62-"), 116962)  # last number, trailing sign ignored
+        self.assertEqual(to_cents("-23,46"), -2346)
+        for value in ("", None, "abc", "€"):
+            self.assertIsNone(to_cents(value))
+
+    def test_same_value_as_euro_to_float(self):
+        for text in AMOUNTS:
+            with self.subTest(text=text):
+                self.assertEqual(to_euros(to_cents(text)), euro_to_float(text))
+
+    def test_numbers(self):
+        self.assertEqual(to_cents(12), 1200)
+        self.assertEqual(to_cents(1169.62), 116962)
+        self.assertEqual(to_cents(0.1 + 0.2), 30)
+        self.assertIsNone(to_euros(None))
+        self.assertEqual(to_euros(116962), 1169.62)
+
+    def test_sums_are_exact(self):
+        self.assertEqual(sum(to_cents("0,10") for _ in range(10)), to_cents("1,00"))
+
+
+class RecordTest(unittest.TestCase):
+    def test_flat_form_round_trip(self):
+        fields = sample_fields(7)
+        rec = PayslipRecord.from_fields(fields)
+        flat = rec.to_dict()
+        self.assertEqual(list(flat), list(RECORD_COLUMNS))
+        self.assertEqual(flat["anno"], 2025)
+        for name in AMOUNT_FIELDS:
+            self.assertEqual(flat[name], round(fields[name], 2))
+        self.assertEqual(PayslipRecord.from_fields(flat), rec)
+
+    def test_aliases_and_extra(self):
+        rec = PayslipRecord.from_fields({"netto_in_busta": "1.012,00", "codice_fiscale": "RSSMRA80A01H501U",
+                                         "occ_FE": 3, "posizione_inail": "123", "_errors": {"x": "e"}})
+        self.assertEqual(rec.netto_a_pagare, 101200)
+        self.assertEqual(rec.get("netto_in_busta"), 1012.0)
+        self.assertEqual(rec.dipendente_cf, "RSSMRA80A01H501U")
+        self.assertEqual(rec.presence("FE"), 3)
+        self.assertEqual(rec.extra, {"posizione_inail": "123"})
+
+
+if __name__ == "__main__":
+    unittest.main()
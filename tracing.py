@@ -0,0 +1,311 @@
+# tracing.py — per-stage timing spans, counters and per-document profiling
+#
+#     with tracing.document(pdf_path):               # one "document" span + counters of that document
+#         with tracing.span("render", page=1, field="anno"):
+#             ...
+#         tracing.count("ocr_calls")
+#
+# Disabled unless TRACE_FILE is set (the scripts' --trace option does it): span() then
+# returns a shared no-op context manager and count() only bumps an in-process dict.
+# Enabled, every span becomes one JSON line {"stage", "ms", "doc", "page", "field", ...,
+# "parent", "pid"}; document spans also carry the counters incremented while they ran.
+# Lines are buffered per process and appended to the file at the end of every document,
+# so pool workers (which inherit the environment) all write to the same trace.
+#
+#   TRACE_PROFILE=dir   cProfile every document, dir/<document>.prof (pstats / snakeviz)
+#   TRACE_MALLOC=1      tracemalloc per document: peak and net allocated KiB on its span
+#
+# Summary table (per stage: count, total, mean, p50, p95, max) and counter totals:
+#
+#     uv run tracing.py trace.jsonl
+from pathlib import Path
+import argparse
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+_UNSET = object()
+_counters = {}
+_local = threading.local()
+_lock = threading.Lock()
+_state = _UNSET  # _Tracer or None (disabled), read from the environment once per process
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL = _NullSpan()
+
+
+class _Tracer:
+    def __init__(self, path, profile_dir=None, malloc=False):
+        self.path = path
+        self.profile_dir = profile_dir
+        self.malloc = malloc
+        self.pid = os.getpid()
+        self.lines = []
+        atexit.register(self.flush)
+
+    def emit(self, record):
+        self.lines.append(json.dumps(record, ensure_ascii=False, default=str))
+        if len(self.lines) >= 1000:
+            self.flush()
+
+    def flush(self):
+        with _lock:
+            lines, self.lines = self.lines, []
+        if lines:
+            # one O_APPEND write per batch: lines from several processes do not interleave
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, ("\n".join(lines) + "\n").encode("utf-8"))
+            finally:
+                os.close(fd)
+
+
+def _tracer():
+    global _state
+    if _state is _UNSET:
+        path = os.environ.get("TRACE_FILE")
+        _state = _Tracer(path, os.environ.get("TRACE_PROFILE"), os.environ.get("TRACE_MALLOC") == "1") if path else None
+    return _state
+
+
+def _after_fork():
+    # forked worker: its own buffer and span stack, never the parent's lines a second time
+    global _state
+    _state = _UNSET
+    _local.stack = []
+
+
+if hasattr(os, "register_at_fork"):  # POSIX; Windows workers are spawned, not forked
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def enabled():
+    return _tracer() is not None
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class Span:
+    def __init__(self, tracer, stage, attrs):
+        self.tracer = tracer
+        self.stage = stage
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        # attributes known only inside the span (records found, rows written, ...)
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = _stack()
+        self.parent = stack[-1] if stack else None
+        self.doc = self.attrs.pop("doc", None) or (self.parent.doc if self.parent else None)
+        if self.parent is not None:
+            for key in ("page", "field"):
+                if key not in self.attrs and key in self.parent.attrs:
+                    self.attrs[key] = self.parent.attrs[key]
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ms = (time.perf_counter() - self.start) * 1000
+        _stack().pop()
+        record = {"stage": self.stage, "ms": round(ms, 3), "doc": self.doc, **self.attrs,
+                  "parent": self.parent.stage if self.parent else None, "pid": self.tracer.pid}
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        self.tracer.emit(record)
+        return False
+
+
+def span(stage, **attrs):
+    # attrs: page=, field=, anything JSON-serialisable; doc, page and field are inherited
+    # from the enclosing span
+    tracer = _tracer()
+    if tracer is None:
+        return _NULL
+    return Span(tracer, stage, attrs)
+
+
+def count(name, n=1):
+    _counters[name] = _counters.get(name, 0) + n
+
+
+def counters():
+    return dict(_counters)
+
+
+class _Document(Span):
+    def __enter__(self):
+        self.before = dict(_counters)
+        # profiling hooks only on the outermost document (one profiler can be active at a time)
+        self.profiler = None
+        root = not _stack()
+        if root and self.tracer.profile_dir:
+            import cProfile
+            self.profiler = cProfile.Profile()
+        self.malloc = root and self.tracer.malloc
+        if self.malloc:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.malloc_start = tracemalloc.get_traced_memory()[0]
+        super().__enter__()
+        if self.profiler:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.profiler:
+            self.profiler.disable()
+            out = Path(self.tracer.profile_dir)
+            out.mkdir(parents=True, exist_ok=True)
+            self.profiler.dump_stats(out / f"{Path(str(self.doc)).name}.{self.tracer.pid}.prof")
+        if self.malloc:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            self.attrs.update(malloc_peak_kb=round((peak - self.malloc_start) / 1024),
+                              malloc_net_kb=round((current - self.malloc_start) / 1024))
+        delta = {k: v - self.before.get(k, 0) for k, v in _counters.items() if v != self.before.get(k, 0)}
+        if delta:
+            self.attrs["counters"] = delta
+        super().__exit__(exc_type, exc, tb)
+        if self.parent is None:
+            self.tracer.flush()
+        return False
+
+
+def document(doc, **attrs):
+    # root span of one input document (path or id); profiling hooks apply here. Inside
+    # another document span it is a no-op: the outer one already times and counts it
+    tracer = _tracer()
+    if tracer is None or any(isinstance(sp, _Document) for sp in _stack()):
+        return _NULL
+    return _Document(tracer, "document", {"doc": str(doc), **attrs})
+
+
+def flush():
+    tracer = _tracer()
+    if tracer is not None:
+        tracer.flush()
+
+
+# --- configuration from the command line ---
+
+def configure(path, profile_dir=None, malloc=False):
+    # through the environment, so that pool workers started afterwards trace too;
+    # the trace file is truncated: one file per run
+    global _state
+    Path(path).write_text("")
+    os.environ["TRACE_FILE"] = str(path)
+    for name, value in (("TRACE_PROFILE", profile_dir), ("TRACE_MALLOC", "1" if malloc else None)):
+        if value:
+            os.environ[name] = str(value)
+        else:
+            os.environ.pop(name, None)
+    _state = _UNSET
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("tracing")
+    group.add_argument("--trace", metavar="FILE", help="write per-stage timing spans as JSON lines and print a summary")
+    group.add_argument("--profile", metavar="DIR", help="with --trace: cProfile every document into DIR")
+    group.add_argument("--tracemalloc", action="store_true", help="with --trace: peak memory per document")
+
+
+def from_args(args):
+    if args.trace:
+        configure(args.trace, args.profile, args.tracemalloc)
+
+
+def finish(args, file=None):
+    # end of a run started with from_args(): flush and print the summary
+    if args.trace:
+        flush()
+        print_summary(args.trace, file)
+
+
+# --- summary ---
+
+def read_trace(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, round(q / 100 * (len(sorted_values) - 1)))]
+
+
+def summarize(records):
+    # {stage: {count, total_ms, mean_ms, p50_ms, p95_ms, max_ms, errors}}, counters summed over documents
+    by_stage, totals = {}, {}
+    for rec in records:
+        by_stage.setdefault(rec["stage"], []).append(rec)
+        for name, n in rec.get("counters", {}).items():
+            totals[name] = totals.get(name, 0) + n
+    stages = {}
+    for stage, recs in by_stage.items():
+        values = sorted(r["ms"] for r in recs)
+        stages[stage] = {
+            "count": len(values),
+            "total_ms": sum(values),
+            "mean_ms": sum(values) / len(values),
+            "p50_ms": _percentile(values, 50),
+            "p95_ms": _percentile(values, 95),
+            "max_ms": values[-1],
+            "errors": sum(1 for r in recs if "error" in r),
+        }
+    return dict(sorted(stages.items(), key=lambda kv: -kv[1]["total_ms"])), totals
+
+
+def print_summary(path, file=None):
+    file = file or sys.stdout
+    stages, totals = summarize(read_trace(path))
+    # nested stages are included in their parents' time (document contains everything)
+    print(f"\n{'stage':<16}{'count':>8}{'total s':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}", file=file)
+    for stage, s in stages.items():
+        print(f"{stage:<16}{s['count']:>8}{s['total_ms'] / 1000:>10.2f}{s['mean_ms']:>10.2f}"
+              f"{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['max_ms']:>10.2f}"
+              + (f"   {s['errors']} errors" if s["errors"] else ""), file=file)
+    for name, n in sorted(totals.items()):
+        print(f"  {name:<24} {n}", file=file)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Summarise a JSON-lines trace written with --trace")
+    ap.add_argument("trace")
+    ap.add_argument("--stage", help="only list the slowest spans of this stage")
+    ap.add_argument("--top", type=int, default=10)
+    args = ap.parse_args()
+    if args.stage:
+        recs = sorted((r for r in read_trace(args.trace) if r["stage"] == args.stage), key=lambda r: -r["ms"])
+        for rec in recs[:args.top]:
+            print(json.dumps(rec, ensure_ascii=False))
+        return
+    print_summary(args.trace)
+
+
+if __name__ == "__main__":
+    main()
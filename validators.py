@@ -0,0 +1,30 @@
+# validators.py — format checks for extracted field values
+#
+# Used to decide whether a value read from the PDF text layer (or OCR'd at low
+# resolution) can be trusted, or the field has to go through (higher dpi) OCR again.
+import re
+
+MONTHS = ["Gennaio", "Febbraio", "Marzo", "Aprile", "Maggio", "Giugno",
+          "Luglio", "Agosto", "Settembre", "Ottobre", "Novembre", "Dicembre"]
+
+FORMATS = {
+    # codice fiscale of a person (16 chars) or of a company (11 digits, same as the P.IVA)
+    "cf": re.compile(r"[A-Z]{6}\d{2}[A-Z]\d{2}[A-Z]\d{3}[A-Z]|\d{11}"),
+    "digits": re.compile(r"\d+"),
+    "amount": re.compile(r"-?(?:\d{1,3}(?:\.\d{3})+|\d+),\d{2}"),
+    "date": re.compile(r"(?:0?[1-9]|[12]\d|3[01])/(?:0?[1-9]|1[0-2])/(?:19|20)\d{2}"),
+    "month": re.compile("|".join(MONTHS), re.IGNORECASE),
+    "year": re.compile(r"(?:19|20)\d{2}"),
+    "text": re.compile(r".*\w.*", re.DOTALL),
+}
+
+
+def field_format(field):
+    # explicit "format" key, otherwise digits for int fields and free text for the rest
+    return field.get("format") or ("digits" if field.get("type") == int else "text")
+
+
+def is_valid(field, text):
+    if not text:
+        return False
+    return FORMATS[field_format(field)].fullmatch(text.strip()) is not None